@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load benchmark for the unified server
+Drives story generation and static/health routes at the same time and
+reports throughput and latency percentiles for each group of routes.
+
+Story requests use "fresh": true, so against a server with a real API key
+every story request is a paid model call. With --offline the benchmark
+instead runs the server in-process against fake_anthropic.py, so nothing
+leaves the machine.
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import fake_anthropic
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# Configuration
+BASE_URL = 'http://localhost:8080'
+TIMEOUT = 60  # seconds
+BUSY_BACKOFF = 0.5  # seconds a story client waits after a 429/503, like a person retrying
+STATIC_PATHS = [
+    '/',
+    '/styles.css',
+    '/js/modules/reading-game-ui.js',
+    '/images/bg-level-1-safari.jpg',
+    '/api/health',
+]
+
+
+def timed_request(url, payload=None):
+    """Send one request and return (status, seconds). Status 0 means no response."""
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    req = urllib.request.Request(url, data=data)
+    if data is not None:
+        req.add_header('Content-Type', 'application/json')
+
+    start_time = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=TIMEOUT) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        status = e.code
+    except Exception:
+        status = 0
+    return status, time.perf_counter() - start_time
+
+
+def timed_stream_request(url, payload):
+    """
+    Stream one story and return (status, seconds to first event, seconds).
+    An error event counts as status 503 because it is how the stream
+    reports a busy or failing server once the response has started.
+    """
+    req = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'))
+    req.add_header('Content-Type', 'application/json')
+
+    start_time = time.perf_counter()
+    first_event = None
+    try:
+        with urllib.request.urlopen(req, timeout=TIMEOUT) as response:
+            status = response.status
+            for line in response:
+                if first_event is None:
+                    first_event = time.perf_counter() - start_time
+                if json.loads(line).get('type') == 'error':
+                    status = 503
+    except urllib.error.HTTPError as e:
+        e.read()
+        status = e.code
+    except Exception:
+        status = 0
+    elapsed = time.perf_counter() - start_time
+    return status, first_event if first_event is not None else elapsed, elapsed
+
+
+def story_payload(name):
+    """Return the body of a fresh Pre-K tiny story request."""
+    return {
+        'gradeLevel': 'Pre-K',
+        'length': 'tiny',
+        'prompt': f'benchmark story {name}',
+        'random': False,
+        'fresh': True
+    }
+
+
+def time_story_after_idle(base_url, idle):
+    """Return (status, seconds) of a story requested idle seconds after the one before it."""
+    timed_request(f'{base_url}/api/generate-story', story_payload('before idle'))
+    time.sleep(idle)
+    return timed_request(f'{base_url}/api/generate-story', story_payload('after idle'))
+
+
+def story_worker(base_url, worker_id, deadline, results, stream=False):
+    """Request fresh stories back to back until the deadline."""
+    count = 0
+    while time.perf_counter() < deadline:
+        payload = story_payload(f'{worker_id}-{count}')
+        if stream:
+            status, first_seconds, seconds = timed_stream_request(f'{base_url}/api/generate-story/stream', payload)
+            results['first'].append((status, first_seconds))
+        else:
+            status, seconds = timed_request(f'{base_url}/api/generate-story', payload)
+        results['story'].append((status, seconds))
+        count += 1
+        if status in (429, 503):
+            time.sleep(BUSY_BACKOFF)
+
+
+def static_worker(base_url, deadline, results):
+    """Cycle through the static and health routes until the deadline."""
+    count = 0
+    while time.perf_counter() < deadline:
+        path = STATIC_PATHS[count % len(STATIC_PATHS)]
+        results.append(timed_request(f'{base_url}{path}'))
+        count += 1
+
+
+def percentile(values, pct):
+    """Return the pct-th percentile of values (nearest rank)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def run_load(base_url, story_concurrency, static_concurrency, duration, stream=False):
+    """
+    Run story and static workers together for duration seconds. When
+    streaming, the 'first' group holds the time to each story's first event.
+    """
+    deadline = time.perf_counter() + duration
+    results = {'story': [], 'first': [], 'static': []} if stream else {'story': [], 'static': []}
+    threads = []
+
+    for worker_id in range(story_concurrency):
+        threads.append(threading.Thread(
+            target=story_worker, args=(base_url, worker_id, deadline, results, stream)
+        ))
+    for _ in range(static_concurrency):
+        threads.append(threading.Thread(
+            target=static_worker, args=(base_url, deadline, results['static'])
+        ))
+
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start_time
+
+
+def start_offline_server(args):
+    """
+    Start a fake Anthropic backend and the server in this process.
+    Returns (base_url, backend). Story data goes to a temporary directory.
+    """
+    backend = fake_anthropic.FakeAnthropicServer(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        cache_min_tokens=args.cache_min_tokens,
+        prefill_tokens_per_second=args.prefill_tokens_per_second,
+        connect_latency=args.connect_latency
+    ).start()
+
+    # The server reads its configuration when it is imported
+    os.environ.update({
+        'ANTHROPIC_API_KEY': 'offline-benchmark',
+        'ANTHROPIC_BASE_URL': backend.url,
+        'DATA_DIR': tempfile.mkdtemp(prefix='bench-api-'),
+        'LIVE_RELOAD_PORT': '0'
+    })
+    # Every story client comes from this one address
+    os.environ.setdefault('STORY_RATE_PER_MINUTE', '0')
+    import server
+    from waitress import create_server
+
+    # Per-request info logging would dominate the benchmark output
+    logging.getLogger().setLevel(logging.WARNING)
+    server.upstream_http.start()  # As server.py's startup does
+
+    httpd = create_server(server.app, host='127.0.0.1', port=0,
+                          threads=server.SERVER_THREADS + server.STORY_WORKERS)
+    threading.Thread(target=httpd.run, daemon=True).start()
+    return f'http://127.0.0.1:{httpd.effective_port}', backend
+
+
+def print_report(results, elapsed):
+    """Print throughput and latency percentiles for each route group."""
+    print("\n" + "="*60)
+    print(f"Results ({elapsed:.1f}s)")
+    print("="*60)
+    print(f"{'group':<8} {'requests':>8} {'ok':>6} {'busy':>6} {'errors':>6} "
+          f"{'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+
+    for group, samples in results.items():
+        ok = [seconds for status, seconds in samples if 200 <= status < 400]
+        busy = sum(1 for status, _ in samples if status in (429, 503))
+        errors = len(samples) - len(ok) - busy
+        print(f"{group:<8} {len(samples):>8} {len(ok):>6} {busy:>6} {errors:>6} "
+              f"{len(samples) / elapsed:>7.1f} "
+              f"{percentile(ok, 50) * 1000:>8.1f} "
+              f"{percentile(ok, 95) * 1000:>8.1f} "
+              f"{percentile(ok, 99) * 1000:>8.1f}")
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description='Load benchmark for the Family Dashboard server')
+    parser.add_argument('--url', default=BASE_URL, help=f'server base URL (default {BASE_URL})')
+    parser.add_argument('--story-concurrency', type=int, default=4,
+                        help='parallel clients requesting stories (default 4)')
+    parser.add_argument('--static-concurrency', type=int, default=4,
+                        help='parallel clients requesting static files and health (default 4)')
+    parser.add_argument('--duration', type=float, default=20,
+                        help='seconds to run (default 20)')
+    parser.add_argument('--stream', action='store_true',
+                        help='request stories from the streaming endpoint')
+    parser.add_argument('--idle', type=float, default=0,
+                        help='first time one story requested after this many idle seconds (default 0, off)')
+    parser.add_argument('--offline', action='store_true',
+                        help='run the server in-process against a local fake Anthropic API')
+    offline = parser.add_argument_group('offline backend (with --offline)')
+    fake_anthropic.add_backend_arguments(offline)
+    args = parser.parse_args()
+
+    backend = None
+    if args.offline:
+        args.url, backend = start_offline_server(args)
+
+    print("\n" + "="*60)
+    print("Family Dashboard Load Benchmark")
+    print("="*60)
+    print(f"Server: {args.url}" + (" (offline)" if backend else ""))
+    if backend:
+        print(f"Fake API: {args.latency}s latency, {args.tokens_per_second} tokens/s, "
+              f"error rate {args.error_rate:.0%} ({args.error_status})")
+    print(f"Story clients: {args.story_concurrency}, static clients: {args.static_concurrency}"
+          + (" (streaming)" if args.stream else ""))
+    print(f"Duration: {args.duration:.0f}s")
+
+    if args.idle:
+        status, seconds = time_story_after_idle(args.url, args.idle)
+        print(f"\nStory after {args.idle:.0f}s idle: {seconds * 1000:.1f} ms (status {status})")
+
+    results, elapsed = run_load(args.url, args.story_concurrency, args.static_concurrency,
+                                args.duration, args.stream)
+    print_report(results, elapsed)
+
+    if backend:
+        stats = backend.stats()
+        print(f"\nFake API: {stats['requests']} requests over {stats['connections']} connections, "
+              f"{stats['errors']} injected errors, "
+              f"{stats['input_tokens']} input / {stats['output_tokens']} output tokens, "
+              f"{stats['cache_read_input_tokens']} read from / {stats['cache_creation_input_tokens']} "
+              f"written to the prompt cache")
+
+
+if __name__ == '__main__':
+    main()
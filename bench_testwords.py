@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark for test word post-processing
+Compares choose_test_words, which indexes a story's words once and picks
+test words ranked with the grade word lists, with the previous
+per-sentence select_test_word scan, on generated 80-sentence stories.
+The stories are processed whole, as replies are, and one sentence at a
+time, as streamed ones are. The whole stage is timed too, as that is
+what the index is for: it tokenizes each sentence once for its test word
+and its scores, where the previous stage scored each sentence from its
+text again, so its test word time includes splitting the words scored.
+
+Nothing is sent to the Anthropic API; the stories are made up locally.
+"""
+
+import argparse
+import io
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# The server reads its configuration when it is imported
+os.environ.setdefault('ANTHROPIC_API_KEY', 'offline-benchmark')
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='bench-testwords-')
+os.environ['LIVE_RELOAD_PORT'] = '0'
+import server  # noqa: E402
+
+# Configuration
+SENTENCES = 80
+GRADE_LEVEL = '4th'
+THEME_WORDS = ['dragon', 'castle', 'treasure', 'mermaid', 'rocket', 'forest', 'wizard', 'island',
+               'submarine', 'volcano', 'lantern', 'compass', 'unicorn', 'thunderstorm', 'adventure',
+               'garden', 'pirate', 'jungle', 'meadow', 'planet', 'comet', 'bakery', 'library',
+               'waterfall', 'penguin', 'octopus', 'kitten', 'blanket', 'feather', 'bicycle',
+               'mountain', 'river', 'canyon', 'cookie', 'telescope', 'ladder', 'bridge', 'tunnel',
+               'harbor', 'village', 'crystal', 'puzzle', 'rainbow', 'snowflake', 'balloon',
+               'whistle', 'basket', 'cottage', 'spaceship', 'sandcastle']
+VERBS = ['discovered', 'carried', 'painted', 'followed', 'whispered to', 'searched for', 'built']
+FRIENDS = ['Maya', 'the pirate', 'a clever fox', 'Grandpa', 'the tiny robot']
+
+
+def make_story(sentence_count, rng):
+    """Return (title, sentences) with the quotes, semicolons and possessives real stories have."""
+    sentences = []
+    for _ in range(sentence_count):
+        theme = rng.choice(THEME_WORDS)
+        other = rng.choice(THEME_WORDS)
+        text = rng.choice([
+            f'{rng.choice(FRIENDS).capitalize()} {rng.choice(VERBS)} the {theme} near the {other}.',
+            f'"Look at the {theme}!" shouted {rng.choice(FRIENDS)}; everyone ran to the {other}.',
+            f"The {theme}'s shadow was long, and it didn't move past the old {other}.",
+            f'Then the {theme} and the {other} were gone, as if by magic!',
+        ])
+        sentences.append({'text': text, 'testWord': theme})
+    return 'The Benchmark Adventure', sentences
+
+
+def legacy_select_test_word(sentence, grade_level, used_words):
+    """select_test_word as it was before the word index, for comparison."""
+    words = sentence.replace('.', '').replace(',', '').replace('!', '').replace('?', '').split()
+
+    max_length = server.GRADE_CONFIGS[grade_level]['max_word_length']
+    suitable_words = [
+        word for word in words
+        if 3 <= len(word) <= max_length
+        and word.lower() not in used_words
+        and word.isalpha()
+    ]
+    if not suitable_words:
+        suitable_words = [word for word in words if word.isalpha() and word.lower() not in used_words]
+    if not suitable_words:
+        suitable_words = [word for word in words if word.isalpha()]
+    return suitable_words[0] if suitable_words else words[0]
+
+
+def legacy_process_sentences(sentences, grade_level, used_words, start=0, scored=False):
+    """process_sentence as it was before the word index, applied to each sentence."""
+    processed = []
+    for index, sentence_obj in enumerate(sentences, start):
+        text = sentence_obj.get('text', '')
+        test_word = sentence_obj.get('testWord', '')
+        if not test_word or test_word.lower() not in text.lower():
+            test_word = legacy_select_test_word(text, grade_level, used_words)
+            server.testword_fallbacks.inc(reason='invalid')
+            server.logger.warning(f"Sentence {index+1}: Invalid testWord, selected '{test_word}' as fallback")
+        if test_word.lower() in used_words:
+            test_word = legacy_select_test_word(text, grade_level, used_words)
+            server.testword_fallbacks.inc(reason='duplicate')
+            server.logger.warning(f"Sentence {index+1}: Duplicate testWord, selected '{test_word}' as alternative")
+        used_words.add(test_word.lower())
+        include_test = grade_level != '4th' or index % 2 == 0
+        processed.append({'text': text, 'testWord': test_word if include_test else None})
+        if scored:
+            processed[-1]['scores'] = server.score_sentence(text, processed[-1]['testWord'], grade_level)
+            server.speech.queue(processed[-1])
+    return processed
+
+
+def index_process_sentences(sentences, index):
+    """The test word part of process_sentences, to compare with the legacy one."""
+    start = len(index)
+    index.add([s.get('text', '') for s in sentences])
+    test_words = server.choose_test_words(index, sentences, start)
+    return [{'text': s.get('text', ''), 'testWord': word if index.grade_level != '4th' or i % 2 == 0 else None}
+            for i, (s, word) in enumerate(zip(sentences, test_words), start)]
+
+
+def scenario_stories(scenario, count, rng):
+    """
+    Return count stories for a scenario: 'valid' and 'streamed' keep the
+    model's test words, 'missing' drops them all and 'repeated' uses the
+    same one in every sentence, so every sentence needs a fallback.
+    """
+    stories = []
+    for _ in range(count):
+        _, sentences = make_story(SENTENCES, rng)
+        if scenario == 'missing':
+            sentences = [{'text': s['text'], 'testWord': ''} for s in sentences]
+        elif scenario == 'repeated':
+            sentences = [{'text': s['text'], 'testWord': 'the'} for s in sentences]
+        stories.append(sentences)
+    return stories
+
+
+def legacy_story(sentences, chunk, scored=False):
+    """Process a story with the legacy functions, chunk sentences at a time."""
+    used_words = set()
+    processed = []
+    for start in range(0, len(sentences), chunk):
+        processed.extend(legacy_process_sentences(sentences[start:start + chunk], GRADE_LEVEL, used_words,
+                                                  start, scored))
+    return processed
+
+
+def index_story(sentences, chunk, process=index_process_sentences):
+    """Process a story through one StoryWordIndex, chunk sentences at a time."""
+    index = server.StoryWordIndex(GRADE_LEVEL)
+    processed = []
+    for start in range(0, len(sentences), chunk):
+        processed.extend(process(sentences[start:start + chunk], index))
+    return processed
+
+
+def legacy_scored_story(sentences, chunk):
+    """Process and score a story with the legacy functions."""
+    return legacy_story(sentences, chunk, scored=True)
+
+
+def scored_story(sentences, chunk):
+    """Process and score a story with process_sentences."""
+    return index_story(sentences, chunk, server.process_sentences)
+
+
+def time_stories(process, stories, repeats, chunk):
+    """Return (best milliseconds per story over repeats runs, chosen words of every story)."""
+    best = None
+    for _ in range(repeats):
+        chosen = []
+        start_time = time.perf_counter()
+        for sentences in stories:
+            chosen.append([s['testWord'] for s in process(sentences, chunk)])
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000 / len(stories), chosen
+
+
+def quality(chosen):
+    """Return (repeated test words, common-word test words, test words above the grade) summed over the stories."""
+    repeated = common = hard = 0
+    grade = server.word_levels.grades.index(GRADE_LEVEL)
+    for words in chosen:
+        words = [word.lower() for word in words if word]
+        repeated += len(words) - len(set(words))
+        common += sum(1 for word in words if word in server.COMMON_WORD_RANKS)
+        hard += sum(1 for word in words if server.word_levels.level(word) > grade)
+    return repeated, common, hard
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description='Benchmark test word post-processing')
+    parser.add_argument('--stories', type=int, default=200, help='stories per scenario (default 200)')
+    parser.add_argument('--repeats', type=int, default=5, help='runs per scenario, best is kept (default 5)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed (default 1)')
+    args = parser.parse_args()
+
+    # Fallbacks are logged, but writing the log isn't what is being measured
+    logging.disable(logging.WARNING)
+
+    print("\n" + "="*60)
+    print(f"Test word post-processing, {SENTENCES}-sentence {GRADE_LEVEL} grade stories")
+    print("="*60)
+    print(f"{'':<10} {'test words':^29} {'with scores':^29}")
+    print(f"{'scenario':<10} {'legacy ms':>10} {'index ms':>9} {'speedup':>8} "
+          f"{'legacy ms':>10} {'index ms':>9} {'speedup':>8} "
+          f"{'repeats':>13} {'common words':>13} {'above grade':>13}")
+
+    for scenario in ('valid', 'missing', 'repeated', 'streamed'):
+        stories = scenario_stories(scenario, args.stories, random.Random(args.seed))
+        chunk = 1 if scenario == 'streamed' else SENTENCES
+        legacy_ms, legacy_words = time_stories(legacy_story, stories, args.repeats, chunk)
+        index_ms, index_words = time_stories(index_story, stories, args.repeats, chunk)
+        legacy_scored_ms, _ = time_stories(legacy_scored_story, stories, args.repeats, chunk)
+        scored_ms, _ = time_stories(scored_story, stories, args.repeats, chunk)
+        legacy_repeats, legacy_common, legacy_hard = quality(legacy_words)
+        index_repeats, index_common, index_hard = quality(index_words)
+        print(f"{scenario:<10} {legacy_ms:>10.3f} {index_ms:>9.3f} {legacy_ms / index_ms:>7.1f}x "
+              f"{legacy_scored_ms:>10.3f} {scored_ms:>9.3f} {legacy_scored_ms / scored_ms:>7.1f}x "
+              f"{legacy_repeats:>5} -> {index_repeats:<5} {legacy_common:>5} -> {index_common:<5} "
+              f"{legacy_hard:>5} -> {index_hard:<5}")
+
+    print("\nstreamed: the valid stories, one sentence at a time; each batch costs a few microseconds,")
+    print("          next to the tenths of a second the model takes to write a sentence")
+    print("with scores: test words, sentence scores and queued audio, as process_sentences does")
+    print("repeats: test words used twice in a story; common words: test words from COMMON_WORDS;")
+    print("above grade: test words above the grade's word lists")
+
+
+if __name__ == '__main__':
+    main()
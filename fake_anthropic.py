@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Anthropic messages API
+Answers POST /v1/messages, with or without "stream": true, with a made-up
+story in the shape the story prompt asks for, as well as POST
+/v1/messages/count_tokens and GET /v1/models. Latency, output token rate,
+connection setup time, prompt caching and error injection are
+configurable, so the server can be benchmarked without network access or
+API spend.
+
+Run on its own and point the server at it:
+    python fake_anthropic.py --port 8090 --latency 1.0 --tokens-per-second 80
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8090 ANTHROPIC_API_KEY=offline python server.py
+
+bench_api.py --offline starts one automatically.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Configuration
+DEFAULT_PORT = 8090
+CHARS_PER_TOKEN = 4
+TOKENS_PER_DELTA = 4  # Output tokens sent in each streamed text delta
+CACHE_TTL = 300  # seconds a cached prompt prefix lives after its last use, like the API's default
+SYLLABLES = ['ba', 'ko', 'mi', 'su', 'te', 'lo', 'pa', 'ri', 'nu', 'de']
+
+ERROR_TYPES = {
+    429: 'rate_limit_error',
+    500: 'api_error',
+    529: 'overloaded_error',
+}
+
+
+def story_text(sentence_count, title='The Offline Adventure'):
+    """Return story JSON with sentence_count sentences, each with a unique testWord."""
+    sentences = []
+    for i in range(sentence_count):
+        word = SYLLABLES[i % 10] + SYLLABLES[i // 10 % 10] + (SYLLABLES[i // 100 % 10] if i >= 100 else '')
+        sentences.append({'text': f'The {word} ran to the big red hill.', 'testWord': word})
+    return json.dumps({'title': title, 'sentences': sentences}, indent=2)
+
+
+def outline_text(parts, title='The Offline Adventure'):
+    """Return a story plan with the given number of parts, for sectioned stories."""
+    return json.dumps({'title': title, 'sections': [f'Part {i + 1} of the adventure.' for i in range(parts)]})
+
+
+def prompt_text(body):
+    """Return all prompt text in a messages request, for counting input tokens."""
+    system = body.get('system', '')
+    if isinstance(system, list):
+        system = ''.join(block.get('text', '') for block in system)
+    parts = [system]
+    for message in body.get('messages', []):
+        content = message.get('content', '')
+        if isinstance(content, list):
+            content = ''.join(block.get('text', '') for block in content if isinstance(block, dict))
+        parts.append(content)
+    return ''.join(parts)
+
+
+def cached_prefix(body):
+    """
+    Return the system text up to the last block marked with cache_control,
+    which is the prefix the API would cache, or '' if nothing is marked.
+    """
+    system = body.get('system', '')
+    if not isinstance(system, list):
+        return ''
+    marked = [i for i, block in enumerate(system) if block.get('cache_control')]
+    if not marked:
+        return ''
+    return ''.join(block.get('text', '') for block in system[:marked[-1] + 1])
+
+
+class FakeAnthropicHandler(BaseHTTPRequestHandler):
+    """Handles /v1/messages requests for FakeAnthropicServer."""
+
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+
+    def setup(self):
+        # Runs once per connection; stands in for the TCP and TLS handshakes
+        super().setup()
+        self.server.count('connections')
+        if self.server.connect_latency:
+            time.sleep(self.server.connect_latency)
+
+    def do_GET(self):
+        if not self.path.startswith('/v1/models'):
+            self._send_json(404, {'type': 'error', 'error': {'type': 'not_found_error', 'message': 'Not found'}})
+            return
+        model = {'type': 'model', 'id': 'fake-model', 'display_name': 'Fake Model',
+                 'created_at': '2025-01-01T00:00:00Z'}
+        self._send_json(200, {'data': [model], 'has_more': False, 'first_id': 'fake-model', 'last_id': 'fake-model'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+
+        if not self.path.startswith('/v1/messages'):
+            self._send_json(404, {'type': 'error', 'error': {'type': 'not_found_error', 'message': 'Not found'}})
+            return
+        if self.path.startswith('/v1/messages/count_tokens'):
+            self._send_json(200, {'input_tokens': max(1, len(prompt_text(body)) // CHARS_PER_TOKEN)})
+            return
+
+        config = self.server
+        config.count('requests')
+        if random.random() < config.error_rate:
+            config.count('errors')
+            self._send_error(config.error_status)
+            return
+
+        prompt = prompt_text(body)
+        outline = re.search(r'EXACTLY (\d+) parts', prompt)
+        match = re.search(r'EXACTLY (\d+) sentences', prompt)
+        if outline:
+            text = outline_text(int(outline.group(1)))
+        else:
+            text = story_text(int(match.group(1)) if match else 10)
+        input_tokens = max(1, len(prompt) // CHARS_PER_TOKEN)
+        output_tokens = max(1, len(text) // CHARS_PER_TOKEN)
+        usage = config.cache_usage(cached_prefix(body), input_tokens)
+        usage['output_tokens'] = output_tokens
+        for name, count in usage.items():
+            config.count(name, count)
+
+        # Cached prompt tokens don't have to be read again before the first token
+        latency = config.latency
+        if config.prefill_tokens_per_second:
+            latency += (usage['input_tokens'] + usage['cache_creation_input_tokens']) / config.prefill_tokens_per_second
+        time.sleep(latency)
+        if body.get('stream'):
+            self._stream_message(body, text, usage)
+        else:
+            if config.tokens_per_second:
+                time.sleep(output_tokens / config.tokens_per_second)
+            self._send_json(200, self._message(body, text, usage))
+
+    def _message(self, body, text, usage):
+        return {
+            'id': f'msg_{uuid.uuid4().hex[:24]}',
+            'type': 'message',
+            'role': 'assistant',
+            'model': body.get('model', 'fake-model'),
+            'content': [{'type': 'text', 'text': text}],
+            'stop_reason': 'end_turn',
+            'stop_sequence': None,
+            'usage': usage
+        }
+
+    def _stream_message(self, body, text, usage):
+        """Send the message as server-sent events, paced at tokens_per_second."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        message = self._message(body, '', dict(usage, output_tokens=0))
+        message['content'] = []
+        message['stop_reason'] = None
+        self._send_event('message_start', {'type': 'message_start', 'message': message})
+        self._send_event('content_block_start', {
+            'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}
+        })
+
+        step = TOKENS_PER_DELTA * CHARS_PER_TOKEN
+        delay = TOKENS_PER_DELTA / self.server.tokens_per_second if self.server.tokens_per_second else 0
+        for start in range(0, len(text), step):
+            if delay:
+                time.sleep(delay)
+            self._send_event('content_block_delta', {
+                'type': 'content_block_delta', 'index': 0,
+                'delta': {'type': 'text_delta', 'text': text[start:start + step]}
+            })
+
+        self._send_event('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+        self._send_event('message_delta', {
+            'type': 'message_delta',
+            'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+            'usage': {'output_tokens': usage['output_tokens']}
+        })
+        self._send_event('message_stop', {'type': 'message_stop'})
+        self._write_chunk(b'')
+
+    def _send_event(self, event, data):
+        self._write_chunk(f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode('utf-8'))
+
+    def _write_chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def _send_error(self, status):
+        error_type = ERROR_TYPES.get(status, 'api_error')
+        self._send_json(status, {
+            'type': 'error',
+            'error': {'type': error_type, 'message': f'Injected {error_type}'}
+        }, headers={'retry-after': '1'} if status in (429, 529) else None)
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('request-id', f'req_{uuid.uuid4().hex[:24]}')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output readable
+
+
+class FakeAnthropicServer(ThreadingHTTPServer):
+    """
+    HTTP server standing in for api.anthropic.com.
+
+    latency is the delay before the first token, tokens_per_second paces
+    the output (0 sends it all at once), and error_rate is the fraction
+    of requests answered with error_status instead of a story.
+
+    connect_latency is added once per new connection, like a TLS handshake
+    to the real API. Prompt caching works like the API's: a system prefix marked with
+    cache_control and at least cache_min_tokens long is written to the
+    cache on first use and read from it for CACHE_TTL seconds after each
+    use. With prefill_tokens_per_second, uncached input tokens add to the
+    time to the first token.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=1.0, tokens_per_second=80, error_rate=0.0, error_status=529,
+                 cache_min_tokens=1024, prefill_tokens_per_second=0, connect_latency=0.0):
+        super().__init__(('127.0.0.1', port), FakeAnthropicHandler)
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.cache_min_tokens = cache_min_tokens
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.connect_latency = connect_latency
+        self.counts = {'requests': 0, 'errors': 0, 'connections': 0, 'input_tokens': 0, 'output_tokens': 0,
+                       'cache_read_input_tokens': 0, 'cache_creation_input_tokens': 0}
+        self._cache = {}  # cached prefix -> expiry time
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def start(self):
+        """Serve from a background thread and return self."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def cache_usage(self, prefix, input_tokens):
+        """Return the input side of a usage block, reading or writing prefix in the cache."""
+        usage = {'input_tokens': input_tokens, 'cache_read_input_tokens': 0, 'cache_creation_input_tokens': 0}
+        prefix_tokens = len(prefix) // CHARS_PER_TOKEN
+        if not prefix or prefix_tokens < self.cache_min_tokens:
+            return usage
+
+        now = time.time()
+        with self._lock:
+            hit = self._cache.get(prefix, 0) > now
+            self._cache[prefix] = now + CACHE_TTL
+        usage['cache_read_input_tokens' if hit else 'cache_creation_input_tokens'] = prefix_tokens
+        usage['input_tokens'] = max(0, input_tokens - prefix_tokens)
+        return usage
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counts[name] += amount
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+def add_backend_arguments(parser):
+    """Add the fake backend's options to an argparse parser."""
+    parser.add_argument('--latency', type=float, default=1.0,
+                        help='seconds before the first token (default 1.0)')
+    parser.add_argument('--tokens-per-second', type=float, default=80,
+                        help='output token rate, 0 for instant (default 80)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of requests that fail (default 0)')
+    parser.add_argument('--error-status', type=int, default=529,
+                        help='HTTP status of injected errors (default 529 overloaded)')
+    parser.add_argument('--cache-min-tokens', type=int, default=1024,
+                        help='smallest system prompt that is cached (default 1024)')
+    parser.add_argument('--prefill-tokens-per-second', type=float, default=0,
+                        help='rate uncached input tokens are read at, 0 for instant (default 0)')
+    parser.add_argument('--connect-latency', type=float, default=0.0,
+                        help='seconds added to each new connection, like a TLS handshake (default 0)')
+
+
+def main():
+    """Run the fake backend until interrupted."""
+    parser = argparse.ArgumentParser(description='Local stand-in for the Anthropic messages API')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'port to listen on (default {DEFAULT_PORT})')
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+
+    backend = FakeAnthropicServer(args.port, args.latency, args.tokens_per_second,
+                                  args.error_rate, args.error_status,
+                                  args.cache_min_tokens, args.prefill_tokens_per_second, args.connect_latency)
+    print(f"Fake Anthropic API listening on {backend.url}")
+    print(f"Latency: {args.latency}s, {args.tokens_per_second} tokens/s, "
+          f"error rate {args.error_rate:.0%} ({args.error_status})")
+    try:
+        backend.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nStopped. {backend.stats()}")
+
+
+if __name__ == '__main__':
+    main()
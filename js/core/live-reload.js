@@ -0,0 +1,108 @@
+// Live Reload Module
+// Applies file changes pushed by the server without reloading the whole page
+(function() {
+    'use strict';
+
+    window.LiveReload = {
+        source: null,
+
+        init: function() {
+            if (typeof EventSource === 'undefined') return;
+
+            fetch('/api/live-reload')
+                .then(response => response.ok ? response.json() : null)
+                .then(config => {
+                    if (config && config.enabled) {
+                        this.connect(config.port);
+                    }
+                })
+                .catch(() => {
+                    // Server without live reload - nothing to do
+                });
+        },
+
+        connect: function(port) {
+            const url = `${window.location.protocol}//${window.location.hostname}:${port}/events`;
+            this.source = new EventSource(url);
+
+            this.source.addEventListener('change', (event) => {
+                const data = JSON.parse(event.data);
+                this.applyChanges(data.paths || []);
+            });
+        },
+
+        applyChanges: function(paths) {
+            console.log('🔄 Files changed:', paths);
+
+            // Scripts register timers and event listeners when they run, so
+            // running a changed module a second time isn't safe - reload instead
+            const needsFullReload = paths.some(path =>
+                path === 'index.html' || (path.endsWith('.js') && this.isLoadedScript(path))
+            );
+            if (needsFullReload) {
+                window.location.reload();
+                return;
+            }
+
+            paths.forEach(path => {
+                if (path.endsWith('.css')) {
+                    this.reloadStylesheet(path);
+                } else if (path.startsWith('pages/') && path.endsWith('.html')) {
+                    this.reloadPage(path);
+                } else if (path.startsWith('images/')) {
+                    this.reloadImages(path);
+                }
+            });
+        },
+
+        isLoadedScript: function(path) {
+            return Array.from(document.scripts).some(script => this.matchesPath(script.src, path));
+        },
+
+        matchesPath: function(url, path) {
+            if (!url) return false;
+            return new URL(url, window.location.href).pathname === '/' + path;
+        },
+
+        // Swap in a fresh copy of the stylesheet, removing the old one once
+        // the new one has loaded so the page never flashes unstyled
+        reloadStylesheet: function(path) {
+            document.querySelectorAll('link[rel="stylesheet"]').forEach(link => {
+                if (!this.matchesPath(link.href, path)) return;
+
+                const fresh = link.cloneNode();
+                fresh.href = `${path}?v=${Date.now()}`;
+                fresh.addEventListener('load', () => link.remove());
+                link.after(fresh);
+            });
+        },
+
+        // Page templates are loaded lazily by the Router; drop the stale copy
+        // and load it again if it is the page being shown
+        reloadPage: function(path) {
+            const pageName = path.slice('pages/'.length, -'.html'.length);
+            const page = document.getElementById(pageName);
+            if (!page) return;
+
+            const wasActive = page.classList.contains('active');
+            page.remove();
+            if (wasActive && typeof Router !== 'undefined') {
+                Router.switchToTab(pageName);
+            }
+        },
+
+        reloadImages: function(path) {
+            document.querySelectorAll('img').forEach(img => {
+                if (this.matchesPath(img.src, path)) {
+                    img.src = `${path}?v=${Date.now()}`;
+                }
+            });
+        }
+    };
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', () => LiveReload.init());
+    } else {
+        LiveReload.init();
+    }
+})();
@@ -291,7 +291,8 @@ const GameEngine = {
                 img.onerror = () => {
                     console.warn(`Failed to load decoration image: ${deco.image}`);
                 };
-                img.src = deco.image;
+                // The server sends a smaller copy no narrower than ?w=
+                img.src = `${deco.image}?w=${Math.ceil(deco.width * (window.devicePixelRatio || 1))}`;
             }
         }
     },
@@ -307,7 +308,8 @@ const GameEngine = {
                 console.warn(`Failed to load background image: ${level.background.image}`);
                 this.backgroundImage = null;
             };
-            img.src = level.background.image;
+            // Backgrounds are 16:9 and drawn at the canvas height
+            img.src = `${level.background.image}?w=${Math.ceil(MathGame.canvas.height * 16 / 9)}`;
         } else {
             this.backgroundImage = null;
         }
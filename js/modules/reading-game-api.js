@@ -13,7 +13,7 @@
 
         /**
          * Generate a story using the backend API
-         * @param {Object} params - { gradeLevel, length, prompt, random }
+         * @param {Object} params - { gradeLevel, length, prompt, random, fresh }
          * @returns {Promise} Resolves with story data or rejects with error
          */
         generateStory: function(params) {
@@ -71,7 +71,8 @@
                         gradeLevel: params.gradeLevel,
                         length: params.length,
                         prompt: params.prompt || '',
-                        random: params.random || false
+                        random: params.random || false,
+                        fresh: params.fresh || false
                     });
                     xhr.send(payload);
                 } catch (e) {
@@ -81,6 +82,118 @@
             });
         },
 
+        /**
+         * Generate a story using the streaming endpoint, which delivers the
+         * title and each sentence as soon as the server has them.
+         * @param {Object} params - { gradeLevel, length, prompt, random, fresh }
+         * @param {Object} handlers - { onTitle(title), onSentence(sentence, index) }
+         * @returns {Promise} Resolves with the complete story or rejects with error
+         */
+        generateStoryStream: function(params, handlers) {
+            var self = this;
+            handlers = handlers || {};
+
+            return new Promise(function(resolve, reject) {
+                var xhr = new XMLHttpRequest();
+                var url = self.BASE_URL + '/api/generate-story/stream';
+                var parsedLength = 0;
+                var finished = false;
+
+                // The timeout only covers the wait for the first event;
+                // once sentences are arriving the story is clearly on its way
+                var timeoutId = setTimeout(function() {
+                    xhr.abort();
+                    reject(new Error('Request timeout. Please try again.'));
+                }, self.TIMEOUT);
+
+                function finish(error, story) {
+                    if (finished) return;
+                    finished = true;
+                    clearTimeout(timeoutId);
+                    if (error) {
+                        reject(error);
+                    } else {
+                        resolve(story);
+                    }
+                }
+
+                function handleEvent(event) {
+                    clearTimeout(timeoutId);
+                    if (event.type === 'title' && handlers.onTitle) {
+                        handlers.onTitle(event.title);
+                    } else if (event.type === 'sentence' && handlers.onSentence) {
+                        handlers.onSentence(event.sentence, event.index);
+                    } else if (event.type === 'done') {
+                        finish(null, event.story);
+                    } else if (event.type === 'error') {
+                        finish(new Error(event.error || 'Unknown error'));
+                    }
+                }
+
+                // Parse every complete line received so far
+                function processLines() {
+                    var text = xhr.responseText;
+                    var newline;
+                    while ((newline = text.indexOf('\n', parsedLength)) !== -1) {
+                        var line = text.substring(parsedLength, newline).trim();
+                        parsedLength = newline + 1;
+                        if (!line) continue;
+                        try {
+                            handleEvent(JSON.parse(line));
+                        } catch (e) {
+                            finish(new Error('Invalid response from server'));
+                            xhr.abort();
+                            return;
+                        }
+                    }
+                }
+
+                xhr.open('POST', url, true);
+                xhr.setRequestHeader('Content-Type', 'application/json');
+
+                xhr.onprogress = function() {
+                    if (xhr.status === 200) {
+                        processLines();
+                    }
+                };
+
+                xhr.onload = function() {
+                    if (xhr.status === 200) {
+                        processLines();
+                        finish(new Error('Story stream ended unexpectedly'));
+                    } else {
+                        try {
+                            var errorResponse = JSON.parse(xhr.responseText);
+                            finish(new Error(errorResponse.error || 'Server error'));
+                        } catch (e) {
+                            finish(new Error('Server error: ' + xhr.status));
+                        }
+                    }
+                };
+
+                xhr.onerror = function() {
+                    finish(new Error('Network error. Make sure the server is running on port 8080.'));
+                };
+
+                xhr.onabort = function() {
+                    clearTimeout(timeoutId);
+                };
+
+                try {
+                    var payload = JSON.stringify({
+                        gradeLevel: params.gradeLevel,
+                        length: params.length,
+                        prompt: params.prompt || '',
+                        random: params.random || false,
+                        fresh: params.fresh || false
+                    });
+                    xhr.send(payload);
+                } catch (e) {
+                    finish(new Error('Failed to send request: ' + e.message));
+                }
+            });
+        },
+
         /**
          * Check if backend is healthy
          * @returns {Promise} Resolves with health status or rejects with error
@@ -126,6 +239,81 @@
             });
         },
 
+        /**
+         * List stories generated on any device in the house, newest first.
+         * Summaries only - fetch a story with getSharedStory to read it.
+         * @param {Object} params - { gradeLevel, length, q, page, pageSize } (all optional)
+         * @returns {Promise} Resolves with { stories, total, page } or rejects with error
+         */
+        listSharedStories: function(params) {
+            var query = [];
+            params = params || {};
+            ['gradeLevel', 'length', 'q', 'page', 'pageSize'].forEach(function(name) {
+                if (params[name]) {
+                    query.push(name + '=' + encodeURIComponent(params[name]));
+                }
+            });
+            return this.getJSON('/api/stories' + (query.length ? '?' + query.join('&') : ''));
+        },
+
+        /**
+         * Fetch one shared story with its sentences
+         * @param {String} storyId - Library id from listSharedStories
+         * @returns {Promise} Resolves with story data or rejects with error
+         */
+        getSharedStory: function(storyId) {
+            return this.getJSON('/api/stories/' + encodeURIComponent(storyId)).then(function(response) {
+                return response.story;
+            });
+        },
+
+        /**
+         * GET a JSON API route
+         * @param {String} path - Route path including any query string
+         * @returns {Promise} Resolves with the response body or rejects with error
+         */
+        getJSON: function(path) {
+            var self = this;
+
+            return new Promise(function(resolve, reject) {
+                var xhr = new XMLHttpRequest();
+
+                var timeoutId = setTimeout(function() {
+                    xhr.abort();
+                    reject(new Error('Request timeout. Please try again.'));
+                }, self.TIMEOUT);
+
+                xhr.open('GET', self.BASE_URL + path, true);
+
+                xhr.onload = function() {
+                    clearTimeout(timeoutId);
+                    var response;
+                    try {
+                        response = JSON.parse(xhr.responseText);
+                    } catch (e) {
+                        reject(new Error('Server error: ' + xhr.status));
+                        return;
+                    }
+                    if (xhr.status === 200 && response.success) {
+                        resolve(response);
+                    } else {
+                        reject(new Error(response.error || 'Server error'));
+                    }
+                };
+
+                xhr.onerror = function() {
+                    clearTimeout(timeoutId);
+                    reject(new Error('Network error. Make sure the server is running on port 8080.'));
+                };
+
+                xhr.onabort = function() {
+                    clearTimeout(timeoutId);
+                };
+
+                xhr.send();
+            });
+        },
+
         /**
          * Validate story structure
          * @param {Object} story - Story object from API
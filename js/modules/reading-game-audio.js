@@ -145,6 +145,26 @@
             ]);
         },
 
+        /**
+         * Play speech rendered by the server (a sentence or a spelled-out word)
+         * @param {String} url - Audio URL from a story sentence's audio field
+         * @param {Number} delay - Seconds to wait first, e.g. for a chime to finish
+         */
+        playSpeech: function(url, delay) {
+            if (!url || !this.isSoundEnabled()) return;
+
+            var self = this;
+            setTimeout(function() {
+                if (self.speech) {
+                    self.speech.pause();
+                }
+                self.speech = new Audio(url);
+                self.speech.play().catch(function(e) {
+                    console.warn('Could not play speech:', e.message);
+                });
+            }, (delay || 0) * 1000);
+        },
+
         /**
          * Toggle sound on/off
          */
@@ -21,6 +21,8 @@
         skippedWords: [],
         trophyEligible: true,
         spellingInProgress: false,  // Track if user is currently spelling (inline mode)
+        storyStreaming: false,  // True while sentences of the current story are still arriving
+        expectedSentenceCount: 0,  // Sentence count to expect while the story is streaming
 
         // Selected options
         selectedGrade: '2nd',
@@ -76,6 +78,7 @@
             this.skippedWords = [];
             this.trophyEligible = true;
             this.spellingInProgress = false;  // Reset spelling flag
+            this.storyStreaming = false;
             this.resetWordState();
 
             // Save grade level preference
@@ -351,6 +354,10 @@
             if (!this.currentStory) return 0;
 
             var totalSentences = this.currentStory.sentences.length;
+            if (this.storyStreaming) {
+                // Count the sentences that are still on their way
+                totalSentences = Math.max(totalSentences, this.expectedSentenceCount);
+            }
             var gradeConfig = window.ReadingGameData.getGradeConfig(this.selectedGrade);
 
             if (gradeConfig.testEveryOther) {
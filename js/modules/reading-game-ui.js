@@ -211,11 +211,17 @@
         },
 
         /**
-         * Generate a story
+         * Generate a story.
+         * Sentences are streamed from the server, so reading starts as soon
+         * as the first one arrives while the rest of the story is written.
          */
         generateStory: function(random, prompt) {
             var self = this;
             var state = window.ReadingGameState;
+            var gradeLevel = state.selectedGrade;
+            var length = state.selectedLength;
+            var story = null;
+            var title = '';
 
             state.setState('story-loading');
             this.render();
@@ -223,38 +229,96 @@
             window.ReadingGameAudio.playLoading();
 
             var params = {
-                gradeLevel: state.selectedGrade,
-                length: state.selectedLength,
+                gradeLevel: gradeLevel,
+                length: length,
                 random: random,
                 prompt: prompt || ''
             };
 
-            window.ReadingGameAPI.generateStory(params)
+            function startReading(storyData, streaming) {
+                story = window.ReadingGameAPI.createStoryObject(storyData, gradeLevel, length);
+                state.startNewGame(story, gradeLevel, length);
+                state.storyStreaming = streaming;
+                state.expectedSentenceCount = window.ReadingGameData.getSentenceCount(gradeLevel, length);
+                self.render();
+            }
+
+            window.ReadingGameAPI.generateStoryStream(params, {
+                onTitle: function(storyTitle) {
+                    title = storyTitle;
+                },
+                onSentence: function(sentence) {
+                    if (!story) {
+                        startReading({ title: title, sentences: [sentence] }, true);
+                        return;
+                    }
+                    story.sentences.push(sentence);
+                    if (self._waitingForSentence && state.currentStory === story) {
+                        self.render();
+                    }
+                }
+            })
                 .then(function(storyData) {
                     // Validate story
                     if (!window.ReadingGameAPI.validateStory(storyData)) {
                         throw new Error('Invalid story format');
                     }
 
-                    // Create story object
-                    var story = window.ReadingGameAPI.createStoryObject(
-                        storyData,
-                        state.selectedGrade,
-                        state.selectedLength
-                    );
+                    if (!story) {
+                        startReading(storyData, false);
+                        return;
+                    }
 
-                    // Start game
-                    state.startNewGame(story, state.selectedGrade, state.selectedLength);
-                    self.render();
+                    story.title = storyData.title;
+                    story.sentences = storyData.sentences;
+                    self.finishStreamingStory(story);
                 })
                 .catch(function(error) {
                     console.error('Story generation error:', error);
+
+                    if (story) {
+                        // Keep the sentences that already arrived
+                        self.finishStreamingStory(story);
+                        return;
+                    }
+
                     alert('Failed to generate story: ' + error.message);
                     state.setState('story-input');
                     self.render();
                 });
         },
 
+        /**
+         * Save a streamed story once all of its sentences have arrived
+         */
+        finishStreamingStory: function(story) {
+            var state = window.ReadingGameState;
+
+            window.ReadingGameStorage.updateStory(story.id, {
+                title: story.title,
+                sentences: story.sentences
+            });
+
+            if (state.currentStory === story) {
+                state.storyStreaming = false;
+                if (this._waitingForSentence) {
+                    this.render();
+                }
+            }
+        },
+
+        /**
+         * Render a short wait while the next streamed sentence is written
+         */
+        renderWaitingForSentence: function() {
+            var html = '<div class="reading-loading">';
+            html += '<div class="reading-spinner"></div>';
+            html += '<p>Writing the next page...</p>';
+            html += '</div>';
+
+            this.container.innerHTML = html;
+        },
+
         /**
          * Render loading screen
          */
@@ -275,6 +339,14 @@
             var state = window.ReadingGameState;
             var sentence = state.getCurrentSentence();
 
+            this._waitingForSentence = false;
+            if (!sentence && state.storyStreaming) {
+                // Reader caught up with the story that is still being written
+                this._waitingForSentence = true;
+                this.renderWaitingForSentence();
+                return;
+            }
+
             if (!sentence) {
                 // Story complete
                 state.completeStory();
@@ -345,6 +417,9 @@
                     sentenceText = this.highlightWord(sentence.text, sentence.testWord);
                 }
                 html += '<p class="reading-sentence reading-current-sentence">' + sentenceText + '</p>';
+                if (sentence.audio && sentence.audio.sentence) {
+                    html += '<button class="reading-btn reading-btn-small reading-btn-secondary" id="reading-hear-sentence">🔊 Hear it</button>';
+                }
 
                 // Show either start button or spelling interface
                 if (state.spellingInProgress) {
@@ -462,6 +537,13 @@
                 });
             }
 
+            var hearBtn = document.getElementById('reading-hear-sentence');
+            if (hearBtn) {
+                hearBtn.addEventListener('click', function() {
+                    window.ReadingGameAudio.playSpeech(state.getCurrentSentence().audio.sentence);
+                });
+            }
+
             var spellBtn = document.getElementById('reading-start-spelling');
 
             // Clean up previous Enter key handler if exists
@@ -564,11 +646,15 @@
             }
 
             // Submit attempt
+            var sentence = state.getCurrentSentence();
             var result = state.checkSpelling(attempt);
 
             if (result.correct) {
                 // Success!
                 window.ReadingGameAudio.playWordComplete();
+                if (sentence.audio) {
+                    window.ReadingGameAudio.playSpeech(sentence.audio.spelling, 0.6);
+                }
                 this.showCorrectFeedback(result, function() {
                     if (result.storyComplete) {
                         state.exitSpelling();
@@ -1030,10 +1116,86 @@
                 });
             }
 
+            // Stories generated on every device in the house
+            html += '<div class="reading-library-section">';
+            html += '<h2>🏠 Family Library</h2>';
+            html += '<div class="reading-story-list" id="reading-shared-stories"></div>';
+            html += '<button class="reading-btn reading-btn-secondary" id="reading-shared-more" style="display: none;">Show more</button>';
+            html += '</div>';
+
             html += '</div>';
 
             this.container.innerHTML = html;
             this.attachLibraryHandlers();
+            this.loadSharedStories(1);
+        },
+
+        /**
+         * Append a page of shared stories from the server to the library
+         */
+        loadSharedStories: function(page) {
+            var self = this;
+            var list = document.getElementById('reading-shared-stories');
+            var moreBtn = document.getElementById('reading-shared-more');
+            if (!list) return;
+
+            window.ReadingGameAPI.listSharedStories({ page: page, pageSize: 20 }).then(function(response) {
+                // The player may have left the library while the list loaded
+                if (!document.body.contains(list)) return;
+
+                var html = '';
+                response.stories.forEach(function(story) {
+                    var config = window.ReadingGameData.GRADE_LEVELS[story.gradeLevel];
+                    html += '<div class="reading-story-card">';
+                    html += '<h3>' + story.title + '</h3>';
+                    html += '<p class="reading-story-meta">';
+                    html += (config ? config.emoji + ' ' : '') + story.length + ' • ' + story.sentenceCount + ' sentences';
+                    html += '</p>';
+                    html += '<div class="reading-story-actions">';
+                    html += '<button class="reading-btn reading-btn-small reading-play-shared" data-story-id="' + story.id + '">Read</button>';
+                    html += '</div>';
+                    html += '</div>';
+                });
+                if (page === 1 && response.stories.length === 0) {
+                    html = '<p class="reading-empty-library">No shared stories yet.</p>';
+                }
+                list.insertAdjacentHTML('beforeend', html);
+
+                list.querySelectorAll('.reading-play-shared:not([data-bound])').forEach(function(btn) {
+                    btn.setAttribute('data-bound', 'true');
+                    btn.addEventListener('click', function() {
+                        self.playSharedStory(this.getAttribute('data-story-id'), this);
+                    });
+                });
+
+                moreBtn.style.display = page * 20 < response.total ? '' : 'none';
+                moreBtn.onclick = function() {
+                    self.loadSharedStories(page + 1);
+                };
+            }).catch(function(error) {
+                console.warn('Could not load shared stories:', error.message);
+                if (page === 1 && document.body.contains(list)) {
+                    list.innerHTML = '<p class="reading-empty-library">Shared stories are not available right now.</p>';
+                }
+            });
+        },
+
+        /**
+         * Fetch a shared story and start reading it on this device
+         */
+        playSharedStory: function(storyId, button) {
+            var self = this;
+            var state = window.ReadingGameState;
+            button.disabled = true;
+
+            window.ReadingGameAPI.getSharedStory(storyId).then(function(storyData) {
+                var story = window.ReadingGameAPI.createStoryObject(storyData, storyData.gradeLevel, storyData.length);
+                state.startNewGame(story, storyData.gradeLevel, storyData.length);
+                self.render();
+            }).catch(function(error) {
+                button.disabled = false;
+                alert('Could not open this story: ' + error.message);
+            });
         },
 
         /**
@@ -7,19 +7,61 @@ Serves static files and provides API endpoints for story generation
 
 import os
 import sys
+import re
+import gzip
+import ctypes
+import ctypes.util
+import select
+import shutil
+import selectors
+import socket
+import sqlite3
+import struct
+import subprocess
 import json
+import math
+import random
+import hashlib
+import importlib.util
 import logging
-import webbrowser
 import threading
 import time
+import argparse
+import atexit
+import contextvars
+import mimetypes
+import queue
+import uuid
+from array import array
+from bisect import bisect_left
+from collections import Counter as WordCounts, OrderedDict, deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import chain, count
+from operator import itemgetter
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
 from pathlib import Path
 from datetime import datetime
 
-from flask import Flask, request, jsonify, send_from_directory
+# Startup is timed from here; the standard library imports above are quick
+STARTUP_BEGAN = time.perf_counter()
+
+from flask import Flask, Response, g, request, jsonify, send_file, send_from_directory, stream_with_context
 from flask_cors import CORS
-from anthropic import Anthropic
+from werkzeug.security import safe_join
 from dotenv import load_dotenv
 
+try:
+    import brotli
+except ImportError:
+    brotli = None  # Optional: only gzip variants are served without it
+
+try:
+    from PIL import Image, features as pil_features
+except ImportError:
+    Image = None  # Optional: images are served as they are without it
+
 # Fix Windows console encoding for emoji support
 if sys.platform == 'win32':
     import io
@@ -32,49 +74,218 @@ load_dotenv()
 # Configuration
 PORT = 8080
 DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.getenv('DATA_DIR', os.path.join(DIRECTORY, 'data'))
+
+# Story generation configuration
+STORY_MODEL = os.getenv('STORY_MODEL', 'claude-sonnet-4-5-20250929')
+STORY_FAST_MODEL = os.getenv('STORY_FAST_MODEL', 'claude-haiku-4-5-20251001')  # Empty to always use STORY_MODEL
+STORY_FAST_LENGTHS = [length.strip() for length in os.getenv('STORY_FAST_LENGTHS', 'tiny,short').split(',') if length.strip()]
+STORY_MAX_TOKENS_CAP = int(os.getenv('STORY_MAX_TOKENS_CAP', '8000'))  # Upper bound for any story budget
+STORY_SECTIONS_MIN_SENTENCES = int(os.getenv('STORY_SECTIONS_MIN_SENTENCES', '60'))  # Longer stories use sections; 0 disables
+STORY_SECTION_SENTENCES = int(os.getenv('STORY_SECTION_SENTENCES', '20'))  # Sentences per section
+STORY_CACHE_FILE = os.path.join(DATA_DIR, 'story-cache.json')
+STORY_CACHE_MAX_ENTRIES = int(os.getenv('STORY_CACHE_MAX_ENTRIES', '200'))
+STORY_CACHE_MAX_AGE_DAYS = float(os.getenv('STORY_CACHE_MAX_AGE_DAYS', '30'))
+STORY_POOL_FILE = os.path.join(DATA_DIR, 'story-pool.json')
+STORY_POOL_SIZE = int(os.getenv('STORY_POOL_SIZE', '2'))
+STORY_POOL_LOW_WATERMARK = int(os.getenv('STORY_POOL_LOW_WATERMARK', '1'))
+STORY_BATCH_FILE = os.path.join(DATA_DIR, 'story-batches.json')
+STORY_LIBRARY_FILE = os.path.join(DATA_DIR, 'story-library.sqlite3')
+STORY_BATCH_WORKERS = int(os.getenv('STORY_BATCH_WORKERS', '2'))  # Batch stories generated at once
+STORY_BATCH_MAX_STORIES = int(os.getenv('STORY_BATCH_MAX_STORIES', '50'))  # Stories per batch
+STORY_BATCH_MAX_JOBS = int(os.getenv('STORY_BATCH_MAX_JOBS', '20'))  # Batches kept, oldest finished dropped first
+STORY_BATCH_MAX_PENDING = int(os.getenv('STORY_BATCH_MAX_PENDING', '5'))  # Unfinished batches; more get a 503
+WORD_LISTS_DIR = os.getenv('WORD_LISTS_DIR', os.path.join(DIRECTORY, 'wordlists'))  # Grade word lists for difficulty scores
+AUDIO_DIR = os.path.join(DATA_DIR, 'audio')
+AUDIO_WORKERS = int(os.getenv('AUDIO_WORKERS', '2'))  # Sentences rendered to speech at once
+TTS_COMMAND = os.getenv('TTS_COMMAND', '')  # espeak-compatible engine; empty finds espeak-ng or espeak
+TTS_VOICE = os.getenv('TTS_VOICE', 'en-us')
+TTS_SPEED = int(os.getenv('TTS_SPEED', '130'))  # Words per minute
+MAX_HARD_WORD_SHARE = float(os.getenv('MAX_HARD_WORD_SHARE', '0.1'))  # Share of words above the grade a story may have
+
+# Serving configuration
+SERVER_MODE = os.getenv('SERVER_MODE', 'production')  # 'production' (waitress) or 'dev' (Flask)
+SERVER_THREADS = int(os.getenv('SERVER_THREADS', '8'))  # Threads for static files and health checks
+STORY_WORKERS = int(os.getenv('STORY_WORKERS', '4'))  # Story requests generating at once
+STORY_WAIT_TIMEOUT = float(os.getenv('STORY_WAIT_TIMEOUT', '30'))  # Seconds to wait for an identical request's story
+UPSTREAM_CONCURRENCY = int(os.getenv('UPSTREAM_CONCURRENCY', '2'))  # Model calls in flight at once
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv('UPSTREAM_QUEUE_TIMEOUT', '20'))  # Seconds to wait for a call slot
+STORY_RATE_PER_MINUTE = float(os.getenv('STORY_RATE_PER_MINUTE', '4'))  # New stories per device per minute; 0 disables
+STORY_RATE_BURST = int(os.getenv('STORY_RATE_BURST', '3'))  # New stories a device may start back to back
+
+# Upstream resilience configuration. The total deadline stays inside the
+# reading game's 30 second request TIMEOUT: a story request gets one, for its
+# wait for a call slot and every attempt of every model call it makes.
+UPSTREAM_MAX_ATTEMPTS = int(os.getenv('UPSTREAM_MAX_ATTEMPTS', '3'))
+UPSTREAM_ATTEMPT_TIMEOUT = float(os.getenv('UPSTREAM_ATTEMPT_TIMEOUT', '25'))  # Seconds per attempt
+UPSTREAM_TOTAL_DEADLINE = float(os.getenv('UPSTREAM_TOTAL_DEADLINE', '27'))  # Seconds for a story request's calls
+UPSTREAM_BACKOFF_BASE = float(os.getenv('UPSTREAM_BACKOFF_BASE', '0.5'))  # Seconds before the first retry
+UPSTREAM_BACKOFF_MAX = float(os.getenv('UPSTREAM_BACKOFF_MAX', '4'))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))  # Failures in a row to open
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', '30'))  # Seconds before a trial call
+
+# Upstream HTTP configuration
+UPSTREAM_POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', str(UPSTREAM_CONCURRENCY + 2)))  # Connections to the API
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv('UPSTREAM_KEEPALIVE_EXPIRY', '60'))  # Seconds an idle connection is kept
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '5'))  # Seconds to connect, TLS included
+UPSTREAM_HTTP2 = os.getenv('UPSTREAM_HTTP2', 'true').lower() in ('1', 'true', 'yes')  # Used when h2 is installed
+UPSTREAM_WARMUP_INTERVAL = float(os.getenv('UPSTREAM_WARMUP_INTERVAL', '30'))  # Idle seconds before a warmup; 0 disables
+UPSTREAM_WARMUP_WINDOW = float(os.getenv('UPSTREAM_WARMUP_WINDOW', '600'))  # Seconds after the last story call to keep warming
+
+# Static asset cache configuration
+STATIC_CACHE_MAX_BYTES = int(os.getenv('STATIC_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+STATIC_CACHE_MAX_FILE_BYTES = int(os.getenv('STATIC_CACHE_MAX_FILE_BYTES', str(4 * 1024 * 1024)))
+IMAGE_VARIANTS_DIR = os.path.join(DATA_DIR, 'images')
+IMAGE_VARIANT_WIDTHS = [int(width) for width in os.getenv('IMAGE_VARIANT_WIDTHS', '480,960,1280,1920').split(',') if width.strip()]
+
+# File watcher configuration
+WATCH_EXTENSIONS = ['.html', '.css', '.js', '.jpg', '.jpeg', '.png', '.gif', '.svg', '.webp']
+WATCH_IGNORED_DIRS = {'.git', 'venv', '.venv', '__pycache__', 'node_modules', 'data'}
+WATCH_DEBOUNCE = 0.2  # seconds of quiet before a burst of writes is reported
+WATCH_POLL_INTERVAL = 1.0  # seconds between scans when inotify is unavailable
+LIVE_RELOAD_PORT = int(os.getenv('LIVE_RELOAD_PORT', str(PORT + 1)))  # 0 disables live reload
+
+# Logging configuration
+LOG_FILE = os.getenv('LOG_FILE', os.path.join(DATA_DIR, 'server.log'))  # Outside the watched tree, see create_file_watcher
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # 'text' or 'json' (JSON lines) for the log file
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))  # Rotate the log file at this size
+LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', '')  # Rotate by time instead, e.g. 'midnight' or 'H'
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))  # Rotated files to keep
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))  # Records waiting to be written; more are dropped
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.01'))  # Share of successful LOG_SAMPLED_ROUTES requests logged
+LOG_SAMPLED_ROUTES = {'/<path:path>', '/api/audio/<key>.wav', '/api/health', '/metrics'}
+
+# ============================================================================
+# Logging
+# ============================================================================
+
+LOG_TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class JsonLogFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line, with any request fields under "http"."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        if getattr(record, 'http', None):
+            entry['http'] = record.http
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class LogQueueHandler(QueueHandler):
+    """
+    Hands records to the log listener thread, so request threads never
+    wait on the disk or the journal. When the queue is full (the disk is
+    stuck) records are dropped and counted instead of blocking.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self):
+        """Return queue statistics for the health endpoint."""
+        return {
+            'queued': self.queue.qsize(),
+            'dropped': self.dropped
+        }
+
+
+def make_log_file_handler():
+    """Return the rotating handler for LOG_FILE, by time if LOG_ROTATE_WHEN is set, else by size."""
+    os.makedirs(os.path.dirname(os.path.abspath(LOG_FILE)), exist_ok=True)
+    if LOG_ROTATE_WHEN:
+        handler = TimedRotatingFileHandler(LOG_FILE, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT,
+                                           encoding='utf-8')
+    else:
+        handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                      encoding='utf-8')
+    handler.setFormatter(JsonLogFormatter() if LOG_FORMAT == 'json' else logging.Formatter(LOG_TEXT_FORMAT))
+    return handler
+
+
+console_log_handler = logging.StreamHandler()
+console_log_handler.setFormatter(logging.Formatter(LOG_TEXT_FORMAT))
+log_queue_handler = LogQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+log_queue_handler.setFormatter(logging.Formatter('%(message)s'))  # The listener's handlers add the rest
+log_listener = QueueListener(log_queue_handler.queue, make_log_file_handler(), console_log_handler)
+logging.basicConfig(level=logging.INFO, handlers=[log_queue_handler])
+log_listener.start()
+atexit.register(log_listener.stop)  # Writes out whatever is still queued
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('server.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
+access_logger = logging.getLogger(f'{__name__}.access')
+# The access log below replaces the development server's own request lines
+logging.getLogger('werkzeug').setLevel(logging.WARNING)
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)  # Enable CORS for local development
 
-# Initialize Anthropic client
+# Seconds from STARTUP_BEGAN to each startup stage, and to load the Anthropic client
+startup_seconds = {'imports': round(time.perf_counter() - STARTUP_BEGAN, 3)}
+
+# The Anthropic client is created on first use. Importing the SDK takes about
+# a second, which would otherwise delay serving after every restart.
 anthropic_api_key = os.getenv('ANTHROPIC_API_KEY')
-if anthropic_api_key:
-    client = Anthropic(api_key=anthropic_api_key)
-    logger.info('Anthropic API client initialized')
-else:
-    client = None
+_client = None
+_client_lock = threading.Lock()
+if not anthropic_api_key:
     logger.warning('ANTHROPIC_API_KEY not found - story generation will not work')
 
+
+def get_client():
+    """Return the Anthropic client, importing the SDK on first use, or None without an API key."""
+    global _client
+    if _client is None and anthropic_api_key:
+        with _client_lock:
+            if _client is None:
+                start_time = time.perf_counter()
+                from anthropic import Anthropic
+                # Retries are handled by upstream_policy, so the SDK's own are disabled
+                _client = Anthropic(
+                    api_key=anthropic_api_key, max_retries=0, http_client=upstream_http.build_client()
+                )
+                startup_seconds['client'] = round(time.perf_counter() - start_time, 3)
+                logger.info(f"Anthropic API client initialized in {startup_seconds['client']:.2f}s")
+    return _client
+
 # Grade level configurations
 GRADE_CONFIGS = {
     'Pre-K': {
         'sentence_counts': {'tiny': 10, 'short': 20, 'medium': 40},
         'vocabulary_level': 'Pre-K (ages 4-5)',
         'max_word_length': 6,
+        'tokens_per_sentence': 30,  # Starting estimate for the token budget, JSON included
+        'max_reading_grade': 2.0,  # Flesch-Kincaid grade of an average sentence that still fits
         'description': 'very simple 3-5 letter words like cat, dog, sun, run, jump'
     },
     '2nd': {
         'sentence_counts': {'tiny': 10, 'short': 20, 'medium': 40},
         'vocabulary_level': '2nd grade (ages 7-8)',
         'max_word_length': 9,
+        'tokens_per_sentence': 35,
+        'max_reading_grade': 4.0,
         'description': 'words appropriate for developing readers, mix of 4-9 letter words'
     },
     '4th': {
         'sentence_counts': {'tiny': 20, 'short': 40, 'medium': 80},
         'vocabulary_level': '4th grade (ages 9-10)',
         'max_word_length': 14,
+        'tokens_per_sentence': 45,
+        'max_reading_grade': 6.0,
         'description': 'richer vocabulary with longer, more challenging words and compound words'
     }
 }
@@ -98,172 +309,3540 @@ RANDOM_THEMES = [
     "a chef cooking for a royal feast"
 ]
 
+# Prompt templates for story generation
+SYSTEM_PROMPT_TEMPLATE = """You are a creative children's story writer. Generate engaging, age-appropriate stories for reading practice.
+
+Your task:
+1. Write a story with EXACTLY {sentence_count} sentences for {vocabulary_level} level
+2. For each sentence, select ONE test word for spelling practice
+3. Test words should be {word_description}
+4. Never repeat the same test word in a story
+5. Prefer common, fun, thematic words (like "mermaid", "treasure", "rocket")
+6. Each sentence should be clear and complete
+7. The story should be coherent and entertaining
+
+Return your response as valid JSON in this exact format:
+{{
+  "title": "Story Title Here",
+  "sentences": [
+    {{"text": "First sentence here.", "testWord": "selected"}},
+    {{"text": "Second sentence here.", "testWord": "another"}}
+  ]
+}}
+
+IMPORTANT:
+- Return ONLY valid JSON, no other text
+- Use exactly {sentence_count} sentences
+- Ensure all testWords are different
+- Each testWord must appear in its sentence
+- Keep vocabulary appropriate for {vocabulary_level}"""
+
+USER_PROMPT_TEMPLATE = "Write a story about: {prompt}"
+
+# Long stories are planned first, then their sections are written in parallel
+OUTLINE_SYSTEM_PROMPT_TEMPLATE = """You are planning a children's story for {vocabulary_level} readers.
+
+Split the story into EXACTLY {parts} parts that together make one complete story with a beginning, \
+middle and end. Describe what happens in each part in one or two sentences, and give the story a title.
+
+Return ONLY a JSON object in this format:
+{{
+  "title": "Story Title",
+  "sections": ["What happens in part 1", "What happens in part 2"]
+}}"""
+
+SECTION_PROMPT_TEMPLATE = """You are writing part {part} of {parts} of a story titled "{title}" about: {prompt}
+
+The plan for the whole story:
+{outline}
+
+Write ONLY part {part}: {summary}
+{position} Use "{title}" as the title in your JSON."""
+
+# Asks for the missing end of a story that came back short or cut off
+TOP_UP_PROMPT_TEMPLATE = """Continue this story, titled "{title}". So far it reads:
+
+{story_so_far}
+
+Write the next {missing} sentences to finish it. Use the same title and JSON format. \
+Don't use any of these testWords again: {used_words}"""
+
+# Changing either template changes this hash, so cached stories made with
+# an older prompt are never served for the new one
+PROMPT_TEMPLATE_HASH = hashlib.sha256(
+    (SYSTEM_PROMPT_TEMPLATE + USER_PROMPT_TEMPLATE).encode('utf-8')
+).hexdigest()[:16]
+
+
+# ============================================================================
+# Metrics
+# ============================================================================
+
+def _format_labels(labels):
+    """Render a label dict in Prometheus text format, e.g. {route="/",status="200"}."""
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in sorted(labels.items()):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    """A monotonically increasing count, one series per label combination."""
+
+    type = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def family(self, sample_name):
+        return self.name
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        """Yield (name, labels, value) for every series."""
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield self.name, dict(key), value
+
+
+class Histogram:
+    """Counts observations into cumulative buckets, one set per label combination."""
+
+    type = 'histogram'
+
+    # Seconds; wide enough for sub-millisecond stages and 30 second model calls
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}  # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def family(self, sample_name):
+        return self.name
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            all_series = {key: list(series) for key, series in self._series.items()}
+        for key, series in all_series.items():
+            labels = dict(key)
+            for bound, count in zip(self.buckets, series):
+                yield f'{self.name}_bucket', dict(labels, le=repr(float(bound))), count
+            yield f'{self.name}_bucket', dict(labels, le='+Inf'), series[-1]
+            yield f'{self.name}_sum', labels, series[-2]
+            yield f'{self.name}_count', labels, series[-1]
+
+
+class StatsGauges:
+    """
+    Exposes a component's stats() dict as gauges named prefix_key.
+    Nested dicts extend the name, or become a "key" label when their keys
+    aren't valid metric names (like the story pool's "Pre-K/tiny"). A
+    string such as the breaker state becomes a gauge of 1 with a "value"
+    label.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, help_text, stats_fn):
+        self.name = name
+        self.help_text = help_text
+        self.stats_fn = stats_fn
+
+    def family(self, sample_name):
+        return sample_name  # Every flattened stat is its own gauge
+
+    def samples(self):
+        yield from self._flatten(self.name, {}, self.stats_fn())
+
+    def _flatten(self, name, labels, value):
+        if isinstance(value, bool):
+            yield name, labels, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, labels, value
+        elif isinstance(value, str):
+            yield name, dict(labels, value=value), 1
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                if re.fullmatch(r'[a-zA-Z_]\w*', str(key)):
+                    yield from self._flatten(f'{name}_{key}', labels, item)
+                else:
+                    yield from self._flatten(name, dict(labels, key=key), item)
+
+
+class MetricsRegistry:
+    """Holds every metric and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text):
+        return self.register(Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=Histogram.DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            declared = set()
+            for name, labels, value in metric.samples():
+                family = metric.family(name)
+                if family not in declared:
+                    declared.add(family)
+                    lines.append(f'# HELP {family} {metric.help_text}')
+                    lines.append(f'# TYPE {family} {metric.type}')
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    """
+    Records how long each stage of a piece of work takes. Each mark()
+    observes the time since the previous mark under that stage name.
+    """
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self._last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.histogram.observe(now - self._last, stage=stage)
+        self._last = now
+
+
+metrics = MetricsRegistry()
+http_requests = metrics.counter('http_requests_total', 'HTTP requests by route, method and status.')
+http_request_seconds = metrics.histogram(
+    'http_request_duration_seconds', 'Time to handle a request, including streamed bodies.'
+)
+story_stage_seconds = metrics.histogram(
+    'story_stage_duration_seconds', 'Time spent in each stage of story generation.'
+)
+upstream_tokens = metrics.counter('upstream_tokens_total', 'Tokens used by Anthropic API calls, by model and type.')
+upstream_connections = metrics.counter(
+    'upstream_connections_total', 'Anthropic API requests by whether they opened a new connection or reused one.'
+)
+upstream_queue_seconds = metrics.histogram(
+    'upstream_queue_seconds', 'Time model calls waited for an upstream call slot, by lane (device or background).'
+)
+upstream_connect_seconds = metrics.histogram(
+    'upstream_connect_seconds', 'Time to open a connection to the Anthropic API, TLS included.',
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+testword_fallbacks = metrics.counter(
+    'story_testword_fallbacks_total', 'Test words chosen from the sentence instead of the model, by reason.'
+)
+story_model_requests = metrics.counter(
+    'story_model_requests_total', 'Story generation requests by the model chosen, grade and length.'
+)
+story_repairs = metrics.counter(
+    'story_reply_repairs_total', 'Story replies salvaged after being cut off, top-up requests and section retries by outcome.'
+)
+story_reading_grade = metrics.histogram(
+    'story_reading_grade', 'Average Flesch-Kincaid grade of the sentences of each generated story, by grade.',
+    buckets=(0, 1, 2, 3, 4, 5, 6, 7, 8, 10, 12)
+)
+story_hard_word_share = metrics.histogram(
+    'story_hard_word_share', 'Share of the words of each generated story above its grade word list, by grade.',
+    buckets=(0, 0.02, 0.05, 0.1, 0.15, 0.2, 0.3, 0.5)
+)
+story_test_word_levels = metrics.counter(
+    'story_test_word_levels_total', 'Test words by story grade and the grade word list level they belong to.'
+)
+story_prompt_tokens = metrics.counter(
+    'story_prompt_input_tokens_total', 'Story input tokens by system prompt variant ("grade/length") and type.'
+)
+story_fallbacks = metrics.counter(
+    'story_upstream_fallbacks_total', 'Ready-made stories served because the upstream was unavailable.'
+)
+
+
+def record_token_usage(model, usage, variant=None):
+    """
+    Count the tokens reported in a message's usage block, and the input
+    tokens by system prompt variant ("grade/length") when there is one.
+    """
+    for token_type in ('input_tokens', 'output_tokens', 'cache_read_input_tokens', 'cache_creation_input_tokens'):
+        count = getattr(usage, token_type, None)
+        if count:
+            upstream_tokens.inc(count, model=model, type=token_type[:-len('_tokens')])
+            if variant and token_type != 'output_tokens':
+                story_prompt_tokens.inc(count, variant=variant, type=token_type[:-len('_tokens')])
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.response_status = 500  # Replaced in after_request unless the view raised
+
+
+@app.after_request
+def remember_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def record_request_metrics(error=None):
+    # Teardown runs after a streamed body is finished, so streams are timed in full
+    start_time = g.pop('request_start', None)
+    if start_time is None:
+        return
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    status = g.pop('response_status', 500)
+    seconds = time.perf_counter() - start_time
+    http_requests.inc(route=route, method=request.method, status=status)
+    http_request_seconds.observe(seconds, route=route)
+    log_request(route, status, seconds)
+
+
+def log_request(route, status, seconds):
+    """
+    Write an access log line for a finished request. Successful requests
+    to the busy LOG_SAMPLED_ROUTES are only logged at LOG_SAMPLE_RATE.
+    """
+    sample_rate = LOG_SAMPLE_RATE if route in LOG_SAMPLED_ROUTES and status < 400 else 1.0
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    access_logger.info(
+        f"{request.method} {request.full_path.rstrip('?')} {status} {seconds * 1000:.1f}ms"
+        + (f" (sampled {sample_rate:g})" if sample_rate < 1.0 else ''),
+        extra={'http': {
+            'method': request.method,
+            'path': request.path,
+            'route': route,
+            'status': status,
+            'ms': round(seconds * 1000, 1),
+            'sample_rate': sample_rate
+        }}
+    )
+
+
+# ============================================================================
+# Concurrency Limits
+# ============================================================================
+
+class StoryServiceBusy(Exception):
+    """Raised when story generation is at capacity and the request should be retried later."""
+
+
+class StoryRateLimited(StoryServiceBusy):
+    """Raised when a device has started too many new stories; retry_after says when it may try again."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# The device a story is being generated for, so the upstream call queue can
+# take turns between devices. Work nobody is waiting on (the story pool,
+# batches) runs as 'background' and takes one turn between them.
+story_device = contextvars.ContextVar('story_device', default='background')
+
+# The time.monotonic() time a story request's model calls must be done by,
+# set when the request comes in, so that waiting for a call slot, the
+# outline, every section and a top-up all come out of one budget. Work
+# nobody is waiting on has none, and each of its calls gets the upstream
+# policy's total_deadline.
+story_deadline = contextvars.ContextVar('story_deadline', default=None)
+
+
+@contextmanager
+def generating_for(device, deadline=None):
+    """
+    Make the with block's model calls take device's turns in the upstream
+    call queue and, given a deadline, finish by it.
+    """
+    device_token = story_device.set(device or 'background')
+    deadline_token = story_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        story_deadline.reset(deadline_token)
+        story_device.reset(device_token)
+
+
+def time_left(default):
+    """Return the seconds left until the story request's deadline, or default outside a story request."""
+    deadline = story_deadline.get()
+    return default if deadline is None else deadline - time.monotonic()
+
+
+class ConcurrencyLimit:
+    """
+    Caps how many callers can be inside a section at once.
+
+    With wait_timeout=None a full limit rejects immediately; otherwise
+    callers queue for up to wait_timeout seconds before being rejected.
+    """
+
+    def __init__(self, name, limit, wait_timeout=None):
+        self.name = name
+        self.limit = limit
+        self.wait_timeout = wait_timeout
+        self.in_use = 0
+        self.rejected = 0
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        """Hold one slot for the duration of the with block."""
+        if self.wait_timeout is None:
+            acquired = self._semaphore.acquire(blocking=False)
+        else:
+            acquired = self._semaphore.acquire(timeout=self.wait_timeout)
+
+        if not acquired:
+            with self._lock:
+                self.rejected += 1
+            logger.warning(f"{self.name} limit of {self.limit} reached, rejecting request")
+            raise StoryServiceBusy('Story generator is busy. Please try again in a moment.')
+
+        with self._lock:
+            self.in_use += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        """Return usage statistics for the health endpoint."""
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'in_use': self.in_use,
+                'rejected': self.rejected
+            }
+
+
+class FairQueue:
+    """
+    Caps how many callers can be inside a section at once, queuing the rest
+    for up to wait_timeout seconds like ConcurrencyLimit, or until their
+    story request's deadline if that comes first. A freed slot goes to the
+    next device in turn rather than to the longest waiting call, so a
+    device with many calls queued can't hold up the others.
+    """
+
+    def __init__(self, name, limit, wait_timeout):
+        self.name = name
+        self.limit = limit
+        self.wait_timeout = wait_timeout
+        self.in_use = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._turns = OrderedDict()  # device -> deque of Events, next device first
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        """Hold one slot for the duration of the with block."""
+        device = story_device.get()
+        started = time.perf_counter()
+        with self._lock:
+            if self.in_use < self.limit and not self._turns:
+                self.in_use += 1
+                turn = None
+            else:
+                turn = threading.Event()
+                self._turns.setdefault(device, deque()).append(turn)
+                self.waiting += 1
+
+        wait_timeout = max(0.0, min(self.wait_timeout, time_left(self.wait_timeout)))
+        if turn is not None and not turn.wait(wait_timeout):
+            with self._lock:
+                # The slot may have been handed over just as the wait timed out
+                granted = turn.is_set()
+                if not granted:
+                    self._turns[device].remove(turn)
+                    if not self._turns[device]:
+                        del self._turns[device]
+                    self.waiting -= 1
+                    self.rejected += 1
+            if not granted:
+                logger.warning(f"{self.name} queue wait of {wait_timeout:.1f}s exceeded, rejecting request")
+                raise StoryServiceBusy('Story generator is busy. Please try again in a moment.')
+
+        upstream_queue_seconds.observe(time.perf_counter() - started,
+                                       lane='background' if device == 'background' else 'device')
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        """Hand the slot straight to the next device's oldest waiting call, or free it."""
+        with self._lock:
+            if not self._turns:
+                self.in_use -= 1
+                return
+            device, turns = next(iter(self._turns.items()))
+            turn = turns.popleft()
+            if turns:
+                self._turns.move_to_end(device)
+            else:
+                del self._turns[device]
+            self.waiting -= 1
+            turn.set()
+
+    def stats(self):
+        """Return usage and queue statistics for the health endpoint."""
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'in_use': self.in_use,
+                'waiting': self.waiting,
+                'waiting_devices': len(self._turns),
+                'rejected': self.rejected
+            }
+
+
+class DeviceRateLimit:
+    """
+    Token bucket per device (client IP) for story requests that need a new
+    story. A device may start burst stories back to back and then one every
+    60 / per_minute seconds; requests beyond that get StoryRateLimited with
+    the time until the next one is allowed. Ready-made stories are free.
+    """
+
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.allowed = 0
+        self.limited = 0
+        self._buckets = {}  # device -> (tokens, monotonic time they were counted)
+        self._pruned = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, device):
+        """Spend one of device's tokens, or raise StoryRateLimited if it has none."""
+        if self.rate <= 0:
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            tokens, counted = self._buckets.get(device, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - counted) * self.rate)
+            if tokens >= 1:
+                self._buckets[device] = (tokens - 1, now)
+                self.allowed += 1
+                retry_after = None
+            else:
+                self._buckets[device] = (tokens, now)
+                self.limited += 1
+                retry_after = (1 - tokens) / self.rate
+            if now - self._pruned > 60:
+                self._prune(now)
+
+        if retry_after is not None:
+            logger.warning(f"Rate limiting new stories from {device}, next in {retry_after:.1f}s")
+            raise StoryRateLimited(
+                f'Too many new stories from this device. Please try again in {math.ceil(retry_after)} seconds.',
+                retry_after
+            )
+
+    def _prune(self, now):
+        """Forget devices whose buckets have refilled; they start full anyway."""
+        self._buckets = {
+            device: (tokens, counted) for device, (tokens, counted) in self._buckets.items()
+            if tokens + (now - counted) * self.rate < self.burst
+        }
+        self._pruned = now
+
+    def stats(self):
+        """Return rate limit statistics for the health endpoint."""
+        with self._lock:
+            return {
+                'per_minute': self.rate * 60,
+                'burst': self.burst,
+                'devices': len(self._buckets),
+                'allowed': self.allowed,
+                'limited': self.limited
+            }
+
+
+# Story requests that need a new story are admitted up to STORY_WORKERS at
+# once and rejected beyond that, so they never take the threads reserved
+# for static files and health checks. Each device may only start new
+# stories at STORY_RATE_PER_MINUTE. Outbound model calls are capped
+# separately and queued fairly between devices; the story pool worker
+# shares that cap with live requests.
+story_workers = ConcurrencyLimit('Story workers', STORY_WORKERS)
+story_rate_limit = DeviceRateLimit(STORY_RATE_PER_MINUTE, STORY_RATE_BURST)
+upstream_calls = FairQueue('Upstream calls', UPSTREAM_CONCURRENCY, wait_timeout=UPSTREAM_QUEUE_TIMEOUT)
+
+
+# ============================================================================
+# Upstream Resilience
+# ============================================================================
+
+class UpstreamUnavailable(StoryServiceBusy):
+    """Raised when the Anthropic API is failing and a story can't be generated right now."""
+
+
+# Overloaded, rate limited or transient server errors are worth retrying
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+def is_retryable_error(error):
+    """True for timeouts, connection failures and transient API errors."""
+    if _client is None:
+        return False  # Without a client there was no API call to fail
+    from anthropic import APIConnectionError, APIStatusError
+
+    if isinstance(error, APIConnectionError):  # Includes APITimeoutError
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+class CircuitBreaker:
+    """
+    Stops calling the upstream while it is unhealthy.
+
+    After failure_threshold failures in a row the breaker opens and calls
+    fail fast. Once reset_timeout has passed, one trial call is let
+    through (half-open); its success closes the breaker, its failure opens
+    it again.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.times_opened = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """Return True if a call may go upstream now."""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = 'half-open'
+                self._trial_in_flight = False
+            if self.state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logger.info('Circuit breaker closed - upstream is healthy again')
+            self.state = 'closed'
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == 'half-open' or self.consecutive_failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.times_opened += 1
+                    logger.warning(f"Circuit breaker opened after {self.consecutive_failures} failures")
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def stats(self):
+        """Return breaker state for the health endpoint."""
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'times_opened': self.times_opened
+            }
+
+
+class UpstreamPolicy:
+    """
+    Runs upstream calls with jittered exponential backoff and a circuit breaker.
+
+    Every attempt gets its own timeout, and all attempts together must fit
+    inside total_deadline, or inside what is left of the story request's
+    deadline (see generating_for) if that is less. Only retryable errors
+    (see is_retryable_error) are retried; when retries or time run out, or
+    the breaker is open, UpstreamUnavailable is raised.
+    """
+
+    MIN_ATTEMPT_TIME = 2.0  # Don't start an attempt with less time than this left
+
+    def __init__(self, breaker, max_attempts, attempt_timeout, total_deadline, backoff_base, backoff_max):
+        self.breaker = breaker
+        self.max_attempts = max_attempts
+        self.attempt_timeout = attempt_timeout
+        self.total_deadline = total_deadline
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.counts = {'calls': 0, 'attempts': 0, 'retries': 0, 'exhausted': 0, 'short_circuited': 0,
+                       'out_of_time': 0}
+        self._lock = threading.Lock()
+
+    def call(self, fn):
+        """Call fn(timeout) until it succeeds, a non-retryable error occurs, or time runs out."""
+        self._count('calls')
+        total_deadline = min(self.total_deadline, time_left(self.total_deadline))
+        if total_deadline < self.MIN_ATTEMPT_TIME:
+            # Checked before the breaker, so a call that never starts isn't its trial call
+            self._count('out_of_time')
+            logger.error(f"Upstream call not started with {max(0.0, total_deadline):.1f}s of the request left")
+            raise UpstreamUnavailable('The story service is not responding right now. Please try again in a minute.')
+        if not self.breaker.allow_request():
+            self._count('short_circuited')
+            raise UpstreamUnavailable('The story service is temporarily unavailable. Please try again in a minute.')
+
+        deadline = time.monotonic() + total_deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            self._count('attempts')
+            timeout = max(self.MIN_ATTEMPT_TIME, min(self.attempt_timeout, deadline - time.monotonic()))
+            try:
+                result = fn(timeout)
+            except Exception as e:
+                if not is_retryable_error(e):
+                    # The upstream answered, so it is healthy even if the request was bad
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+
+                delay = self._backoff(attempt, e)
+                out_of_time = time.monotonic() + delay + self.MIN_ATTEMPT_TIME > deadline
+                if attempt >= self.max_attempts or out_of_time or not self.breaker.allow_request():
+                    self._count('exhausted')
+                    logger.error(f"Upstream call failed after {attempt} attempt(s): {e}")
+                    raise UpstreamUnavailable(
+                        'The story service is not responding right now. Please try again in a minute.'
+                    ) from e
+
+                self._count('retries')
+                logger.warning(f"Upstream attempt {attempt} failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            return result
+
+    def stats(self):
+        """Return retry counts and breaker state for the health endpoint."""
+        with self._lock:
+            stats = dict(self.counts)
+        stats['breaker'] = self.breaker.stats()
+        return stats
+
+    def _backoff(self, attempt, error):
+        """Full-jitter exponential backoff, stretched to honour a Retry-After header."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        try:
+            delay = max(delay, float(retry_after))
+        except (TypeError, ValueError):
+            pass
+        return delay
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+
+upstream_breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+upstream_policy = UpstreamPolicy(
+    upstream_breaker,
+    max_attempts=UPSTREAM_MAX_ATTEMPTS,
+    attempt_timeout=UPSTREAM_ATTEMPT_TIMEOUT,
+    total_deadline=UPSTREAM_TOTAL_DEADLINE,
+    backoff_base=UPSTREAM_BACKOFF_BASE,
+    backoff_max=UPSTREAM_BACKOFF_MAX
+)
+
+
+# ============================================================================
+# Upstream HTTP
+# ============================================================================
+
+def import_httpx():
+    """Return the HTTP library the anthropic SDK is built on."""
+    try:
+        import httpx
+    except ImportError:
+        import httpx2 as httpx  # Newer anthropic releases use httpx2
+    return httpx
+
+
+class UpstreamHttp:
+    """
+    The connection pool the Anthropic client sends its requests over.
+
+    Idle connections are kept for keepalive_expiry seconds instead of the
+    SDK's 5. A warmup thread opens a connection at startup with a free
+    request (listing one model), then sends one whenever the API hasn't
+    been called for warmup_interval seconds, but only within warmup_window
+    seconds of the last real call. A story in the middle of a session
+    doesn't pay for a new TCP and TLS handshake, and an idle server
+    doesn't call the API at all.
+    HTTP/2 is used when the h2 package is installed, so concurrent calls
+    share one connection. Every request is traced to count whether it
+    opened a connection or reused one.
+    """
+
+    def __init__(self, pool_size, keepalive_expiry, connect_timeout, http2, warmup_interval, warmup_window):
+        self.pool_size = pool_size
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.http2 = http2 and importlib.util.find_spec('h2') is not None
+        self.warmup_interval = warmup_interval
+        self.warmup_window = warmup_window
+        self.warmups = 0
+        self.warmup_failures = 0
+        self._last_request = 0.0
+        self._last_call = float('-inf')  # Last request that wasn't a warmup
+        self._lock = threading.Lock()
+
+    def build_client(self):
+        """Return an HTTP client for the Anthropic client, with this pool's limits and tracing."""
+        from anthropic import DefaultHttpxClient
+
+        httpx = import_httpx()
+        return DefaultHttpxClient(
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+            timeout=self.timeout(UPSTREAM_ATTEMPT_TIMEOUT),
+            http2=self.http2,
+            event_hooks={'request': [self._trace_request]}
+        )
+
+    def timeout(self, seconds):
+        """Return the timeout for a call of at most seconds, with a shorter limit on connecting."""
+        return import_httpx().Timeout(seconds, connect=min(self.connect_timeout, seconds))
+
+    def start(self):
+        """Open a connection now, and keep one open between calls while stories are being asked for."""
+        if self.warmup_interval <= 0:
+            return
+
+        def run():
+            self._warm()
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    idle = now - self._last_request
+                    active = now - self._last_call < self.warmup_window
+                if idle >= self.warmup_interval:
+                    if active:
+                        self._warm()
+                    idle = 0
+                time.sleep(self.warmup_interval - idle)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def stats(self):
+        """Return pool settings and warmup counts for the health endpoint."""
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'keepalive_expiry': self.keepalive_expiry,
+                'http2': self.http2,
+                'warmup_window': self.warmup_window,
+                'warmups': self.warmups,
+                'warmup_failures': self.warmup_failures
+            }
+
+    def _warm(self):
+        try:
+            get_client().models.list(limit=1, timeout=self.timeout(self.connect_timeout * 2))
+        except Exception as e:
+            with self._lock:
+                self.warmup_failures += 1
+            logger.debug(f"Upstream warmup failed: {e}")
+            return
+        with self._lock:
+            self.warmups += 1
+
+    def _trace_request(self, request):
+        """Attach a trace to a request that records how it got its connection."""
+        with self._lock:
+            self._last_request = time.monotonic()
+            if not request.url.path.endswith('/models'):
+                self._last_call = self._last_request
+        connect_started = None
+
+        def trace(event, info):
+            nonlocal connect_started
+            if event == 'connection.connect_tcp.started':
+                connect_started = time.perf_counter()
+            elif event.endswith('.send_request_headers.started'):
+                if connect_started is None:
+                    upstream_connections.inc(connection='reused')
+                else:
+                    upstream_connections.inc(connection='new')
+                    upstream_connect_seconds.observe(time.perf_counter() - connect_started)
+
+        request.extensions['trace'] = trace
+
+
+upstream_http = UpstreamHttp(
+    pool_size=UPSTREAM_POOL_SIZE,
+    keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+    connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+    http2=UPSTREAM_HTTP2,
+    warmup_interval=UPSTREAM_WARMUP_INTERVAL,
+    warmup_window=UPSTREAM_WARMUP_WINDOW
+)
+
+
+# ============================================================================
+# Model Routing and Token Budgets
+# ============================================================================
+
+def choose_story_model(grade_level, length):
+    """Return the model for a story: the fast model for STORY_FAST_LENGTHS, else STORY_MODEL."""
+    if STORY_FAST_MODEL and length in STORY_FAST_LENGTHS:
+        return STORY_FAST_MODEL
+    return STORY_MODEL
+
+
+class StoryTokenBudget:
+    """
+    Sizes max_tokens for each grade and length from the number of
+    sentences asked for.
+
+    Budgets start from the grade's tokens_per_sentence estimate and then
+    follow the largest tokens-per-sentence rate seen in recent replies,
+    plus a safety margin, so long stories aren't cut off and short ones
+    don't carry a 4000 token allowance.
+    """
+
+    MARGIN = 1.3
+    OVERHEAD_TOKENS = 100  # Title and JSON framing
+    MIN_TOKENS = 1024
+    HISTORY = 20  # Recent replies remembered per grade and length
+
+    def __init__(self, max_tokens_cap):
+        self.max_tokens_cap = max_tokens_cap
+        self.truncated = 0
+        self._rates = {}  # (grade_level, length) -> recent tokens-per-sentence rates
+        self._lock = threading.Lock()
+
+    def budget(self, grade_level, length, sentence_count=None):
+        """Return max_tokens for a story, or for sentence_count sentences of one."""
+        config = GRADE_CONFIGS[grade_level]
+        if sentence_count is None:
+            sentence_count = config['sentence_counts'][length]
+        with self._lock:
+            rates = self._rates.get((grade_level, length))
+            rate = max(rates) if rates else config['tokens_per_sentence']
+        tokens = int(rate * sentence_count * self.MARGIN) + self.OVERHEAD_TOKENS
+        return max(self.MIN_TOKENS, min(self.max_tokens_cap, tokens))
+
+    def observe(self, grade_level, length, sentence_count, output_tokens, stop_reason=None):
+        """Learn from a reply's output token count and number of complete sentences."""
+        if stop_reason == 'max_tokens':
+            with self._lock:
+                self.truncated += 1
+            logger.warning(f"{length} {grade_level} story hit its max_tokens budget")
+        if not sentence_count or not output_tokens:
+            return
+        with self._lock:
+            rates = self._rates.setdefault((grade_level, length), deque(maxlen=self.HISTORY))
+            rates.append(output_tokens / sentence_count)
+
+    def stats(self):
+        """Return the current budgets for the health endpoint."""
+        budgets = {
+            f"{grade_level}/{length}": self.budget(grade_level, length)
+            for grade_level, config in GRADE_CONFIGS.items()
+            for length in config['sentence_counts']
+        }
+        with self._lock:
+            return {'budgets': budgets, 'truncated': self.truncated}
+
+
+story_token_budget = StoryTokenBudget(STORY_MAX_TOKENS_CAP)
+
+
+# ============================================================================
+# Test Word Selection
+# ============================================================================
+
+# The 100 most frequent English words, most frequent first (Fry's list).
+# They are poor spelling words at every grade, and the more frequent the worse.
+COMMON_WORDS = (
+    'the of and a to in is you that it he was for on are as with his they i '
+    'at be this have from or one had by word but not what all were we when your can '
+    'said there use an each which she do how their if will up other about out many then '
+    'them these so some her would make like him into time has look two more write go see '
+    'number no way could people my than first water been call who oil its now find long '
+    'down day did get come made may part'
+).split()
+COMMON_WORD_RANKS = {word: rank for rank, word in enumerate(COMMON_WORDS)}
+
+# Punctuation and digits that separate words. Apostrophes inside words are
+# kept so that "dragon's" and "don't" stay whole; quote marks are not.
+# Test words are matched with hyphenated words kept whole as well.
+BREAK_CHARACTERS = '!"#$%&()*+,./:;<=>?@[\\]^_`{|}~“”‘«»¿¡—–…0123456789\t\n\r'
+WORD_BREAKS = str.maketrans(dict.fromkeys(BREAK_CHARACTERS + '-', ' '))
+HYPHENATED_WORD_BREAKS = str.maketrans(dict.fromkeys(BREAK_CHARACTERS, ' '))
+QUOTE_PATTERN = re.compile(r"['’](?:(?![^\W\d_])|(?<![^\W\d_]['’]))")  # Not between two letters
+QUOTES = "'’"
+SENTENCE_BREAK = '\x1e'  # Joins a story's sentences so they are tokenized in one go
+
+WordEntry = namedtuple('WordEntry', 'word length rank above_grade')
+
+
+def score_test_word(entry, config):
+    """
+    Default test word score for a WordEntry; higher is better.
+
+    Words of 3 letters up to the grade's max_word_length come first, the
+    longer the better. Within that, words from the grade's own word list
+    gain a point, words above it lose points by how far above they are
+    and frequent function words lose points.
+    """
+    max_length = config['max_word_length']
+    score = 10.0 if 3 <= entry.length <= max_length else 0.0
+    score += min(entry.length, max_length) / max_length
+    if entry.above_grade > 0:
+        score -= 3.0 * entry.above_grade
+    elif entry.above_grade == 0:
+        score += 1.0
+    if entry.rank is not None:
+        score -= 5.0 * (1 - entry.rank / len(COMMON_WORDS))
+    return score
+
+
+class WordRanks(dict):
+    """
+    Test word sort keys for one scorer and grade, best first.
+
+    A word maps to (sort key, lowercase test word, test word), or None if
+    it can't be a test word. Each word is scored with scorer(entry, config)
+    the first time it is looked up and kept across stories, up to
+    CACHE_SIZE words, so a scorer must depend only on its arguments.
+    Quotes around a word are dropped and possessives count as their base
+    word ("dragon's" is "dragon"); contractions are never test words.
+    """
+
+    CACHE_SIZE = 65536
+
+    def __init__(self, scorer, grade_level):
+        super().__init__()
+        self.scorer = scorer
+        self.config = GRADE_CONFIGS[grade_level]
+        self.grade = list(GRADE_CONFIGS).index(grade_level)
+
+    def __missing__(self, token):
+        if len(self) >= self.CACHE_SIZE:
+            self.clear()
+        word = token.strip(QUOTES)
+        if word.endswith(("'s", '’s')):
+            word = word[:-2]
+        rank = None
+        if word.isalpha():
+            base = word.lower()
+            entry = WordEntry(base, len(base), COMMON_WORD_RANKS.get(base), word_levels.level(base) - self.grade)
+            rank = (-self.scorer(entry, self.config), base, word)
+        self[token] = rank
+        return rank
+
+
+SCORE = itemgetter(0)  # Of WordRanks values
+BASE = itemgetter(1)
+word_ranks = {}  # (scorer, grade level) -> WordRanks
+
+
+class StoryWordIndex:
+    """
+    The words of one story, indexed as its sentences arrive.
+
+    Each batch of sentences added (a whole reply, a section or a streamed
+    sentence) is tokenized with a few string operations over all of them
+    at once, and never again. By position, the index keeps every
+    sentence's words as written, its lowercase words for scoring, and its
+    lowercase words with a space on both sides, hyphenated words both
+    whole and split; for the story, the test words used so far and how
+    often each word is used, counted when a choice needs it. Checking a
+    test word is a substring test, and choosing one ranks a sentence's
+    words with WordRanks.
+    """
+
+    def __init__(self, grade_level, scorer=score_test_word):
+        self.grade_level = grade_level
+        self.ranks = word_ranks.get((scorer, grade_level))
+        if self.ranks is None:
+            self.ranks = word_ranks.setdefault((scorer, grade_level), WordRanks(scorer, grade_level))
+        self.used_words = set()  # Lowercase test words of the story so far
+        self._lines = []  # Each sentence's words as written, hyphenated words split
+        self._words = []  # Each sentence's lowercase words without quotes, for scoring
+        self._plain_lines = []  # Each sentence's lowercase words, spaced for substring tests
+        self._counts = WordCounts()  # Lowercase word -> times the story uses it
+        self._counted = 0  # Sentences in _counts
+
+    def __len__(self):
+        return len(self._lines)
+
+    def add(self, texts):
+        """Index the story's next sentences."""
+        if len(texts) == 1:
+            joined = texts[0].replace(SENTENCE_BREAK, ' ')
+        else:
+            joined = SENTENCE_BREAK.join(texts)
+            if joined.count(SENTENCE_BREAK) != len(texts) - 1:
+                joined = SENTENCE_BREAK.join(text.replace(SENTENCE_BREAK, ' ') for text in texts)
+        joined = joined.translate(HYPHENATED_WORD_BREAKS)
+        lower = joined.lower()
+        hyphenated = '-' in joined
+        if hyphenated:
+            joined = joined.replace('-', ' ')
+        self._lines.extend(joined.split(SENTENCE_BREAK))
+
+        words = lower.replace('-', ' ') if hyphenated else lower
+        quoted = "'" in lower or '’' in lower
+        if quoted:
+            words = QUOTE_PATTERN.sub(' ', words)
+        self._words.extend([line.split() for line in words.split(SENTENCE_BREAK)])
+
+        # Every word in a line has a space on both sides, and without
+        # quotes "dragon's" reads "dragon s", so a substring test finds the possessive
+        plain = f' {lower} '.replace(SENTENCE_BREAK, f' {SENTENCE_BREAK} ')
+        if quoted:
+            plain = plain.replace("'", ' ').replace('’', ' ')
+        plain_lines = plain.split(SENTENCE_BREAK)
+        if hyphenated:
+            plain_lines = [line + line.replace('-', ' ') if '-' in line else line for line in plain_lines]
+        self._plain_lines.extend(plain_lines)
+
+    def words(self, index):
+        """Return the lowercase words of sentence index, as score_sentence splits them."""
+        return self._words[index]
+
+    def contains(self, index, word):
+        """
+        Return True if word is one of the words of sentence index,
+        possessives and hyphenated words included. Words with an
+        apostrophe never are.
+        """
+        return f' {word.lower()} ' in self._plain_lines[index]
+
+    def uses(self, word):
+        """Return how many times the story so far uses a lowercase word."""
+        if self._counted < len(self._words):
+            self._counts.update(chain.from_iterable(self._words[self._counted:]))
+            self._counted = len(self._words)
+        return self._counts[word]
+
+    def choose(self, index):
+        """
+        Return the best word of sentence index that isn't in used_words,
+        or its best word if every word is used, and add it to used_words.
+        Ties go to the word the story uses least, then to the earlier word.
+        """
+        tokens = self._lines[index].split()
+        ranked = list(filter(None, map(self.ranks.__getitem__, tokens)))
+        used_words = self.used_words
+        unused = [rank for rank in ranked if rank[1] not in used_words] or ranked
+        if unused:
+            scores = list(map(SCORE, unused))
+            best = min(scores)
+            if scores.count(best) == 1:
+                word = unused[scores.index(best)][2]
+            else:
+                _, _, position = min(zip(scores, map(self.uses, map(BASE, unused)), count()))
+                word = unused[position][2]
+        else:
+            word = tokens[0].strip(QUOTES) if tokens else ''
+        used_words.add(word.lower())
+        return word
+
+
+def choose_test_words(index, sentences, start):
+    """
+    Return a test word for each of sentences, which are the sentences of
+    index (their story's StoryWordIndex) from start on. The model's test
+    word is kept when it is in its sentence and not used earlier in the
+    story. The others are chosen with index.choose once every kept word
+    is known, so that none is taken from a later sentence.
+    """
+    used_words = index.used_words
+    invalid = []
+    duplicate = []
+    test_words = []
+    for position, sentence_obj in enumerate(sentences, start):
+        test_word = sentence_obj.get('testWord', '')
+        if not test_word or not index.contains(position, test_word):
+            invalid.append(position)
+        elif test_word.lower() in used_words:
+            duplicate.append(position)
+        else:
+            used_words.add(test_word.lower())
+        test_words.append(test_word)
+
+    if not invalid and not duplicate:
+        return test_words
+    for position in sorted(invalid + duplicate):
+        test_words[position - start] = index.choose(position)
+
+    for reason, positions in (('invalid', invalid), ('duplicate', duplicate)):
+        if positions:
+            testword_fallbacks.inc(len(positions), reason=reason)
+            chosen = ', '.join(f"{position + 1} ('{test_words[position - start]}')" for position in positions)
+            logger.warning(f"{reason.capitalize()} testWord replaced in sentences {chosen}")
+    return test_words
+
+
+def process_sentences(sentences, index):
+    """
+    Add sentences to index, the StoryWordIndex of their story, and give
+    every one its test word (see choose_test_words) and its scores, and
+    queue its audio. The sentences are tokenized once, for both.
+    """
+    if not sentences:
+        return []
+    grade_level = index.grade_level
+    start = len(index)
+    texts = [sentence_obj.get('text', '') for sentence_obj in sentences]
+    index.add(texts)
+    test_words = choose_test_words(index, sentences, start)
+
+    processed = []
+    for position, (text, test_word) in enumerate(zip(texts, test_words), start):
+        # For 4th grade, only mark every other sentence for testing
+        include_test = True
+        if grade_level == '4th':
+            include_test = (position % 2 == 0)  # Test even-indexed sentences (0, 2, 4, ...)
+
+        processed.append({
+            'text': text,
+            'testWord': test_word if include_test else None,
+            'scores': score_sentence(text, test_word if include_test else None, grade_level, index.words(position))
+        })
+        speech.queue(processed[-1])
+    return processed
+
+
+# ============================================================================
+# Story Difficulty
+# ============================================================================
+
+VOWEL_GROUPS = re.compile(r'[aeiouy]+')
+INFLECTIONS = ('ies', 'ied', 'ing', 'est', 'es', 'ed', 'er', 'ly', 's')  # Longest first
+
+
+@lru_cache(maxsize=65536)
+def count_syllables(word):
+    """Estimate the syllables in a lowercase word from its vowel groups."""
+    count = len(VOWEL_GROUPS.findall(word))
+    if word.endswith('e') and not word.endswith(('le', 'ee')) and count > 1:
+        count -= 1  # Silent e, as in "cake"
+    return max(1, count)
+
+
+class WordLevels:
+    """
+    Grade word lists, loaded once at startup.
+
+    Each file in the word list directory holds the words a reader knows by
+    the end of a grade (pre-k.txt, 2nd.txt, 4th.txt). A word's level is the
+    index of the first grade that lists it, in GRADE_CONFIGS order; words
+    in no list are estimated from their syllables and length, up to one
+    level past the hardest grade. The words are kept in one sorted tuple
+    with an array of levels beside it and looked up by bisection, so the
+    lists cost a few bytes a word. Levels are remembered for the words
+    stories actually use, up to CACHE_SIZE of them.
+    """
+
+    CACHE_SIZE = 65536
+
+    def __init__(self, directory, grades):
+        self.grades = list(grades)
+        words = {}
+        for level, grade in enumerate(self.grades):
+            path = Path(directory) / f'{grade.lower()}.txt'
+            try:
+                lines = path.read_text(encoding='utf-8').splitlines()
+            except OSError as e:
+                logger.warning(f"Could not load word list {path}: {e}")
+                continue
+            for line in lines:
+                if line.startswith('#'):
+                    continue
+                for word in line.lower().split():
+                    words.setdefault(word, level)
+        self.words = tuple(sorted(words))
+        self.levels = array('B', (words[word] for word in self.words))
+        # level(word) is cached with lru_cache, so it can be mapped over words without a Python call each
+        self.level = lru_cache(maxsize=self.CACHE_SIZE)(self._level)
+
+    def _level(self, word):
+        """Return the level of a lowercase word, matching inflected forms through their base word."""
+        level = self._listed(word)
+        if level is not None:
+            return level
+        for ending in INFLECTIONS:
+            if word.endswith(ending) and len(word) - len(ending) >= 3:
+                base = word[:-len(ending)]
+                level = self._listed(base)
+                if level is None and ending in ('ies', 'ied'):
+                    level = self._listed(base + 'y')
+                if level is None and ending in ('ed', 'ing', 'er', 'est'):
+                    level = self._listed(base + 'e')  # "baked", "baking"
+                    if level is None and len(base) > 3 and base[-1] == base[-2]:
+                        level = self._listed(base[:-1])  # "hopped", "running"
+                if level is not None:
+                    return level
+        return self.estimate(word)
+
+    def estimate(self, word):
+        """Return the level of a word in no list, from its syllables and length."""
+        syllables = count_syllables(word)
+        if syllables == 1 and len(word) <= 5:
+            return 0
+        if syllables <= 2 and len(word) <= 8:
+            return min(1, len(self.grades) - 1)
+        if syllables <= 3 and len(word) <= 11:
+            return len(self.grades) - 1
+        return len(self.grades)
+
+    def level_name(self, level):
+        """Return the grade a level belongs to, or 'beyond' past the hardest grade."""
+        return self.grades[level] if level < len(self.grades) else 'beyond'
+
+    def stats(self):
+        """Return word list statistics for the health endpoint."""
+        return {
+            'words': len(self.words),
+            'by_grade': {grade: self.levels.count(level) for level, grade in enumerate(self.grades)}
+        }
+
+    def _listed(self, word):
+        i = bisect_left(self.words, word)
+        if i < len(self.words) and self.words[i] == word:
+            return self.levels[i]
+        return None
+
+
+word_levels = WordLevels(WORD_LISTS_DIR, GRADE_CONFIGS)
+
+
+def score_sentence(text, test_word, grade_level, words=None):
+    """
+    Score one sentence for a grade. words are its lowercase words if they
+    have been split already (see StoryWordIndex.words).
+
+    Returns readingGrade, the Flesch-Kincaid grade of the sentence;
+    words and hardWords, its word count and how many of them are above
+    the grade's word list level; and testWordLevel, the grade the test
+    word belongs to (None without a test word).
+    """
+    grade = word_levels.grades.index(grade_level)
+    if words is None:
+        words = QUOTE_PATTERN.sub(' ', text.translate(WORD_BREAKS)).lower().split()
+    syllables = sum(map(count_syllables, words))
+    hard_words = sum(map(grade.__lt__, map(word_levels.level, words)))  # Levels above the grade
+
+    reading_grade = 0.0
+    if words:
+        reading_grade = max(0.0, 0.39 * len(words) + 11.8 * syllables / len(words) - 15.59)
+    return {
+        'readingGrade': round(reading_grade, 1),
+        'words': len(words),
+        'hardWords': hard_words,
+        'testWordLevel': word_levels.level_name(word_levels.level(test_word.lower())) if test_word else None
+    }
+
+
+def score_story(sentences, grade_level):
+    """
+    Summarize the sentence scores of a story and record them in the
+    difficulty metrics. fitsGrade is True when the average sentence
+    reads at or below the grade's max_reading_grade and no more than
+    MAX_HARD_WORD_SHARE of the words are above the grade's lists.
+    Sentences without scores (from before scoring existed) are skipped.
+    """
+    scores = [sentence['scores'] for sentence in sentences if sentence.get('scores')]
+    words = sum(score['words'] for score in scores)
+    reading_grade = sum(score['readingGrade'] for score in scores) / len(scores) if scores else 0.0
+    hard_word_share = sum(score['hardWords'] for score in scores) / words if words else 0.0
+    test_word_levels = {}
+    for score in scores:
+        if score['testWordLevel']:
+            test_word_levels[score['testWordLevel']] = test_word_levels.get(score['testWordLevel'], 0) + 1
+
+    story_reading_grade.observe(reading_grade, grade=grade_level)
+    story_hard_word_share.observe(hard_word_share, grade=grade_level)
+    for level, count in test_word_levels.items():
+        story_test_word_levels.inc(count, grade=grade_level, level=level)
+
+    return {
+        'readingGrade': round(reading_grade, 1),
+        'hardWordShare': round(hard_word_share, 3),
+        'testWordLevels': test_word_levels,
+        'fitsGrade': (reading_grade <= GRADE_CONFIGS[grade_level]['max_reading_grade']
+                      and hard_word_share <= MAX_HARD_WORD_SHARE)
+    }
+
+
+# ============================================================================
+# Story Reply Parsing
+# ============================================================================
+
+class StoryStreamParser:
+    """
+    Incremental parser for a story reply that arrives in chunks.
+
+    The title and each sentence object are returned as soon as they are
+    complete, without waiting for the rest of the JSON document.
+    """
+
+    TITLE_PATTERN = re.compile(r'"title"\s*:\s*("(?:[^"\\]|\\.)*")')
+    SENTENCES_PATTERN = re.compile(r'"sentences"\s*:\s*\[')
+
+    def __init__(self):
+        self.text = ''
+        self.title = None
+        self.finished = False
+        self._pos = None  # Scan position inside the sentences array
+
+    def feed(self, chunk):
+        """Add a chunk of reply text and return any newly completed sentence objects."""
+        self.text += chunk
+
+        if self.title is None:
+            match = self.TITLE_PATTERN.search(self.text)
+            if match:
+                self.title = json.loads(match.group(1))
+
+        if self._pos is None:
+            match = self.SENTENCES_PATTERN.search(self.text)
+            if not match:
+                return []
+            self._pos = match.end()
+
+        sentences = []
+        while not self.finished:
+            sentence_obj = self._next_sentence()
+            if sentence_obj is None:
+                break
+            sentences.append(sentence_obj)
+        return sentences
+
+    def _next_sentence(self):
+        """Return the next complete sentence object, or None if more text is needed."""
+        text = self.text
+        while self._pos < len(text):
+            char = text[self._pos]
+            if char == ']':
+                self.finished = True
+                return None
+            if char != '{':
+                self._pos += 1  # Skip commas and whitespace between objects
+                continue
+
+            end = self._find_object_end(self._pos)
+            if end is None:
+                return None
+
+            raw_object = text[self._pos:end]
+            self._pos = end
+            try:
+                return json.loads(raw_object)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping malformed sentence in stream: {raw_object[:80]}")
+        return None
+
+    def _find_object_end(self, start):
+        """Return the index just past the object starting at start, or None if incomplete."""
+        depth = 0
+        in_string = False
+        escaped = False
+        for i in range(start, len(self.text)):
+            char = self.text[i]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == '\\':
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+                if depth == 0:
+                    return i + 1
+        return None
+
+
+def clean_sentence(sentence_obj):
+    """
+    Return a sentence object in the expected shape, or None if it has no
+    usable text. A missing or non-string testWord becomes '' so that
+    process_sentences picks one.
+    """
+    if not isinstance(sentence_obj, dict):
+        return None
+    text = sentence_obj.get('text')
+    if not isinstance(text, str) or not text.strip():
+        return None
+    test_word = sentence_obj.get('testWord')
+    return {'text': text.strip(), 'testWord': test_word if isinstance(test_word, str) else ''}
+
+
+def clean_story(title, sentences):
+    """Validate a parsed story, dropping malformed sentences. Returns (title, sentences)."""
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError("Invalid story structure: missing title")
+
+    cleaned = []
+    for sentence_obj in sentences:
+        sentence = clean_sentence(sentence_obj)
+        if sentence is None:
+            logger.warning(f"Skipping malformed sentence: {str(sentence_obj)[:80]}")
+        else:
+            cleaned.append(sentence)
+
+    if not cleaned:
+        raise ValueError("Invalid story structure: no sentences")
+    return title.strip(), cleaned
+
+
+def find_json_object(text, list_key):
+    """
+    Return the first JSON object in text that has a title and a list under
+    list_key, wherever it is in the text, or None if there isn't one.
+    """
+    decoder = json.JSONDecoder()
+    start = text.find('{')
+    while start != -1:
+        try:
+            obj, end = decoder.raw_decode(text, start)
+        except json.JSONDecodeError:
+            start = text.find('{', start + 1)
+            continue
+        if isinstance(obj, dict) and 'title' in obj and isinstance(obj.get(list_key), list):
+            return obj
+        start = text.find('{', end)
+    return None
+
+
+def parse_story_reply(text):
+    """
+    Pull the story out of a model reply.
+
+    Returns (title, sentences, complete). The first JSON object with a
+    title and a sentences list is used wherever it is in the reply, so
+    code fences, a preamble or trailing text don't matter. If there is no
+    complete object, e.g. because the reply was cut off at max_tokens,
+    the title and every complete sentence are salvaged and complete is
+    False. Raises ValueError if no title and sentences can be recovered.
+    """
+    story_data = find_json_object(text, 'sentences')
+    if story_data is not None:
+        return clean_story(story_data['title'], story_data['sentences']) + (True,)
+
+    parser = StoryStreamParser()
+    sentences = parser.feed(text)
+    if parser.title is None:
+        raise ValueError("Invalid story structure: missing title or sentences")
+    return clean_story(parser.title, sentences) + (False,)
+
+
+class SystemPrompts:
+    """
+    The story system prompt for each grade and sentence count, built once.
+
+    The variants for every grade and length are formatted at import; the
+    other counts sections and top-ups ask for are formatted on first use
+    and kept. They are not marked for prompt caching: at about 260 tokens
+    they are far below the size the API caches (1024 tokens for Sonnet,
+    more for Haiku), which count_tokens() can check with the API.
+    """
+
+    def __init__(self, template, grade_configs):
+        self.template = template
+        self.grade_configs = grade_configs
+        self._blocks = {}
+        self._lock = threading.Lock()
+        for grade_level, config in grade_configs.items():
+            for sentence_count in config['sentence_counts'].values():
+                self.get(grade_level, sentence_count)
+
+    def get(self, grade_level, sentence_count):
+        """Return the system blocks for a grade and sentence count."""
+        key = (grade_level, sentence_count)
+        blocks = self._blocks.get(key)
+        if blocks is None:
+            config = self.grade_configs[grade_level]
+            text = self.template.format(
+                sentence_count=sentence_count,
+                vocabulary_level=config['vocabulary_level'],
+                word_description=config['description']
+            )
+            blocks = [{'type': 'text', 'text': text}]
+            with self._lock:
+                blocks = self._blocks.setdefault(key, blocks)
+        return blocks
+
+    def count_tokens(self):
+        """
+        Count the tokens of each grade and length variant for the model that
+        writes it. Token counting is free, but takes one API call per
+        variant, so this only runs when asked for (--count-prompt-tokens).
+        Returns {"grade/length": (model, tokens)}.
+        """
+        counts = {}
+        for grade_level, config in self.grade_configs.items():
+            for length, sentence_count in config['sentence_counts'].items():
+                model = choose_story_model(grade_level, length)
+                blocks = self.get(grade_level, sentence_count)
+                # The count includes a one-word user message the API requires
+                result = get_client().messages.count_tokens(
+                    model=model,
+                    system=blocks,
+                    messages=[{'role': 'user', 'content': 'story'}]
+                )
+                counts[f'{grade_level}/{length}'] = (model, result.input_tokens)
+        return counts
+
+    def stats(self):
+        """Return prompt statistics for the health endpoint."""
+        with self._lock:
+            return {'variants': len(self._blocks)}
+
+
+system_prompts = SystemPrompts(SYSTEM_PROMPT_TEMPLATE, GRADE_CONFIGS)
+
+
+def build_story_prompts(grade_level, length, prompt, sentence_count=None):
+    """
+    Return the (system blocks, user_prompt) pair for a story request.
+    sentence_count overrides the count for the grade and length.
+    """
+    sentence_count = sentence_count or GRADE_CONFIGS[grade_level]['sentence_counts'][length]
+    user_prompt = USER_PROMPT_TEMPLATE.format(prompt=prompt)
+    return system_prompts.get(grade_level, sentence_count), user_prompt
+
+
+def request_story_message(model, max_tokens, system_prompt, user_prompt, timer=None, variant=None):
+    """
+    Send one story request through the upstream call limit and retry
+    policy, record its token usage and return the message. variant names
+    the grade and length of a story system prompt, for its token counts.
+    """
+    with upstream_calls.slot():
+        if timer:
+            timer.mark('upstream_wait')
+        message = upstream_policy.call(lambda timeout: get_client().messages.create(
+            model=model,
+            max_tokens=max_tokens,
+            temperature=1.0,
+            system=system_prompt,
+            messages=[
+                {"role": "user", "content": user_prompt}
+            ],
+            timeout=upstream_http.timeout(timeout)
+        ))
+    if timer:
+        timer.mark('upstream_call')
+    record_token_usage(model, message.usage, variant)
+    return message
+
+
+def top_up_story(grade_level, length, title, sentences, missing, used_words):
+    """
+    Ask for the missing sentences of a story that came back short and
+    return them as cleaned sentence objects. Returns what it could get,
+    possibly nothing, rather than failing a story that is already usable.
+    """
+    system_prompt, _ = build_story_prompts(grade_level, None, '', sentence_count=missing)
+    user_prompt = TOP_UP_PROMPT_TEMPLATE.format(
+        title=title,
+        story_so_far=' '.join(sentence['text'] for sentence in sentences),
+        missing=missing,
+        used_words=', '.join(sorted(used_words))
+    )
+
+    logger.info(f"Topping up \"{title}\" with {missing} more sentences")
+    try:
+        message = request_story_message(
+            choose_story_model(grade_level, length),
+            story_token_budget.budget(grade_level, length, sentence_count=missing),
+            system_prompt,
+            user_prompt,
+            variant=f'{grade_level}/{length}'
+        )
+        _, new_sentences, _ = parse_story_reply(message.content[0].text)
+    except Exception as e:
+        story_repairs.inc(kind='top_up_failed')
+        logger.warning(f"Could not top up \"{title}\", keeping {len(sentences)} sentences: {e}")
+        return []
+
+    story_repairs.inc(kind='topped_up')
+    return new_sentences[:missing]
+
+
+def use_story_sections(grade_level, length):
+    """True if the story is long enough to be written in parallel sections."""
+    sentence_count = GRADE_CONFIGS[grade_level]['sentence_counts'][length]
+    return 0 < STORY_SECTIONS_MIN_SENTENCES <= sentence_count
+
+
+def request_story_outline(grade_level, prompt, parts):
+    """Ask for a title and a plan of the story in parts. Returns (title, section summaries)."""
+    config = GRADE_CONFIGS[grade_level]
+    system_prompt = OUTLINE_SYSTEM_PROMPT_TEMPLATE.format(vocabulary_level=config['vocabulary_level'], parts=parts)
+    # The plan is short, so the fast model does it when there is one
+    message = request_story_message(STORY_FAST_MODEL or STORY_MODEL, 1024, system_prompt,
+                                    USER_PROMPT_TEMPLATE.format(prompt=prompt))
+
+    outline = find_json_object(message.content[0].text, 'sections')
+    if outline is None:
+        logger.error(f"Response text: {message.content[0].text}")
+        raise ValueError("Invalid story outline: missing title or sections")
+    summaries = [str(summary) for summary in outline['sections']][:parts]
+    if len(summaries) < parts:
+        raise ValueError(f"Invalid story outline: expected {parts} sections, got {len(summaries)}")
+    return str(outline['title']).strip(), summaries
+
+
+def generate_story_section(grade_level, length, prompt, title, summaries, part, size):
+    """Write one section of a planned story and return its cleaned sentence objects."""
+    parts = len(summaries)
+    if part == 1:
+        position = 'Begin the story here.'
+    elif part == parts:
+        position = 'Carry on from the part before and bring the story to its ending.'
+    else:
+        position = "Carry on from the part before; don't restart or end the story."
+
+    system_prompt, _ = build_story_prompts(grade_level, length, prompt, sentence_count=size)
+    user_prompt = SECTION_PROMPT_TEMPLATE.format(
+        part=part,
+        parts=parts,
+        title=title,
+        prompt=prompt,
+        outline='\n'.join(f"{number}. {summary}" for number, summary in enumerate(summaries, start=1)),
+        summary=summaries[part - 1],
+        position=position
+    )
+
+    message = request_story_message(
+        choose_story_model(grade_level, length),
+        story_token_budget.budget(grade_level, length, sentence_count=size),
+        system_prompt,
+        user_prompt,
+        variant=f'{grade_level}/{length}'
+    )
+    _, sentences, _ = parse_story_reply(message.content[0].text)
+    story_token_budget.observe(grade_level, length, len(sentences),
+                               message.usage.output_tokens, message.stop_reason)
+    return sentences[:size]
+
+
+def generate_story_in_sections(grade_level, length, prompt):
+    """
+    Plan a long story, then write its sections concurrently.
+
+    Returns (title, sections), where sections yields each section's
+    sentence objects in story order as soon as that section is written.
+    Sections are written UPSTREAM_CONCURRENCY at a time, in order, since
+    that is how many model calls can run at once anyway.
+
+    A section that fails is written again. If it fails a second time the
+    sections not yet started are cancelled and sections stops there,
+    leaving the caller to top the story up from the sections before it;
+    only a first section that can't be written fails the whole story.
+    """
+    sentence_count = GRADE_CONFIGS[grade_level]['sentence_counts'][length]
+    parts = -(-sentence_count // STORY_SECTION_SENTENCES)  # Round up
+    sizes = [sentence_count // parts + (1 if i < sentence_count % parts else 0) for i in range(parts)]
+
+    title, summaries = request_story_outline(grade_level, prompt, parts)
+    logger.info(f"Writing \"{title}\" in {parts} sections")
+
+    # Each section runs in a copy of this context, so its model call still
+    # takes the requesting device's turn in the upstream call queue and
+    # comes out of the request's deadline
+    executor = ThreadPoolExecutor(max_workers=min(parts, max(1, UPSTREAM_CONCURRENCY)),
+                                  thread_name_prefix='story-section')
+    futures = [
+        executor.submit(contextvars.copy_context().run, generate_story_section,
+                        grade_level, length, prompt, title, summaries, part, size)
+        for part, size in enumerate(sizes, start=1)
+    ]
+    executor.shutdown(wait=False)
+
+    def sections():
+        try:
+            for part, (future, size) in enumerate(zip(futures, sizes), start=1):
+                try:
+                    yield future.result()
+                    continue
+                except Exception as e:
+                    logger.warning(f"Section {part} of \"{title}\" failed, writing it again: {e}")
+
+                try:
+                    sentences = generate_story_section(grade_level, length, prompt, title, summaries, part, size)
+                except Exception as e:
+                    story_repairs.inc(kind='section_failed')
+                    if part == 1:
+                        raise
+                    logger.warning(f"Section {part} of \"{title}\" failed again, "
+                                   f"keeping the {part - 1} section(s) before it: {e}")
+                    return
+                story_repairs.inc(kind='section_retried')
+                yield sentences
+        finally:
+            # Sections nobody will read (after a failure, or a client that
+            # went away) aren't started
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return title, sections()
+
+
+def generate_story_with_claude(grade_level, length, prompt, random_theme):
+    """
+    Generate a story using Claude API with grade-appropriate content.
+
+    A reply that was cut off keeps its complete sentences, and a story
+    that comes back short is topped up with a second, smaller request
+    instead of being regenerated. Long stories (see use_story_sections)
+    are planned first and written in parallel sections.
+    """
+    if not anthropic_api_key:
+        raise ValueError('Story generation not available - API key not configured')
+
+    sentence_count = GRADE_CONFIGS[grade_level]['sentence_counts'][length]
+
+    timer = StageTimer(story_stage_seconds)
+
+    # Use random theme if requested
+    if random_theme:
+        prompt = random.choice(RANDOM_THEMES)
+
+    # Build the prompt for Claude
+    system_prompt, user_prompt = build_story_prompts(grade_level, length, prompt)
+    timer.mark('prompt_build')
+
+    try:
+        model = choose_story_model(grade_level, length)
+        story_model_requests.inc(model=model, grade=grade_level, length=length)
+        logger.info(f"Generating {length} story for {grade_level} with {model}: {prompt}")
+
+        if use_story_sections(grade_level, length):
+            title, sections = generate_story_in_sections(grade_level, length, prompt)
+            timer.mark('outline')
+            sentences = [sentence_obj for section in sections for sentence_obj in section]
+            timer.mark('sections')
+        else:
+            message = request_story_message(
+                model, story_token_budget.budget(grade_level, length), system_prompt, user_prompt, timer,
+                variant=f'{grade_level}/{length}'
+            )
+            response_text = message.content[0].text
+
+            try:
+                title, sentences, complete = parse_story_reply(response_text)
+            except ValueError:
+                logger.error(f"Response text: {response_text}")
+                raise
+            timer.mark('json_parse')
+            story_token_budget.observe(grade_level, length, len(sentences),
+                                       message.usage.output_tokens, message.stop_reason)
+
+            if not complete:
+                story_repairs.inc(kind='salvaged')
+                logger.warning(f"Story reply was incomplete (stop reason {message.stop_reason}), "
+                               f"salvaged {len(sentences)} sentences")
+
+        # Process sentences and ensure testWord is present and valid
+        story_words = StoryWordIndex(grade_level)
+        processed_sentences = process_sentences(sentences, story_words)
+
+        # Validate sentence count, topping up a short story
+        if len(sentences) != sentence_count:
+            logger.warning(f"Expected {sentence_count} sentences, got {len(sentences)}")
+        if len(sentences) < sentence_count:
+            extra = top_up_story(grade_level, length, title, processed_sentences,
+                                 sentence_count - len(sentences), story_words.used_words)
+            processed_sentences.extend(process_sentences(extra, story_words))
+            timer.mark('top_up')
+
+        result = {
+            'title': title,
+            'sentences': processed_sentences
+        }
+        result['difficulty'] = score_story(processed_sentences, grade_level)
+        timer.mark('postprocess')
+
+        library_id = story_library.add(result, grade_level, length, prompt, random_theme)
+        if library_id:
+            result['libraryId'] = library_id
+
+        logger.info(f"Successfully generated story: {result['title']} ({len(processed_sentences)} sentences)")
+        return result
+
+    except Exception as e:
+        logger.error(f"Error generating story: {e}")
+        raise
+
+
+# ============================================================================
+# Streaming Story Generation
+# ============================================================================
+
+def stream_story_with_claude(grade_level, length, prompt, random_theme):
+    """
+    Generate a story with the streaming API.
+
+    Yields a 'title' event, then a 'sentence' event for each sentence as
+    soon as it is complete and processed, and finally a 'done' event with
+    the whole story. Like generate_story_with_claude, a short or cut-off
+    story is topped up, with the extra sentences streamed at the end.
+    """
+    if not anthropic_api_key:
+        raise ValueError('Story generation not available - API key not configured')
+
+    timer = StageTimer(story_stage_seconds)
+
+    if random_theme:
+        prompt = random.choice(RANDOM_THEMES)
+
+    system_prompt, user_prompt = build_story_prompts(grade_level, length, prompt)
+    timer.mark('prompt_build')
+    model = choose_story_model(grade_level, length)
+    story_model_requests.inc(model=model, grade=grade_level, length=length)
+    logger.info(f"Streaming {length} story for {grade_level} with {model}: {prompt}")
+
+    story_words = StoryWordIndex(grade_level)
+    processed_sentences = []
+
+    if use_story_sections(grade_level, length):
+        title, sections = generate_story_in_sections(grade_level, length, prompt)
+        timer.mark('outline')
+        yield {'type': 'title', 'title': title}
+
+        for section in sections:
+            for sentence in process_sentences(section, story_words):
+                index = len(processed_sentences)
+                processed_sentences.append(sentence)
+                yield {'type': 'sentence', 'index': index, 'sentence': sentence}
+        timer.mark('sections')
+
+        yield from finish_streamed_story(grade_level, length, prompt, random_theme,
+                                         title, processed_sentences, story_words, timer)
+        return
+
+    parser = StoryStreamParser()
+    title_sent = False
+
+    def open_stream(timeout):
+        # The request is sent when the stream is entered, so retries cover
+        # connection and status errors but never replay sentences already sent
+        manager = get_client().messages.stream(
+            model=model,
+            max_tokens=story_token_budget.budget(grade_level, length),
+            temperature=1.0,
+            system=system_prompt,
+            messages=[
+                {"role": "user", "content": user_prompt}
+            ],
+            timeout=upstream_http.timeout(timeout)
+        )
+        return manager, manager.__enter__()
+
+    with upstream_calls.slot():
+        timer.mark('upstream_wait')
+        manager, stream = upstream_policy.call(open_stream)
+        try:
+            for text in stream.text_stream:
+                new_sentences = parser.feed(text)
+
+                if not title_sent and parser.title is not None:
+                    title_sent = True
+                    yield {'type': 'title', 'title': parser.title}
+
+                cleaned = []
+                for sentence_obj in new_sentences:
+                    sentence_obj = clean_sentence(sentence_obj)
+                    if sentence_obj is None:
+                        logger.warning('Skipping malformed sentence in stream')
+                    else:
+                        cleaned.append(sentence_obj)
+
+                for sentence in process_sentences(cleaned, story_words):
+                    index = len(processed_sentences)
+                    processed_sentences.append(sentence)
+                    if index == 0:
+                        timer.mark('stream_first_sentence')
+                    yield {'type': 'sentence', 'index': index, 'sentence': sentence}
+            timer.mark('stream_rest')
+            final_message = stream.get_final_message()
+            record_token_usage(model, final_message.usage, f'{grade_level}/{length}')
+            story_token_budget.observe(grade_level, length, len(processed_sentences),
+                                       final_message.usage.output_tokens, final_message.stop_reason)
+        except Exception as e:
+            if is_retryable_error(e):
+                upstream_breaker.record_failure()
+            raise
+        finally:
+            manager.__exit__(None, None, None)
+
+    if parser.title is None or not processed_sentences:
+        logger.error(f"Response text: {parser.text}")
+        raise ValueError("Invalid story structure: missing title or sentences")
+
+    if not parser.finished:
+        story_repairs.inc(kind='salvaged')
+        logger.warning(f"Streamed story was incomplete, salvaged {len(processed_sentences)} sentences")
+
+    yield from finish_streamed_story(grade_level, length, prompt, random_theme,
+                                     parser.title, processed_sentences, story_words, timer)
+
+
+def finish_streamed_story(grade_level, length, prompt, random_theme, title, processed_sentences, story_words, timer):
+    """
+    Top up a short streamed story, streaming the extra sentences, then save
+    it to the library and yield the 'done' event.
+    """
+    sentence_count = GRADE_CONFIGS[grade_level]['sentence_counts'][length]
+    if len(processed_sentences) != sentence_count:
+        logger.warning(f"Expected {sentence_count} sentences, got {len(processed_sentences)}")
+    if len(processed_sentences) < sentence_count:
+        extra = top_up_story(grade_level, length, title, processed_sentences,
+                             sentence_count - len(processed_sentences), story_words.used_words)
+        for sentence in process_sentences(extra, story_words):
+            index = len(processed_sentences)
+            processed_sentences.append(sentence)
+            yield {'type': 'sentence', 'index': index, 'sentence': sentence}
+        timer.mark('top_up')
+
+    result = {
+        'title': title,
+        'sentences': processed_sentences,
+        'difficulty': score_story(processed_sentences, grade_level)
+    }
+
+    library_id = story_library.add(result, grade_level, length, prompt, random_theme)
+    if library_id:
+        result['libraryId'] = library_id
+
+    logger.info(f"Successfully streamed story: {result['title']} ({len(processed_sentences)} sentences)")
+    yield {'type': 'done', 'story': result}
+
+
+def story_events(story):
+    """Replay an already generated story as stream events."""
+    yield {'type': 'title', 'title': story['title']}
+    for index, sentence in enumerate(story['sentences']):
+        yield {'type': 'sentence', 'index': index, 'sentence': sentence}
+    yield {'type': 'done', 'story': story}
+
+
+# ============================================================================
+# Background Saves
+# ============================================================================
+
+class JsonFileSaver:
+    """
+    Saves a JSON file from a background thread.
+
+    save() only marks the file dirty, so request paths never wait on the
+    disk. The writer takes a snapshot (by calling snapshot(), which must
+    copy what it returns under its owner's lock) and writes it atomically;
+    saves that arrive while a write is under way are folded into the next
+    one. Anything still unsaved is written at exit.
+    """
+
+    def __init__(self, path, snapshot, description):
+        self.path = Path(path)
+        self.snapshot = snapshot
+        self.description = description
+        self.writes = 0
+        self._dirty = threading.Event()
+        self._writer = None
+        self._write_lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def save(self):
+        """Mark the file dirty and make sure the writer is running."""
+        self._dirty.set()
+        if self._writer is None:
+            with self._write_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, daemon=True)
+                    self._writer.start()
+
+    def flush(self):
+        """Write the file now if it has unsaved changes."""
+        if self._dirty.is_set():
+            self._dirty.clear()
+            self._write()
+
+    def _write_loop(self):
+        while True:
+            self._dirty.wait()
+            self._dirty.clear()
+            self._write()
+
+    def _write(self):
+        with self._write_lock:
+            try:
+                data = self.snapshot()
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.path.with_suffix('.tmp')
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+                self.writes += 1
+            except OSError as e:
+                logger.warning(f"Could not save {self.description} to {self.path}: {e}")
+
+
+# ============================================================================
+# Story Cache
+# ============================================================================
+
+class StoryCache:
+    """
+    Persistent LRU cache of generated stories.
+
+    Entries are keyed on the normalized request (grade, length, prompt text,
+    model and prompt-template hash), expire after max_age_seconds, and the
+    least recently used entry is evicted once max_entries is exceeded.
+    The cache is saved to a JSON file in the background so it survives
+    server restarts.
+    """
+
+    def __init__(self, path, max_entries, max_age_seconds):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._saver = JsonFileSaver(self.path, self._snapshot, 'story cache')
+        self._load()
+
+    @staticmethod
+    def make_key(grade_level, length, prompt, model=None):
+        """Build the cache key for a story request, by default for the model it is routed to."""
+        model = model or choose_story_model(grade_level, length)
+        normalized_prompt = ' '.join(prompt.lower().split())
+        raw_key = json.dumps([grade_level, length, normalized_prompt, model, PROMPT_TEMPLATE_HASH])
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached story for key, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_expired(entry):
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry['story']
+
+    def put(self, key, story, grade_level, length):
+        """Store a story, evicting the least recently used entries if full."""
+        with self._lock:
+            self._entries[key] = {
+                'story': story,
+                'created': time.time(),
+                'grade_level': grade_level,
+                'length': length
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        self._saver.save()
+
+    def find(self, grade_level, length):
+        """Return the most recently used cached story for a grade and length, or None."""
+        with self._lock:
+            for entry in reversed(self._entries.values()):
+                if (entry.get('grade_level') == grade_level and entry.get('length') == length
+                        and not self._is_expired(entry)):
+                    return entry['story']
+        return None
+
+    def record_bypass(self):
+        """Count a request that asked for a fresh story."""
+        with self._lock:
+            self.bypassed += 1
+
+    def stats(self):
+        """Return cache statistics for the health endpoint."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+    def _is_expired(self, entry):
+        return time.time() - entry['created'] > self.max_age_seconds
+
+    def _load(self):
+        """Load cached stories from disk, dropping expired entries."""
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load story cache from {self.path}: {e}")
+            return
+
+        # Saved oldest-first, so insertion order restores the LRU order
+        for key, entry in saved.get('entries', []):
+            if not self._is_expired(entry):
+                self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        logger.info(f"Loaded {len(self._entries)} cached stories from {self.path}")
+
+    def _snapshot(self):
+        """Return the cache as saved to disk, oldest entry first."""
+        with self._lock:
+            return {'entries': list(self._entries.items())}
+
+
+story_cache = StoryCache(
+    STORY_CACHE_FILE,
+    max_entries=STORY_CACHE_MAX_ENTRIES,
+    max_age_seconds=STORY_CACHE_MAX_AGE_DAYS * 24 * 3600
+)
+
+
+# ============================================================================
+# Story Library
+# ============================================================================
+
+class StoryLibrary:
+    """
+    Every story generated in the house, in a SQLite database shared by all
+    devices.
+
+    Lists and searches return compact summaries without the sentences, and
+    are served from indexes on grade, length, theme and created time so
+    they stay fast as the library grows into the thousands.
+    """
+
+    MAX_PAGE_SIZE = 100
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS stories (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            grade_level TEXT NOT NULL,
+            length TEXT NOT NULL,
+            theme TEXT NOT NULL,
+            random INTEGER NOT NULL,
+            sentence_count INTEGER NOT NULL,
+            created REAL NOT NULL,
+            story TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS stories_grade_length_created ON stories (grade_level, length, created DESC);
+        CREATE INDEX IF NOT EXISTS stories_theme ON stories (theme COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS stories_created ON stories (created DESC);
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def add(self, story, grade_level, length, theme, random_theme):
+        """Save a newly generated story and return its library id, or None if it couldn't be saved."""
+        story_id = uuid.uuid4().hex[:12]
+        try:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    conn.execute(
+                        'INSERT INTO stories VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (story_id, story['title'], grade_level, length, theme, int(bool(random_theme)),
+                         len(story['sentences']), time.time(), json.dumps(story, ensure_ascii=False))
+                    )
+        except sqlite3.Error as e:
+            logger.warning(f"Could not save story to the library: {e}")
+            return None
+        return story_id
+
+    def get(self, story_id):
+        """Return a library story with its sentences, or None."""
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT id, title, grade_level, length, theme, random, sentence_count, created, story '
+                'FROM stories WHERE id = ?', (story_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(self._summary(row), **json.loads(row[-1]))
+
+    def search(self, grade_level=None, length=None, query=None, page=1, page_size=20):
+        """
+        Return (summaries, total) for one page of stories, newest first,
+        optionally filtered by grade, length and a title/theme search.
+        """
+        conditions, params = [], []
+        if grade_level:
+            conditions.append('grade_level = ?')
+            params.append(grade_level)
+        if length:
+            conditions.append('length = ?')
+            params.append(length)
+        if query:
+            pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            conditions.append("(title LIKE ? ESCAPE '\\' OR theme LIKE ? ESCAPE '\\')")
+            params.extend([pattern, pattern])
+        where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+
+        page = max(1, page)
+        page_size = max(1, min(self.MAX_PAGE_SIZE, page_size))
+        with self._lock:
+            conn = self._connect()
+            total = conn.execute(f'SELECT COUNT(*) FROM stories {where}', params).fetchone()[0]
+            rows = conn.execute(
+                'SELECT id, title, grade_level, length, theme, random, sentence_count, created '
+                f'FROM stories {where} ORDER BY created DESC LIMIT ? OFFSET ?',
+                params + [page_size, (page - 1) * page_size]
+            ).fetchall()
+        return [self._summary(row) for row in rows], total
+
+    def stats(self):
+        """Return library statistics for the health endpoint."""
+        try:
+            with self._lock:
+                count = self._connect().execute('SELECT COUNT(*) FROM stories').fetchone()[0]
+        except sqlite3.Error:
+            count = 0
+        return {'stories': count}
+
+    def _summary(self, row):
+        story_id, title, grade_level, length, theme, random_theme, sentence_count, created = row[:8]
+        return {
+            'id': story_id,
+            'title': title,
+            'gradeLevel': grade_level,
+            'length': length,
+            'theme': theme,
+            'random': bool(random_theme),
+            'sentenceCount': sentence_count,
+            'created': datetime.utcfromtimestamp(created).isoformat()
+        }
+
+    def _connect(self):
+        """Open the database on first use. Caller must hold the lock."""
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(self.SCHEMA)
+            self._conn = conn
+        return self._conn
+
+
+story_library = StoryLibrary(STORY_LIBRARY_FILE)
+
+
+# ============================================================================
+# Story Speech
+# ============================================================================
+
+class SpeechRenderer:
+    """
+    Renders story sentences and spelled-out test words to WAV files with a
+    local, offline text-to-speech engine (espeak-ng or espeak), so every
+    device plays the same audio and nothing is synthesized twice.
+
+    Files are content-addressed: the name is a hash of the voice, speed and
+    text, so a sentence that appears in several stories is rendered once
+    and a file never changes once written. Sentences are queued as soon as
+    they are generated and a small pool of worker threads renders them in
+    the background. A file asked for before its turn is rendered on the
+    spot. Stories are stored without audio URLs; they are attached, and
+    any file not on disk queued again, each time a story is served, so a
+    URL always has its text behind it, even after a restart. Without an
+    engine the renderer is disabled and stories carry no audio.
+    """
+
+    KEY_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+    RENDER_TIMEOUT = 30  # seconds
+
+    def __init__(self, directory, command, voice, speed, workers):
+        self.directory = Path(directory)
+        self.command = command or shutil.which('espeak-ng') or shutil.which('espeak')
+        self.voice = voice
+        self.speed = speed
+        self.workers = workers
+        self.rendered = 0
+        self.failed = 0
+        self._pending = {}  # key -> text, until rendered
+        self._rendering = {}  # key -> Event set when the render finishes
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+
+    @property
+    def available(self):
+        return bool(self.command)
+
+    def key(self, text):
+        """Return the file key for a text in the current voice."""
+        return hashlib.sha256(f'{self.voice}|{self.speed}|{text}'.encode('utf-8')).hexdigest()[:32]
+
+    def path(self, key):
+        return self.directory / key[:2] / f'{key}.wav'
+
+    def queue(self, sentence):
+        """
+        Queue the audio of a processed sentence, for the sentence and for
+        its test word spelled out, so it is rendered before it is asked for.
+        """
+        if not self.available:
+            return
+        for key, text in self._files(sentence).values():
+            self._enqueue(key, text)
+
+    def attach(self, sentence):
+        """
+        Return a copy of a stored sentence with the URLs of its audio,
+        queueing the files that are not on disk yet.
+        """
+        sentence = {key: value for key, value in sentence.items() if key != 'audio'}
+        if self.available:
+            sentence['audio'] = {}
+            for kind, (key, text) in self._files(sentence).items():
+                sentence['audio'][kind] = f'/api/audio/{key}.wav'
+                self._enqueue(key, text)
+        return sentence
+
+    def get(self, key):
+        """
+        Return the path of a rendered file, rendering it now if it is still
+        queued, or None if the key is unknown or rendering failed.
+        """
+        if not self.KEY_PATTERN.match(key):
+            return None
+        path = self.path(key)
+        if not path.exists():
+            self._render(key)
+        return path if path.exists() else None
+
+    def start(self):
+        """Start the render workers."""
+        if not self.available or self._started:
+            return
+        self._started = True
+        for _ in range(self.workers):
+            threading.Thread(target=self._work, daemon=True).start()
+        logger.info(f"Speech rendering with {self.command} ({self.workers} workers)")
+
+    def stats(self):
+        """Return speech statistics for the health endpoint."""
+        with self._lock:
+            return {
+                'enabled': self.available,
+                'rendered': self.rendered,
+                'failed': self.failed,
+                'queued': len(self._pending)
+            }
+
+    def _files(self, sentence):
+        """Return {kind: (key, text)} for the audio of a sentence."""
+        texts = {'sentence': sentence['text']}
+        if sentence.get('testWord'):
+            word = sentence['testWord']
+            texts['spelling'] = f"{word}. {', '.join(word)}. {word}."
+        return {kind: (self.key(text), text) for kind, text in texts.items()}
+
+    def _enqueue(self, key, text):
+        """Queue a file for the workers unless it is on disk or queued already."""
+        if self.path(key).exists():
+            return
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending[key] = text
+        self._queue.put(key)
+
+    def _work(self):
+        while True:
+            self._render(self._queue.get())
+
+    def _render(self, key):
+        """Render a queued key once, however many threads ask for it at the same time."""
+        with self._lock:
+            text = self._pending.get(key)
+            if text is None:
+                return
+            done = self._rendering.get(key)
+            if done is None:
+                done = self._rendering[key] = threading.Event()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            done.wait(self.RENDER_TIMEOUT)
+            return
+
+        path = self.path(key)
+        tmp_path = path.with_suffix('.tmp')
+        ok = False
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            subprocess.run(
+                [self.command, '-v', self.voice, '-s', str(self.speed), '-w', str(tmp_path), text],
+                check=True, capture_output=True, timeout=self.RENDER_TIMEOUT
+            )
+            os.replace(tmp_path, path)
+            ok = True
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning(f"Could not render speech for {text[:40]!r}: {e}")
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+        finally:
+            with self._lock:
+                del self._pending[key]
+                del self._rendering[key]
+                if ok:
+                    self.rendered += 1
+                else:
+                    self.failed += 1
+            done.set()
+
+
+speech = SpeechRenderer(AUDIO_DIR, TTS_COMMAND, TTS_VOICE, TTS_SPEED, AUDIO_WORKERS)
+
+
+def story_with_audio(story):
+    """Return a copy of a stored story to send to a device, with its audio URLs attached."""
+    return {**story, 'sentences': [speech.attach(sentence) for sentence in story['sentences']]}
+
+
+# ============================================================================
+# Random Story Pool
+# ============================================================================
+
+class StoryPool:
+    """
+    Pool of pre-generated random-theme stories for every grade and length.
+
+    Random requests take a ready story from their (grade, length) bucket.
+    A background worker refills a bucket up to high_watermark whenever it
+    drops below low_watermark. The pool is saved to a JSON file in the
+    background so stories generated before a restart are not lost.
+    """
+
+    RETRY_DELAY = 60  # seconds to wait after a failed refill
+
+    def __init__(self, path, high_watermark, low_watermark):
+        self.path = Path(path)
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.served = 0
+        self.empty = 0
+        self.generated = 0
+        self._buckets = {
+            (grade_level, length): []
+            for grade_level, config in GRADE_CONFIGS.items()
+            for length in config['sentence_counts']
+        }
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._saver = JsonFileSaver(self.path, self._snapshot, 'story pool')
+        self._load()
+
+    def take(self, grade_level, length):
+        """Return a pooled story for the bucket, or None if it is empty."""
+        with self._lock:
+            bucket = self._buckets[(grade_level, length)]
+            if not bucket:
+                self.empty += 1
+                story = None
+            else:
+                story = bucket.pop(0)
+                self.served += 1
+            needs_refill = len(bucket) < self.low_watermark
+
+        if story is not None:
+            self._saver.save()
+        if needs_refill:
+            self._wakeup.set()
+        return story
+
+    def start(self):
+        """Start the background refill worker."""
+        if self.high_watermark <= 0:
+            return
+        worker = threading.Thread(target=self._refill_loop, daemon=True)
+        worker.start()
+        self._wakeup.set()
+
+    def stats(self):
+        """Return pool statistics for the health endpoint."""
+        with self._lock:
+            return {
+                'buckets': {
+                    f"{grade_level}/{length}": len(bucket)
+                    for (grade_level, length), bucket in self._buckets.items()
+                },
+                'high_watermark': self.high_watermark,
+                'low_watermark': self.low_watermark,
+                'served': self.served,
+                'empty': self.empty,
+                'generated': self.generated
+            }
+
+    def _buckets_to_refill(self):
+        with self._lock:
+            return [
+                key for key, bucket in self._buckets.items()
+                if len(bucket) < self.low_watermark
+            ]
+
+    def _refill_loop(self):
+        """Wait for a bucket to run low, then top it up to the high watermark."""
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+
+            for grade_level, length in self._buckets_to_refill():
+                try:
+                    self._refill(grade_level, length)
+                except Exception as e:
+                    logger.warning(f"Story pool refill failed for {length} {grade_level}: {e}")
+                    time.sleep(self.RETRY_DELAY)
+                    self._wakeup.set()
+                    break
+
+    def _refill(self, grade_level, length):
+        while True:
+            with self._lock:
+                if len(self._buckets[(grade_level, length)]) >= self.high_watermark:
+                    return
+
+            story = generate_story_with_claude(grade_level, length, '', True)
+
+            with self._lock:
+                self._buckets[(grade_level, length)].append(story)
+                self.generated += 1
+            self._saver.save()
+            logger.info(f"Story pool: added {length} {grade_level} story '{story['title']}'")
+
+    def _load(self):
+        """Load pooled stories from disk."""
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load story pool from {self.path}: {e}")
+            return
+
+        for bucket_name, stories in saved.get('buckets', {}).items():
+            grade_level, _, length = bucket_name.partition('/')
+            if (grade_level, length) in self._buckets:
+                self._buckets[(grade_level, length)] = stories[:max(self.high_watermark, 0)]
+        logger.info(f"Loaded {sum(len(b) for b in self._buckets.values())} pooled stories from {self.path}")
+
+    def _snapshot(self):
+        """Return the pool as saved to disk."""
+        with self._lock:
+            return {'buckets': {
+                f"{grade_level}/{length}": list(bucket)
+                for (grade_level, length), bucket in self._buckets.items()
+            }}
+
+
+story_pool = StoryPool(
+    STORY_POOL_FILE,
+    high_watermark=STORY_POOL_SIZE,
+    low_watermark=STORY_POOL_LOW_WATERMARK
+)
+
+
+# ============================================================================
+# Request Coalescing
+# ============================================================================
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key.
+
+    The first caller for a key becomes the leader and does the work; callers
+    that arrive while it is in flight wait for the leader and receive the
+    same result, or the same exception. A caller that waits longer than
+    wait_timeout gets StoryServiceBusy instead.
+    """
+
+    def __init__(self, wait_timeout):
+        self.wait_timeout = wait_timeout
+        self.leaders = 0
+        self.coalesced = 0
+        self.timed_out = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """
+        Join the call for key. Returns (future, is_leader); the leader must
+        finish the call with complete(), everyone else waits on the future.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+
+            future = Future()
+            self._calls[key] = future
+            self.leaders += 1
+            return future, True
+
+    def complete(self, key, future, result=None, error=None):
+        """Publish the leader's result (or error) to everyone waiting on key."""
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def wait(self, future):
+        """Return the leader's result (or raise its error), waiting at most wait_timeout."""
+        try:
+            return future.result(timeout=self.wait_timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self.timed_out += 1
+            logger.warning(f"Gave up waiting {self.wait_timeout}s for an identical request's story")
+            raise StoryServiceBusy('Story generator is busy. Please try again in a moment.')
+
+    def do(self, key, fn):
+        """Run fn once for all concurrent callers with the same key."""
+        future, is_leader = self.join(key)
+        if not is_leader:
+            return self.wait(future)
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self.complete(key, future, error=e)
+            raise
+        self.complete(key, future, result=result)
+        return result
+
+    def stats(self):
+        """Return coalescing statistics for the health endpoint."""
+        with self._lock:
+            return {
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'timed_out': self.timed_out,
+                'in_flight': len(self._calls)
+            }
+
+
+story_generations = SingleFlight(wait_timeout=STORY_WAIT_TIMEOUT)
+
+
+def lookup_story(grade_level, length, prompt, random_theme, fresh=False):
+    """
+    Look for a ready-made story for the request.
+
+    Random-theme requests are served from the story pool, other requests
+    from the story cache unless fresh is set. Returns (story, cache_key);
+    story is None when a new one must be generated, and cache_key is None
+    for requests whose result should not be cached.
+    """
+    if random_theme:
+        story = story_pool.take(grade_level, length)
+        if story is not None:
+            logger.info(f"Served {length} {grade_level} random story from pool: {story['title']}")
+        return story, None
+
+    key = StoryCache.make_key(grade_level, length, prompt)
+    if fresh:
+        story_cache.record_bypass()
+        return None, key
+
+    story = story_cache.get(key)
+    if story is not None:
+        logger.info(f"Story cache hit for {length} {grade_level} story: {prompt}")
+    return story, key
+
+
+def fallback_story(grade_level, length):
+    """
+    Return any ready-made story for the grade and length, for when the
+    upstream is unavailable, or None if there is none.
+    """
+    story = story_pool.take(grade_level, length) or story_cache.find(grade_level, length)
+    if story is None:
+        return None
+    story_fallbacks.inc()
+    logger.warning(f"Upstream unavailable - serving fallback {length} {grade_level} story: {story['title']}")
+    return dict(story, fallback=True)
+
+
+def get_story(grade_level, length, prompt, random_theme, fresh=False, device=None):
+    """
+    Return a story for the request, generating one only when neither the
+    story pool nor the story cache has it. Setting fresh skips the cache
+    lookup but still stores the new story for later requests.
+
+    Identical requests that arrive while their story is being generated
+    share that one model call instead of starting another. They still
+    hold a story worker slot while they wait, so a burst of them can't
+    take the threads kept for static files. While the upstream is
+    unavailable, any ready-made story for the same grade and length is
+    served instead, marked with "fallback": true.
+
+    device is the client asking. A request that needs a new story counts
+    against its rate limit (StoryRateLimited when it is spent) once it has
+    a story worker slot, so a request turned away as busy costs nothing,
+    and its model calls take the device's turns in the upstream call queue.
+    Those calls, and their waits for a turn, share UPSTREAM_TOTAL_DEADLINE
+    from when the request came in.
+    """
+    deadline = time.monotonic() + UPSTREAM_TOTAL_DEADLINE
+    story, key = lookup_story(grade_level, length, prompt, random_theme, fresh)
+    if story is not None:
+        return story
+
+    def generate():
+        with generating_for(device, deadline):
+            new_story = generate_story_with_claude(grade_level, length, prompt, random_theme)
+        if key is not None:
+            story_cache.put(key, new_story, grade_level, length)
+        return new_story
+
+    try:
+        with story_workers.slot():
+            if device is not None:
+                story_rate_limit.take(device)
+            if key is None:
+                return generate()
+            return story_generations.do(key, generate)
+    except UpstreamUnavailable:
+        story = fallback_story(grade_level, length)
+        if story is None:
+            raise
+        return story
+
+
+def stream_story(grade_level, length, prompt, random_theme, fresh=False, device=None):
+    """
+    Streaming counterpart of get_story, returning an iterator of events.
+    Ready-made stories are replayed straight away; new stories are streamed
+    from the model and cached.
+
+    A request identical to one already being generated waits for that
+    story and replays it rather than starting its own model call. If the
+    upstream is unavailable before anything was sent, a fallback story is
+    replayed instead, as in get_story. The device's rate limit and the
+    story workers are checked here rather than in the iterator, so
+    StoryRateLimited and StoryServiceBusy are raised before a response
+    starts. The model calls share one deadline, as in get_story.
+    """
+    deadline = time.monotonic() + UPSTREAM_TOTAL_DEADLINE
+    story, key = lookup_story(grade_level, length, prompt, random_theme, fresh)
+    if story is not None:
+        return story_events(story)
+    events = stream_new_story(grade_level, length, prompt, random_theme, key, device, deadline)
+    next(events)  # Takes a story worker slot and a rate limit token, or raises
+    return events
+
+
+def stream_new_story(grade_level, length, prompt, random_theme, key, device, deadline=None):
+    """
+    Stream a story that lookup_story found no ready-made copy of, for
+    stream_story. Waiting for an identical request's story takes a story
+    worker slot, like generating one. deadline is the request's, for its
+    model calls (see generating_for).
+
+    The first item is None, yielded once the slot and the device's rate
+    limit token are held; stream_story takes it so a busy server or a
+    spent device is reported before the response starts. Closing the
+    iterator gives the slot back.
+    """
+    with story_workers.slot():
+        if device is not None:
+            story_rate_limit.take(device)
+        yield None
+        future = None
+        if key is not None:
+            future, is_leader = story_generations.join(key)
+            if not is_leader:
+                yield from story_events(story_generations.wait(future))
+                return
+
+        started = False
+        try:
+            try:
+                with generating_for(device, deadline):
+                    for event in stream_story_with_claude(grade_level, length, prompt, random_theme):
+                        started = True
+                        if event['type'] == 'done' and key is not None:
+                            story_cache.put(key, event['story'], grade_level, length)
+                            story_generations.complete(key, future, result=event['story'])
+                        yield event
+            except UpstreamUnavailable:
+                story = None if started else fallback_story(grade_level, length)
+                if story is None:
+                    raise
+                if future is not None:
+                    story_generations.complete(key, future, result=story)
+                yield from story_events(story)
+        except BaseException as e:
+            if future is not None and not future.done():
+                # A client disconnect stops this generator with GeneratorExit
+                if not isinstance(e, Exception):
+                    e = StoryServiceBusy('Story generation was interrupted. Please try again.')
+                story_generations.complete(key, future, error=e)
+            raise
+
+
+# ============================================================================
+# Story Batches
+# ============================================================================
+
+class StoryBatchQueue:
+    """
+    Generates batches of stories in the background, e.g. a week of reading
+    queued up overnight.
+
+    Each story in a batch is a queue item handled by a fixed pool of
+    worker threads, so throughput grows with the worker count (up to
+    UPSTREAM_CONCURRENCY, which batch workers share with everything else).
+    Batches and their finished stories are saved to a JSON file in the
+    background, and unfinished stories are queued again after a restart. Finished
+    prompted stories also go into the story cache.
+
+    Only finished batches are dropped to stay within max_jobs, so at most
+    max_pending unfinished batches are accepted; submit raises
+    StoryServiceBusy beyond that.
+    """
+
+    MAX_ATTEMPTS = 3
+    RETRY_DELAY = 30  # seconds a worker waits after the upstream was busy
+
+    def __init__(self, path, workers, max_stories, max_jobs, max_pending):
+        self.path = Path(path)
+        self.workers = workers
+        self.max_stories = max_stories
+        self.max_jobs = max_jobs
+        self.max_pending = max_pending
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._jobs = OrderedDict()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._saver = JsonFileSaver(self.path, self._snapshot, 'story batches')
+        self._load()
+
+    def submit(self, specs):
+        """Queue a batch from a list of story request bodies and return its summary."""
+        if not anthropic_api_key:
+            raise ValueError('Story generation not available - API key not configured')
+        if not isinstance(specs, list) or not specs:
+            raise ValueError('stories must be a non-empty list of story requests')
+        if len(specs) > self.max_stories:
+            raise ValueError(f'A batch can have at most {self.max_stories} stories')
+
+        items = []
+        for number, spec in enumerate(specs, start=1):
+            try:
+                grade_level, length, prompt, random_theme, _ = parse_story_request(spec)
+            except ValueError as e:
+                raise ValueError(f'Story {number}: {e}')
+            items.append({
+                'gradeLevel': grade_level,
+                'length': length,
+                'prompt': prompt,
+                'random': bool(random_theme),
+                'status': 'queued',
+                'attempts': 0,
+                'error': None,
+                'story': None
+            })
+
+        job = {'id': uuid.uuid4().hex[:12], 'created': time.time(), 'items': items}
+        with self._lock:
+            pending = self._pending()
+            full = pending >= self.max_pending
+            if full:
+                self.rejected += 1
+            else:
+                self._jobs[job['id']] = job
+                self._trim()
+                summary = self._summary(job)
+        if full:
+            logger.warning(f"{pending} story batches are still unfinished, rejecting another")
+            raise StoryServiceBusy(f'{pending} story batches are still being generated. Please try again later.')
+        self._saver.save()
+
+        for index in range(len(items)):
+            self._queue.put((job['id'], index))
+        logger.info(f"Queued story batch {job['id']} with {len(items)} stories")
+        return summary
+
+    def get(self, job_id):
+        """Return a batch with its stories, or None if there is no such batch."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            details = self._summary(job)
+            details['stories'] = [
+                {key: value for key, value in item.items() if key != 'attempts'}
+                for item in job['items']
+            ]
+            return details
+
+    def list(self):
+        """Return summaries of all batches, newest first."""
+        with self._lock:
+            return [self._summary(job) for job in reversed(self._jobs.values())]
+
+    def start(self):
+        """Start the worker threads."""
+        for _ in range(self.workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def stats(self):
+        """Return batch statistics for the health endpoint."""
+        with self._lock:
+            return {
+                'batches': len(self._jobs),
+                'pending': self._pending(),
+                'queued': self._queue.qsize(),
+                'workers': self.workers,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected
+            }
+
+    def _work(self):
+        while True:
+            job_id, index = self._queue.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue  # Dropped by _trim
+                item = job['items'][index]
+                item['status'] = 'running'
+                item['attempts'] += 1
+
+            try:
+                story = generate_story_with_claude(item['gradeLevel'], item['length'], item['prompt'], item['random'])
+            except Exception as e:
+                retry = item['attempts'] < self.MAX_ATTEMPTS
+                logger.warning(f"Batch {job_id} story {index + 1} failed (attempt {item['attempts']}): {e}")
+                with self._lock:
+                    item['status'] = 'queued' if retry else 'failed'
+                    item['error'] = str(e)
+                    if not retry:
+                        self.failed += 1
+                self._saver.save()
+                if retry:
+                    if isinstance(e, StoryServiceBusy):
+                        time.sleep(self.RETRY_DELAY)
+                    self._queue.put((job_id, index))
+                continue
+
+            if not item['random']:
+                story_cache.put(StoryCache.make_key(item['gradeLevel'], item['length'], item['prompt']),
+                                story, item['gradeLevel'], item['length'])
+            with self._lock:
+                item['status'] = 'done'
+                item['error'] = None
+                item['story'] = story
+                self.completed += 1
+            self._saver.save()
+
+    def _summary(self, job):
+        """Return a batch's status and counts. Caller must hold the lock."""
+        counts = {status: 0 for status in ('queued', 'running', 'done', 'failed')}
+        for item in job['items']:
+            counts[item['status']] += 1
+
+        if counts['queued'] + counts['running'] == 0:
+            status = 'done'
+        elif counts['queued'] == len(job['items']):
+            status = 'queued'
+        else:
+            status = 'running'
+
+        return {
+            'id': job['id'],
+            'created': datetime.utcfromtimestamp(job['created']).isoformat(),
+            'status': status,
+            'total': len(job['items']),
+            **counts
+        }
+
+    def _pending(self):
+        """Return how many batches have stories left to generate. Caller must hold the lock."""
+        return sum(
+            any(item['status'] in ('queued', 'running') for item in job['items'])
+            for job in self._jobs.values()
+        )
+
+    def _trim(self):
+        """Drop the oldest finished batches beyond max_jobs. Caller must hold the lock."""
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if self._summary(self._jobs[job_id])['status'] == 'done':
+                del self._jobs[job_id]
+
+    def _load(self):
+        """Load saved batches from disk and queue their unfinished stories again."""
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load story batches from {self.path}: {e}")
+            return
+
+        requeued = 0
+        for job in saved.get('jobs', []):
+            self._jobs[job['id']] = job
+            for index, item in enumerate(job['items']):
+                if item['status'] in ('queued', 'running'):
+                    item['status'] = 'queued'
+                    self._queue.put((job['id'], index))
+                    requeued += 1
+        logger.info(f"Loaded {len(self._jobs)} story batches from {self.path} ({requeued} stories to generate)")
+
+    def _snapshot(self):
+        """Return the batches as saved to disk. Items change as they run, so they are copied."""
+        with self._lock:
+            return {'jobs': [
+                dict(job, items=[dict(item) for item in job['items']])
+                for job in self._jobs.values()
+            ]}
+
+
+story_batches = StoryBatchQueue(
+    STORY_BATCH_FILE,
+    workers=STORY_BATCH_WORKERS,
+    max_stories=STORY_BATCH_MAX_STORIES,
+    max_jobs=STORY_BATCH_MAX_JOBS,
+    max_pending=STORY_BATCH_MAX_PENDING
+)
+
+
+# ============================================================================
+# Static Asset Cache
+# ============================================================================
+
+class StaticAsset:
+    """One file held in memory, with its validators and compressed variants."""
+
+    # Types worth compressing; images and video are already compressed
+    COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+    MIN_COMPRESS_SIZE = 512  # bytes
+
+    def __init__(self, file_path, stat_result):
+        with open(file_path, 'rb') as f:
+            self.data = f.read()
+        self.mtime_ns = stat_result.st_mtime_ns
+        self.size = stat_result.st_size
+        self.last_modified = stat_result.st_mtime
+        self.mimetype = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+        self.etag = hashlib.sha1(self.data).hexdigest()
+        self.variants = {}
+
+        if self.mimetype.startswith(self.COMPRESSIBLE_TYPES) and len(self.data) >= self.MIN_COMPRESS_SIZE:
+            self._add_variant('gzip', gzip.compress(self.data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                self._add_variant('br', brotli.compress(self.data, quality=11))
+
+    @property
+    def memory_size(self):
+        return len(self.data) + sum(len(body) for body in self.variants.values())
+
+    def matches(self, stat_result):
+        """True if the file on disk is still the one that was loaded."""
+        return stat_result.st_mtime_ns == self.mtime_ns and stat_result.st_size == self.size
+
+    def _add_variant(self, encoding, body):
+        # Only keep variants that are worth the extra memory
+        if len(body) < len(self.data) * 0.9:
+            self.variants[encoding] = body
 
-def select_test_word(sentence, grade_level, used_words):
+
+class StaticAssetCache:
     """
-    Fallback function to select a test word from a sentence.
-    Used if the AI doesn't provide a testWord.
+    LRU cache of static files kept in memory.
+
+    Each lookup stats the file, so an edited file is reloaded on the next
+    request. Files larger than max_file_bytes are not cached, and the least
+    recently used files are dropped once max_bytes is exceeded.
     """
-    # Remove punctuation and split into words
-    words = sentence.replace('.', '').replace(',', '').replace('!', '').replace('?', '').split()
 
-    config = GRADE_CONFIGS[grade_level]
-    max_length = config['max_word_length']
+    def __init__(self, directory, max_bytes, max_file_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.hits = 0
+        self.loads = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
 
-    # Filter suitable words
-    suitable_words = [
-        word for word in words
-        if 3 <= len(word) <= max_length
-        and word.lower() not in used_words
-        and word.isalpha()  # Only alphabetic characters
-    ]
+    def get(self, path):
+        """
+        Return the StaticAsset for a path relative to the directory, or None
+        if it does not exist or is too large to cache.
+        """
+        file_path = safe_join(self.directory, path)
+        if file_path is None:
+            return None
+        try:
+            stat_result = os.stat(file_path)
+        except OSError:
+            return None
+        if not os.path.isfile(file_path) or stat_result.st_size > self.max_file_bytes:
+            return None
 
-    if not suitable_words:
-        # Fall back to any alphabetic word not already used
-        suitable_words = [word for word in words if word.isalpha() and word.lower() not in used_words]
+        with self._lock:
+            asset = self._entries.get(path)
+            if asset is not None and asset.matches(stat_result):
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return asset
 
-    if not suitable_words:
-        # Last resort: use first alphabetic word
-        suitable_words = [word for word in words if word.isalpha()]
+        # Load outside the lock so slow compression doesn't block other requests
+        try:
+            asset = StaticAsset(file_path, stat_result)
+        except OSError:
+            return None
 
-    return suitable_words[0] if suitable_words else words[0]
+        with self._lock:
+            self._remove(path)
+            self._entries[path] = asset
+            self._bytes += asset.memory_size
+            self.loads += 1
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+        return asset
 
+    def invalidate(self, path):
+        """Drop a cached file so the next request reloads it."""
+        with self._lock:
+            self._remove(path)
 
-def generate_story_with_claude(grade_level, length, prompt, random_theme):
-    """
-    Generate a story using Claude API with grade-appropriate content.
-    """
-    if not client:
-        raise ValueError('Story generation not available - API key not configured')
+    def stats(self):
+        """Return cache statistics for the health endpoint."""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'loads': self.loads
+            }
 
-    config = GRADE_CONFIGS[grade_level]
-    sentence_count = config['sentence_counts'][length]
-    vocabulary_level = config['vocabulary_level']
-    word_description = config['description']
+    def _remove(self, path):
+        """Remove an entry. Caller must hold the lock."""
+        asset = self._entries.pop(path, None)
+        if asset is not None:
+            self._bytes -= asset.memory_size
 
-    # Use random theme if requested
-    if random_theme:
-        import random
-        prompt = random.choice(RANDOM_THEMES)
 
-    # For 4th grade, we generate double sentences but only test half
-    test_sentence_count = sentence_count // 2 if grade_level == '4th' else sentence_count
+static_assets = StaticAssetCache(
+    DIRECTORY,
+    max_bytes=STATIC_CACHE_MAX_BYTES,
+    max_file_bytes=STATIC_CACHE_MAX_FILE_BYTES
+)
 
-    # Build the prompt for Claude
-    system_prompt = f"""You are a creative children's story writer. Generate engaging, age-appropriate stories for reading practice.
 
-Your task:
-1. Write a story with EXACTLY {sentence_count} sentences for {vocabulary_level} level
-2. For each sentence, select ONE test word for spelling practice
-3. Test words should be {word_description}
-4. Never repeat the same test word in a story
-5. Prefer common, fun, thematic words (like "mermaid", "treasure", "rocket")
-6. Each sentence should be clear and complete
-7. The story should be coherent and entertaining
+class ImageVariants:
+    """
+    Smaller copies of the images in images/, made with Pillow.
 
-Return your response as valid JSON in this exact format:
-{{
-  "title": "Story Title Here",
-  "sentences": [
-    {{"text": "First sentence here.", "testWord": "selected"}},
-    {{"text": "Second sentence here.", "testWord": "another"}}
-  ]
-}}
+    A JPEG or PNG is re-encoded to AVIF or WebP, whichever the browser
+    accepts, at the narrowest of the configured widths that covers the
+    width asked for with ?w= (the full width without it; images are never
+    enlarged). Variants are made on first request, or ahead of time by
+    warm(), and kept on disk named after the source file and its mtime, so
+    an edited image gets new variants. Animated GIFs, images Pillow can't
+    read and anything a variant can't shrink are served as they are. Without
+    Pillow every image is.
+    """
 
-IMPORTANT:
-- Return ONLY valid JSON, no other text
-- Use exactly {sentence_count} sentences
-- Ensure all testWords are different
-- Each testWord must appear in its sentence
-- Keep vocabulary appropriate for {vocabulary_level}"""
+    SOURCE_TYPES = ('.jpg', '.jpeg', '.png')
+    # Best first: mimetype -> (Pillow format, file extension, encoder options)
+    FORMATS = {
+        'image/avif': ('AVIF', 'avif', {'quality': 55}),
+        'image/webp': ('WEBP', 'webp', {'quality': 80, 'method': 6}),
+    }
 
-    user_prompt = f"Write a story about: {prompt}"
+    def __init__(self, source_dir, cache_dir, widths):
+        self.source_dir = source_dir
+        self.cache_dir = Path(cache_dir)
+        self.widths = sorted(widths)
+        self.formats = [
+            mimetype for mimetype, (_, extension, _) in self.FORMATS.items()
+            if Image is not None and pil_features.check(extension)
+        ]
+        self.made = 0
+        self.served = 0
+        self.bytes_saved = 0
+        self._skipped = set()  # variant names that failed or came out larger than their source
+        self._widths = {}  # source path -> (mtime_ns, width), so requests don't open the image
+        self._locks = {}
+        self._lock = threading.Lock()
 
-    try:
-        logger.info(f"Generating {length} story for {grade_level}: {prompt}")
+    def find(self, path, accept, width=None):
+        """
+        Return (file path, mimetype) of the best variant of an image for a
+        request's Accept header and ?w= width, making it if needed, or None
+        to serve the original.
+        """
+        if not self.formats or not path.startswith('images/') or not path.lower().endswith(self.SOURCE_TYPES):
+            return None
+        # Only formats the browser names; */* also covers formats it can't decode
+        accepted = {value for value, quality in accept if quality > 0}
+        mimetype = next((mimetype for mimetype in self.formats if mimetype in accepted), None)
+        if mimetype is None:
+            return None
+        source = safe_join(self.source_dir, path)
+        if source is None:
+            return None
+        try:
+            stat_result = os.stat(source)
+        except OSError:
+            return None
 
-        message = client.messages.create(
-            model="claude-sonnet-4-5-20250929",
-            max_tokens=4000,
-            temperature=1.0,
-            system=system_prompt,
-            messages=[
-                {"role": "user", "content": user_prompt}
-            ]
-        )
+        variant = self._make(source, stat_result, mimetype, width)
+        if variant is not None:
+            with self._lock:
+                self.served += 1
+                self.bytes_saved += stat_result.st_size - variant.stat().st_size
+        return (variant, mimetype) if variant is not None else None
 
-        # Extract the response text
-        response_text = message.content[0].text.strip()
+    def warm(self):
+        """Make every variant of every image in a background thread."""
+        if not self.formats:
+            return
 
-        # Remove markdown code blocks if present
-        if response_text.startswith('```json'):
-            response_text = response_text[7:]  # Remove ```json
-        if response_text.startswith('```'):
-            response_text = response_text[3:]  # Remove ```
-        if response_text.endswith('```'):
-            response_text = response_text[:-3]  # Remove trailing ```
-        response_text = response_text.strip()
+        def run():
+            started = time.time()
+            for source in sorted(Path(self.source_dir, 'images').iterdir()):
+                if not source.name.lower().endswith(self.SOURCE_TYPES):
+                    continue
+                stat_result = source.stat()
+                for mimetype in self.formats:
+                    for width in self.widths:
+                        self._make(str(source), stat_result, mimetype, width)
+            logger.info(f"Image variants ready in {time.time() - started:.1f}s ({self.made} made)")
 
-        # Parse JSON response
-        story_data = json.loads(response_text)
+        threading.Thread(target=run, daemon=True).start()
 
-        # Validate response structure
-        if 'title' not in story_data or 'sentences' not in story_data:
-            raise ValueError("Invalid story structure: missing title or sentences")
+    def stats(self):
+        """Return variant statistics for the health endpoint."""
+        with self._lock:
+            return {
+                'formats': ','.join(mimetype.split('/')[1] for mimetype in self.formats) or 'none',
+                'made': self.made,
+                'served': self.served,
+                'bytes_saved': self.bytes_saved
+            }
 
-        sentences = story_data['sentences']
+    def _make(self, source, stat_result, mimetype, width):
+        """Return the variant's path, making it first if it isn't on disk, or None to serve the source."""
+        pil_format, extension, options = self.FORMATS[mimetype]
+        full_width = self._source_width(source, stat_result)
+        if full_width is None:
+            return None
+        target = min([w for w in self.widths if w >= width] or [full_width]) if width else full_width
+        target = min(target, full_width)
+        source_name = Path(source).stem
+        prefix = f"{source_name}-{hashlib.sha1(source.encode('utf-8')).hexdigest()[:8]}"
+        name = f'{prefix}-{stat_result.st_mtime_ns}-{target}.{extension}'
+        path = self.cache_dir / name
+        if name in self._skipped:
+            return None
+        if path.exists():
+            return path
 
-        # Validate sentence count
-        if len(sentences) != sentence_count:
-            logger.warning(f"Expected {sentence_count} sentences, got {len(sentences)}")
+        with self._lock:
+            lock = self._locks.setdefault(prefix, threading.Lock())
+        with lock:
+            # Another request may have made it while this one waited
+            if name in self._skipped:
+                return None
+            if path.exists():
+                return path
 
-        # Process sentences and ensure testWord is present and valid
-        used_words = set()
-        processed_sentences = []
+            tmp_path = path.with_suffix('.tmp')
+            try:
+                with Image.open(source) as image:
+                    if target < full_width:
+                        image = image.resize((target, round(image.height * target / full_width)), Image.LANCZOS)
+                    if image.mode not in ('RGB', 'RGBA'):
+                        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+                    self.cache_dir.mkdir(parents=True, exist_ok=True)
+                    image.save(tmp_path, pil_format, **options)
+            except Exception as e:
+                # Bad or truncated images raise more than OSError, e.g.
+                # DecompressionBombError, SyntaxError or struct.error
+                logger.warning(f"Could not make {extension} variant of {source}: {e}")
+                tmp_path.unlink(missing_ok=True)
+                self._skipped.add(name)
+                return None
 
-        for i, sentence_obj in enumerate(sentences):
-            text = sentence_obj.get('text', '')
-            test_word = sentence_obj.get('testWord', '')
+            if tmp_path.stat().st_size >= stat_result.st_size:
+                tmp_path.unlink()
+                self._skipped.add(name)
+                return None
+            os.replace(tmp_path, path)
 
-            # Validate testWord
-            if not test_word or test_word.lower() not in text.lower():
-                # Fallback: select a word from the sentence
-                test_word = select_test_word(text, grade_level, used_words)
-                logger.warning(f"Sentence {i+1}: Invalid testWord, selected '{test_word}' as fallback")
+            # Variants of an older version of the image are no longer needed
+            for old in self.cache_dir.glob(f'{prefix}-*'):
+                if not old.name.startswith(f'{prefix}-{stat_result.st_mtime_ns}-'):
+                    old.unlink(missing_ok=True)
 
-            # Check for duplicates
-            if test_word.lower() in used_words:
-                # Try to find alternative word
-                test_word = select_test_word(text, grade_level, used_words)
-                logger.warning(f"Sentence {i+1}: Duplicate testWord, selected '{test_word}' as alternative")
+        with self._lock:
+            self.made += 1
+        return path
 
-            used_words.add(test_word.lower())
+    def _source_width(self, source, stat_result):
+        """Return the width of the image at source, read once per mtime, or None if Pillow can't read it."""
+        with self._lock:
+            cached = self._widths.get(source)
+        if cached is not None and cached[0] == stat_result.st_mtime_ns:
+            return cached[1]
 
-            # For 4th grade, only mark every other sentence for testing
-            include_test = True
-            if grade_level == '4th':
-                include_test = (i % 2 == 0)  # Test even-indexed sentences (0, 2, 4, ...)
+        try:
+            with Image.open(source) as image:
+                width = image.width
+        except Exception as e:
+            logger.warning(f"Could not read image {source}: {e}")
+            width = None
+        with self._lock:
+            self._widths[source] = (stat_result.st_mtime_ns, width)
+        return width
 
-            processed_sentences.append({
-                'text': text,
-                'testWord': test_word if include_test else None
-            })
 
-        result = {
-            'title': story_data['title'],
-            'sentences': processed_sentences
-        }
+image_variants = ImageVariants(DIRECTORY, IMAGE_VARIANTS_DIR, IMAGE_VARIANT_WIDTHS)
 
-        logger.info(f"Successfully generated story: {result['title']} ({len(processed_sentences)} sentences)")
-        return result
 
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON parsing error: {e}")
-        logger.error(f"Response text: {response_text}")
-        raise ValueError(f"Invalid JSON response from AI: {str(e)}")
-    except Exception as e:
-        logger.error(f"Error generating story: {e}")
-        raise
+def send_static_asset(path):
+    """
+    Serve a file through the static asset cache.
+
+    Responses carry a strong ETag and "Cache-Control: no-cache", so browsers
+    keep their copy but revalidate it on every load and get a 304 unless the
+    file changed. A gzip or brotli variant is sent when the client accepts it;
+    otherwise Range requests get a 206 with the requested bytes.
+    Files the cache doesn't hold are sent from disk. Images are sent as a
+    smaller AVIF or WebP variant when the browser accepts one.
+    """
+    variant = image_variants.find(path, request.accept_mimetypes, request.args.get('w', type=int))
+    if variant is not None:
+        file_path, mimetype = variant
+        response = send_file(file_path, mimetype=mimetype, conditional=True)
+        response.cache_control.no_cache = True
+        response.vary.add('Accept')
+        return response
+
+    asset = static_assets.get(path)
+    if asset is None:
+        return send_from_directory(DIRECTORY, path)
+
+    encoding = None
+    if asset.variants:
+        # Prefer brotli when the client accepts both, it is the smaller one
+        offered = [encoding for encoding in ('br', 'gzip') if encoding in asset.variants]
+        encoding = request.accept_encodings.best_match(offered)
+    body = asset.variants[encoding] if encoding else asset.data
+
+    response = Response(body, mimetype=asset.mimetype)
+    response.set_etag(f"{asset.etag}-{encoding}" if encoding else asset.etag)
+    response.last_modified = asset.last_modified
+    response.cache_control.no_cache = True
+    if encoding:
+        response.content_encoding = encoding
+    if asset.variants:
+        response.vary.add('Accept-Encoding')
+    if image_variants.formats and path.startswith('images/'):
+        response.vary.add('Accept')
+    # Range requests (audio and image seeking) are answered for the identity
+    # body only; a range of a compressed variant isn't useful to a browser
+    if encoding:
+        return response.make_conditional(request)
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(body))
 
 
 # ============================================================================
@@ -273,14 +3852,14 @@ IMPORTANT:
 @app.route('/')
 def serve_index():
     """Serve the main index.html file."""
-    return send_from_directory(DIRECTORY, 'index.html')
+    return send_static_asset('index.html')
 
 
 @app.route('/<path:path>')
 def serve_static(path):
     """Serve static files (CSS, JS, images, etc.)."""
     try:
-        return send_from_directory(DIRECTORY, path)
+        return send_static_asset(path)
     except Exception as e:
         logger.error(f"Error serving {path}: {e}")
         return f"File not found: {path}", 404
@@ -290,6 +3869,45 @@ def serve_static(path):
 # Flask Routes - API Endpoints
 # ============================================================================
 
+def parse_story_request(data):
+    """
+    Validate a story request body.
+    Returns (grade_level, length, prompt, random_theme, fresh) or raises ValueError.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+
+    grade_level = data.get('gradeLevel')
+    length = data.get('length')
+    prompt = data.get('prompt', '')
+    random_theme = data.get('random', False)
+    fresh = bool(data.get('fresh', False))
+
+    if not grade_level or grade_level not in GRADE_CONFIGS:
+        raise ValueError(f'Invalid gradeLevel. Must be one of: {list(GRADE_CONFIGS.keys())}')
+
+    if not length or length not in ['tiny', 'short', 'medium']:
+        raise ValueError('Invalid length. Must be one of: tiny, short, medium')
+
+    if not isinstance(prompt, str):
+        raise ValueError('Prompt must be a string')
+
+    if not random_theme and not prompt.strip():
+        raise ValueError('Prompt is required when random is false')
+
+    return grade_level, length, prompt, random_theme, fresh
+
+
+def rate_limited_response(error):
+    """Return the 429 response for a StoryRateLimited error, with when to retry in seconds."""
+    retry_after = math.ceil(error.retry_after)
+    return jsonify({
+        'success': False,
+        'error': str(error),
+        'retryAfter': retry_after
+    }), 429, {'Retry-After': str(retry_after)}
+
+
 @app.route('/api/generate-story', methods=['POST'])
 def api_generate_story():
     """
@@ -300,9 +3918,14 @@ def api_generate_story():
         "gradeLevel": "2nd",
         "length": "short",
         "prompt": "space adventure with a brave astronaut",
-        "random": false
+        "random": false,
+        "fresh": false
     }
 
+    "fresh" is optional; set it to skip the story cache and get a new story.
+    A device that starts new stories faster than STORY_RATE_PER_MINUTE gets
+    a 429 with Retry-After and "retryAfter" (seconds) instead.
+
     Response:
     {
         "success": true,
@@ -313,40 +3936,23 @@ def api_generate_story():
     }
     """
     try:
-        data = request.get_json()
-
-        # Validate required fields
-        grade_level = data.get('gradeLevel')
-        length = data.get('length')
-        prompt = data.get('prompt', '')
-        random_theme = data.get('random', False)
-
-        if not grade_level or grade_level not in GRADE_CONFIGS:
-            return jsonify({
-                'success': False,
-                'error': f'Invalid gradeLevel. Must be one of: {list(GRADE_CONFIGS.keys())}'
-            }), 400
-
-        if not length or length not in ['tiny', 'short', 'medium']:
-            return jsonify({
-                'success': False,
-                'error': 'Invalid length. Must be one of: tiny, short, medium'
-            }), 400
-
-        if not random_theme and not prompt.strip():
-            return jsonify({
-                'success': False,
-                'error': 'Prompt is required when random is false'
-            }), 400
+        grade_level, length, prompt, random_theme, fresh = parse_story_request(request.get_json())
 
         # Generate the story
-        story = generate_story_with_claude(grade_level, length, prompt, random_theme)
+        story = get_story(grade_level, length, prompt, random_theme, fresh=fresh, device=request.remote_addr)
 
         return jsonify({
             'success': True,
-            'story': story
+            'story': story_with_audio(story)
         })
 
+    except StoryRateLimited as e:
+        return rate_limited_response(e)
+    except StoryServiceBusy as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 503, {'Retry-After': '5'}
     except ValueError as e:
         logger.error(f"Validation error: {e}")
         return jsonify({
@@ -361,13 +3967,258 @@ def api_generate_story():
         }), 500
 
 
+@app.route('/api/generate-story/stream', methods=['POST'])
+def api_generate_story_stream():
+    """
+    Generate a story and stream it back as newline-delimited JSON.
+
+    Takes the same request body as /api/generate-story. Each line is one event:
+        {"type": "title", "title": "The Space Explorer"}
+        {"type": "sentence", "index": 0, "sentence": {"text": "...", "testWord": "..."}}
+        {"type": "done", "story": {"title": "...", "sentences": [...]}}
+
+    If generation fails after the response has started, the last line is
+        {"type": "error", "error": "..."}
+    A device over its rate limit gets the same 429 as /api/generate-story,
+    and a request that finds the story workers full the same 503.
+    """
+    try:
+        grade_level, length, prompt, random_theme, fresh = parse_story_request(request.get_json())
+        events = stream_story(grade_level, length, prompt, random_theme, fresh=fresh, device=request.remote_addr)
+    except StoryRateLimited as e:
+        return rate_limited_response(e)
+    except StoryServiceBusy as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 503, {'Retry-After': '5'}
+    except ValueError as e:
+        logger.error(f"Validation error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    def generate():
+        try:
+            for event in events:
+                if event['type'] == 'sentence':
+                    event = {**event, 'sentence': speech.attach(event['sentence'])}
+                elif event['type'] == 'done':
+                    event = {**event, 'story': story_with_audio(event['story'])}
+                yield json.dumps(event) + '\n'
+        except (StoryServiceBusy, ValueError) as e:
+            logger.error(f"Validation error: {e}")
+            yield json.dumps({'type': 'error', 'error': str(e)}) + '\n'
+        except Exception as e:
+            logger.error(f"Unexpected error while streaming story: {e}")
+            yield json.dumps({'type': 'error', 'error': 'Internal server error. Please try again.'}) + '\n'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/api/stories', methods=['GET'])
+def api_list_stories():
+    """
+    List the stories generated in the house, newest first, as summaries
+    without sentences.
+
+    Query parameters (all optional): gradeLevel, length, q (searches titles
+    and themes), page (from 1) and pageSize (up to 100, default 20).
+    """
+    try:
+        page = int(request.args.get('page', 1))
+        page_size = int(request.args.get('pageSize', 20))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'page and pageSize must be numbers'
+        }), 400
+
+    stories, total = story_library.search(
+        grade_level=request.args.get('gradeLevel'),
+        length=request.args.get('length'),
+        query=request.args.get('q', '').strip(),
+        page=page,
+        page_size=page_size
+    )
+    return jsonify({
+        'success': True,
+        'stories': stories,
+        'total': total,
+        'page': max(1, page)
+    })
+
+
+@app.route('/api/stories/<story_id>', methods=['GET'])
+def api_get_story(story_id):
+    """Return one library story with its sentences."""
+    story = story_library.get(story_id)
+    if story is None:
+        return jsonify({
+            'success': False,
+            'error': 'Story not found'
+        }), 404
+    return jsonify({
+        'success': True,
+        'story': story_with_audio(story)
+    })
+
+
+@app.route('/api/audio/<key>.wav', methods=['GET'])
+def api_audio(key):
+    """
+    Serve a rendered sentence or spelling. Files never change, so they are
+    cached for a year, and range requests are answered for seeking.
+    """
+    path = speech.get(key)
+    if path is None:
+        return jsonify({
+            'success': False,
+            'error': 'Audio not found'
+        }), 404
+    response = send_file(path, mimetype='audio/wav', conditional=True, etag=key)
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 3600
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route('/api/story-batches', methods=['POST'])
+def api_create_story_batch():
+    """
+    Queue a batch of stories to generate in the background.
+
+    Expected JSON payload:
+    {
+        "stories": [
+            {"gradeLevel": "2nd", "length": "short", "prompt": "a dragon who bakes"},
+            {"gradeLevel": "2nd", "length": "short", "random": true}
+        ]
+    }
+
+    Returns 202 with the batch summary; poll /api/story-batches/<id> for results.
+    While STORY_BATCH_MAX_PENDING batches are unfinished, returns 503 instead.
+    """
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            raise ValueError('Request body must be a JSON object')
+        batch = story_batches.submit(data.get('stories'))
+        return jsonify({
+            'success': True,
+            'batch': batch
+        }), 202
+
+    except StoryServiceBusy as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 503, {'Retry-After': '60'}
+    except ValueError as e:
+        logger.error(f"Validation error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+
+@app.route('/api/story-batches', methods=['GET'])
+def api_list_story_batches():
+    """List story batches, newest first."""
+    return jsonify({
+        'success': True,
+        'batches': story_batches.list()
+    })
+
+
+@app.route('/api/story-batches/<batch_id>', methods=['GET'])
+def api_get_story_batch(batch_id):
+    """Return a batch's status and every story generated so far."""
+    batch = story_batches.get(batch_id)
+    if batch is None:
+        return jsonify({
+            'success': False,
+            'error': 'Batch not found'
+        }), 404
+    for item in batch['stories']:
+        if item['story']:
+            item['story'] = story_with_audio(item['story'])
+    return jsonify({
+        'success': True,
+        'batch': batch
+    })
+
+
+@app.route('/api/live-reload', methods=['GET'])
+def api_live_reload():
+    """Tell pages where to connect for live reload events."""
+    return jsonify({
+        'enabled': live_reload.running,
+        'port': live_reload.port
+    })
+
+
+# Component statistics, exported as gauges alongside the request metrics
+metrics.register(StatsGauges('story_cache', 'Story cache statistics.', story_cache.stats))
+metrics.register(StatsGauges('story_pool', 'Random story pool statistics.', story_pool.stats))
+metrics.register(StatsGauges('speech', 'Story speech rendering statistics.', speech.stats))
+metrics.register(StatsGauges('word_lists', 'Grade word list statistics.', word_levels.stats))
+metrics.register(StatsGauges('story_library', 'Story library statistics.', story_library.stats))
+metrics.register(StatsGauges('story_batches', 'Story batch statistics.', story_batches.stats))
+metrics.register(StatsGauges('story_coalescing', 'Request coalescing statistics.', story_generations.stats))
+metrics.register(StatsGauges('system_prompts', 'Story system prompt variants.', system_prompts.stats))
+metrics.register(StatsGauges('story_token_budget', 'Story max_tokens budgets.', story_token_budget.stats))
+metrics.register(StatsGauges('upstream_retry', 'Upstream retry and circuit breaker statistics.', upstream_policy.stats))
+metrics.register(StatsGauges('log_queue', 'Log queue statistics.', log_queue_handler.stats))
+metrics.register(StatsGauges('startup_seconds', 'Seconds from startup to each stage, and to load the Anthropic client.', lambda: startup_seconds))
+metrics.register(StatsGauges('upstream_http', 'Upstream connection pool settings and warmups.', upstream_http.stats))
+metrics.register(StatsGauges('static_assets', 'Static asset cache statistics.', static_assets.stats))
+metrics.register(StatsGauges('image_variants', 'Image variant statistics.', image_variants.stats))
+metrics.register(StatsGauges('story_worker_slots', 'Story worker slots.', story_workers.stats))
+metrics.register(StatsGauges('story_rate_limit', 'Per-device story rate limit statistics.', story_rate_limit.stats))
+metrics.register(StatsGauges('upstream_call_slots', 'Upstream call slots and queue.', upstream_calls.stats))
+
+
+@app.route('/metrics', methods=['GET'])
+def api_metrics():
+    """Request, story pipeline and component metrics in the Prometheus text format."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/api/health', methods=['GET'])
 def api_health():
     """Simple health check endpoint."""
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.utcnow().isoformat(),
-        'anthropic_configured': client is not None
+        'anthropic_configured': bool(anthropic_api_key),
+        'startup': dict(startup_seconds),
+        'story_cache': story_cache.stats(),
+        'story_pool': story_pool.stats(),
+        'coalescing': story_generations.stats(),
+        'batches': story_batches.stats(),
+        'library': story_library.stats(),
+        'word_lists': word_levels.stats(),
+        'speech': speech.stats(),
+        'upstream': upstream_policy.stats(),
+        'upstream_http': upstream_http.stats(),
+        'token_budget': story_token_budget.stats(),
+        'system_prompts': system_prompts.stats(),
+        'logging': log_queue_handler.stats(),
+        'static_assets': static_assets.stats(),
+        'image_variants': image_variants.stats(),
+        'live_reload': live_reload.stats(),
+        'concurrency': {
+            'story_workers': story_workers.stats(),
+            'story_rate_limit': story_rate_limit.stats(),
+            'upstream_calls': upstream_calls.stats()
+        }
     })
 
 
@@ -376,60 +4227,487 @@ def api_health():
 # ============================================================================
 
 class FileWatcher:
-    """Simple file watcher that checks for changes."""
+    """
+    Polling file watcher that checks the whole tree for changes.
+    Used where inotify is not available (Windows, macOS).
+    """
 
-    def __init__(self, directory, extensions=None):
+    def __init__(self, directory, extensions=None, ignored_dirs=None):
         self.directory = Path(directory)
-        self.extensions = extensions or ['.html', '.css', '.js']
-        self.last_modified = {}
-        self._scan_files()
+        self.extensions = tuple(extensions or ['.html', '.css', '.js'])
+        self.ignored_dirs = set(ignored_dirs or ())
+        self.last_modified = self._scan_files()
 
     def _scan_files(self):
-        """Scan all files and store their modification times."""
-        for ext in self.extensions:
-            for file_path in self.directory.glob(f"*{ext}"):
-                self.last_modified[file_path] = file_path.stat().st_mtime
+        """Return the modification time of every watched file, keyed by relative path."""
+        modified = {}
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            dirnames[:] = [d for d in dirnames if d not in self.ignored_dirs]
+            for filename in filenames:
+                if not filename.endswith(self.extensions):
+                    continue
+                file_path = Path(dirpath) / filename
+                try:
+                    modified[file_path.relative_to(self.directory).as_posix()] = file_path.stat().st_mtime
+                except OSError:
+                    pass  # Deleted between listing and stat
+        return modified
 
     def check_changes(self):
-        """Check if any files have been modified."""
-        changed_files = []
-        for ext in self.extensions:
-            for file_path in self.directory.glob(f"*{ext}"):
-                current_mtime = file_path.stat().st_mtime
-                if file_path not in self.last_modified or self.last_modified[file_path] != current_mtime:
-                    changed_files.append(file_path.name)
-                    self.last_modified[file_path] = current_mtime
+        """Return the relative paths of files added, modified or deleted since the last check."""
+        current = self._scan_files()
+        changed_files = {
+            path for path, mtime in current.items()
+            if self.last_modified.get(path) != mtime
+        }
+        changed_files.update(path for path in self.last_modified if path not in current)
+        self.last_modified = current
         return changed_files
 
+    def wait_for_changes(self, timeout=None):
+        """Block until files change (or timeout passes) and return the changed paths."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = WATCH_POLL_INTERVAL
+            if deadline is not None:
+                delay = min(delay, max(0.0, deadline - time.monotonic()))
+            time.sleep(delay)
+            changed = self.check_changes()
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+
+class InotifyWatcher:
+    """
+    Event-driven file watcher using Linux inotify.
+
+    Watches every directory in the tree (adding new directories as they
+    appear) and sleeps in the kernel until something changes, so it costs
+    no CPU while idle.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+
+    WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+                  IN_MOVED_TO | IN_CREATE | IN_DELETE)
+    EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+    def __init__(self, directory, extensions=None, ignored_dirs=None):
+        self.directory = Path(directory)
+        self.extensions = tuple(extensions or ['.html', '.css', '.js'])
+        self.ignored_dirs = set(ignored_dirs or ())
+        self._watches = {}  # watch descriptor -> directory path
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(self.IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1 failed: {os.strerror(errno)}")
+        self._add_tree(self.directory)
+
+    def wait_for_changes(self, timeout=None):
+        """Block until files change (or timeout passes) and return the changed paths."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        return self._read_events()
+
+    def _add_tree(self, root):
+        """Watch root and every directory below it. Returns the watched files found inside."""
+        found = set()
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if d not in self.ignored_dirs]
+            self._add_watch(Path(dirpath))
+            found.update(
+                (Path(dirpath) / filename).relative_to(self.directory).as_posix()
+                for filename in filenames if filename.endswith(self.extensions)
+            )
+        return found
+
+    def _add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(str(path)), self.WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            logger.warning(f"Cannot watch {path}: {os.strerror(errno)}")
+            return
+        self._watches[wd] = path
+
+    def _read_events(self):
+        """Read all pending events and return the watched files they touch."""
+        changed = set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, name_length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_length].rstrip(b'\0'))
+            offset += name_length
+
+            if mask & self.IN_Q_OVERFLOW:
+                logger.warning('File watcher event queue overflowed; some changes may be missed')
+                continue
+            if mask & self.IN_IGNORED:
+                self._watches.pop(wd, None)  # Directory was removed
+                continue
+
+            directory = self._watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = directory / name
+
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO) and name not in self.ignored_dirs:
+                    changed.update(self._add_tree(path))
+            elif name.endswith(self.extensions):
+                changed.add(path.relative_to(self.directory).as_posix())
+        return changed
+
+
+class FileChangeHub:
+    """Publishes batches of changed files to every subscriber."""
+
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """Call callback(paths) with a sorted list of relative paths after each change."""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def publish(self, paths):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(paths)
+            except Exception as e:
+                logger.error(f"File change subscriber failed: {e}")
+
+
+file_changes = FileChangeHub()
+
+
+def invalidate_static_assets(paths):
+    """Drop changed files from the static asset cache."""
+    for path in paths:
+        static_assets.invalidate(path)
+
+
+file_changes.subscribe(invalidate_static_assets)
+
+
+def unwatched_dirs():
+    """
+    Return WATCH_IGNORED_DIRS plus the directories the server writes to
+    itself (DATA_DIR and the log file's), so their writes don't wake the
+    file watcher. A log file at the top of the tree can't be left out,
+    since inotify watches whole directories; that is logged.
+    """
+    ignored = set(WATCH_IGNORED_DIRS)
+    for path in (DATA_DIR, os.path.dirname(os.path.abspath(LOG_FILE))):
+        relative = os.path.relpath(path, DIRECTORY)
+        if relative == '.':
+            logger.warning(f"{path} is the watched directory itself; every write to it wakes the file watcher")
+        elif not relative.startswith('..'):
+            ignored.add(Path(path).name)
+    return ignored
+
+
+def create_file_watcher():
+    """Use inotify where available and fall back to polling elsewhere."""
+    ignored_dirs = unwatched_dirs()
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(DIRECTORY, WATCH_EXTENSIONS, ignored_dirs)
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify unavailable ({e}) - falling back to polling")
+    return FileWatcher(DIRECTORY, WATCH_EXTENSIONS, ignored_dirs)
+
+
+def report_file_changes(paths):
+    """Print changed files to the console."""
+    print(f"\n🔄 File(s) changed: {', '.join(paths)}")
+    if live_reload.running:
+        print(f"   → Pushed to {live_reload.client_count} open page(s)\n")
+    else:
+        print("   → Refresh your browser to see updates\n")
+
+
+# ============================================================================
+# Live Reload
+# ============================================================================
+
+class LiveReloadServer:
+    """
+    Server-sent events endpoint that pushes file changes to open pages.
+
+    Runs one selector loop on its own port instead of inside the web
+    server, so an idle page costs a socket rather than a request worker
+    thread. Pages connect to GET /events and receive a "change" event with
+    the changed paths after every burst of edits.
+    """
+
+    KEEPALIVE_INTERVAL = 30  # seconds between comments that detect dead connections
+    MAX_REQUEST_BYTES = 8192
+    EVENTS_RESPONSE = (
+        b'HTTP/1.1 200 OK\r\n'
+        b'Content-Type: text/event-stream\r\n'
+        b'Cache-Control: no-cache\r\n'
+        b'Connection: keep-alive\r\n'
+        b'Access-Control-Allow-Origin: *\r\n'
+        b'\r\n'
+        b'retry: 2000\n\n'
+    )
+    NOT_FOUND_RESPONSE = b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+
+    def __init__(self, port):
+        self.port = port
+        self.running = False
+        self.events_sent = 0
+        self._selector = selectors.DefaultSelector()
+        self._clients = set()
+        self._pending = {}  # socket -> request bytes received so far
+        self._queued = []
+        self._lock = threading.Lock()
+        self._wake_reader, self._wake_writer = socket.socketpair()
+
+    @property
+    def client_count(self):
+        return len(self._clients)
+
+    def start(self):
+        """Bind the port and start the event loop thread."""
+        listener = socket.create_server(('0.0.0.0', self.port))
+        listener.setblocking(False)
+        self._wake_reader.setblocking(False)
+        self._selector.register(listener, selectors.EVENT_READ, self._accept)
+        self._selector.register(self._wake_reader, selectors.EVENT_READ, self._send_queued)
+
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+        self.running = True
+        logger.info(f"Live reload events on port {self.port}")
+
+    def broadcast(self, paths):
+        """Queue a change event for every connected page. Safe to call from any thread."""
+        if not self.running:
+            return
+        message = f"event: change\ndata: {json.dumps({'paths': paths})}\n\n".encode('utf-8')
+        with self._lock:
+            self._queued.append(message)
+        try:
+            self._wake_writer.send(b'\0')
+        except OSError:
+            pass  # Wakeup buffer full; the loop is already going to run
+
+    def stats(self):
+        """Return live reload statistics for the health endpoint."""
+        return {
+            'running': self.running,
+            'port': self.port,
+            'clients': self.client_count,
+            'events_sent': self.events_sent
+        }
+
+    def _run(self):
+        last_keepalive = time.monotonic()
+        while True:
+            for key, _ in self._selector.select(timeout=self.KEEPALIVE_INTERVAL):
+                key.data(key.fileobj)
+
+            if time.monotonic() - last_keepalive >= self.KEEPALIVE_INTERVAL:
+                for conn in list(self._clients):
+                    self._send(conn, b': keepalive\n\n')
+                last_keepalive = time.monotonic()
+
+    def _accept(self, listener):
+        try:
+            conn, _ = listener.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        self._pending[conn] = b''
+        self._selector.register(conn, selectors.EVENT_READ, self._read)
+
+    def _read(self, conn):
+        try:
+            data = conn.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+
+        if not data:
+            self._close(conn)  # Page closed or navigated away
+            return
+        if conn in self._clients:
+            return  # Subscribers have nothing more to say
+
+        request_bytes = self._pending[conn] + data
+        if b'\r\n\r\n' not in request_bytes:
+            if len(request_bytes) > self.MAX_REQUEST_BYTES:
+                self._close(conn)
+            else:
+                self._pending[conn] = request_bytes
+            return
+
+        del self._pending[conn]
+        request_line = request_bytes.split(b'\r\n', 1)[0].decode('latin-1').split()
+        if len(request_line) >= 2 and request_line[0] == 'GET' and request_line[1].split('?')[0] == '/events':
+            if self._send(conn, self.EVENTS_RESPONSE):
+                self._clients.add(conn)
+        else:
+            self._send(conn, self.NOT_FOUND_RESPONSE)
+            self._close(conn)
+
+    def _send_queued(self, wake_reader):
+        try:
+            while wake_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        with self._lock:
+            messages, self._queued = self._queued, []
+        for message in messages:
+            for conn in list(self._clients):
+                if self._send(conn, message):
+                    self.events_sent += 1
+
+    def _send(self, conn, data):
+        """Send without blocking, dropping clients that can't keep up."""
+        try:
+            sent = conn.send(data)
+        except OSError:
+            sent = -1
+        if sent != len(data):
+            self._close(conn)
+            return False
+        return True
+
+    def _close(self, conn):
+        self._clients.discard(conn)
+        self._pending.pop(conn, None)
+        try:
+            self._selector.unregister(conn)
+        except (KeyError, ValueError):
+            pass
+        conn.close()
+
+
+live_reload = LiveReloadServer(LIVE_RELOAD_PORT)
+metrics.register(StatsGauges('live_reload', 'Live reload statistics.', live_reload.stats))
+
 
 def watch_files():
-    """Background thread to watch for file changes."""
-    watcher = FileWatcher(DIRECTORY)
+    """Background thread to watch for file changes and publish them."""
+    watcher = create_file_watcher()
+    file_changes.subscribe(report_file_changes)
 
     print("\n👀 Watching for file changes...")
-    print("   Monitoring: HTML, CSS, and JS files")
+    print(f"   Monitoring: HTML, CSS, JS and image files ({type(watcher).__name__})")
     print("   (Changes will be detected automatically)\n")
 
     while True:
-        time.sleep(1)  # Check every second
-        changed = watcher.check_changes()
-        if changed:
-            print(f"\n🔄 File(s) changed: {', '.join(changed)}")
-            print("   → Refresh your browser to see updates\n")
+        changed = watcher.wait_for_changes()
+        if not changed:
+            continue
+
+        # Editors often save in several writes; report the burst once it settles
+        while True:
+            more = watcher.wait_for_changes(WATCH_DEBOUNCE)
+            if not more:
+                break
+            changed |= more
+
+        file_changes.publish(sorted(changed))
 
 
 def open_browser():
     """Open browser after a short delay."""
+    import webbrowser  # Only needed when running interactively
+
     time.sleep(1.5)
     print(f"\n🚀 Opening browser at http://localhost:{PORT}\n")
     webbrowser.open(f"http://localhost:{PORT}")
 
 
+def run_server(mode):
+    """
+    Run the web server in the given mode.
+
+    'production' serves with waitress using a fixed thread pool sized for
+    SERVER_THREADS static/health requests plus STORY_WORKERS story requests.
+    'dev' uses Flask's built-in server. Production falls back to dev mode if
+    waitress is not installed.
+    """
+    if mode == 'production':
+        try:
+            from waitress import create_server
+        except ImportError:
+            logger.warning('waitress is not installed - falling back to the Flask development server')
+        else:
+            threads = SERVER_THREADS + STORY_WORKERS
+            server = create_server(app, host='0.0.0.0', port=PORT, threads=threads, ident='family-dashboard')
+            log_ready(f"Serving with waitress on port {PORT} ({threads} threads)")
+            server.run()
+            return
+
+    # Disable Flask's default auto-reloader to use our custom file watcher
+    log_ready(f"Serving with the Flask development server on port {PORT}")
+    app.run(host='0.0.0.0', port=PORT, debug=False, use_reloader=False, threaded=True)
+
+
+def log_ready(message):
+    """Record and log how long startup took, once the port is about to accept requests."""
+    startup_seconds['ready'] = round(time.perf_counter() - STARTUP_BEGAN, 3)
+    logger.info(f"{message} - ready in {startup_seconds['ready']:.2f}s "
+                f"(imports done at {startup_seconds['imports']:.2f}s, setup at {startup_seconds['setup']:.2f}s)")
+
+
+startup_seconds['setup'] = round(time.perf_counter() - STARTUP_BEGAN, 3)
+
+
 # ============================================================================
 # Main Entry Point
 # ============================================================================
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Family Dashboard server')
+    parser.add_argument(
+        '--mode',
+        choices=['production', 'dev'],
+        default=SERVER_MODE,
+        help='production: waitress thread pool (default); dev: Flask development server'
+    )
+    parser.add_argument(
+        '--count-prompt-tokens',
+        action='store_true',
+        help='count the tokens of each story system prompt with the API (one free call each), print them and exit'
+    )
+    args = parser.parse_args()
+
+    if args.count_prompt_tokens:
+        print(f"{'variant':<14} {'model':<28} {'tokens':>7}")
+        for variant, (model, tokens) in system_prompts.count_tokens().items():
+            print(f"{variant:<14} {model:<28} {tokens:>7}")
+        sys.exit(0)
+
     # Change to the project directory
     os.chdir(DIRECTORY)
 
@@ -440,12 +4718,17 @@ if __name__ == '__main__':
     print(f"📂 Serving files from: {DIRECTORY}")
     print(f"🌐 Server running at: http://localhost:{PORT}")
     print(f"📖 Reading Game API: http://localhost:{PORT}/api/generate-story")
+    print(f"📡 Streaming API: http://localhost:{PORT}/api/generate-story/stream")
     print(f"💚 Health Check: http://localhost:{PORT}/api/health")
+    print(f"📈 Metrics: http://localhost:{PORT}/metrics")
+    print(f"⚙️  Mode: {args.mode} ({STORY_WORKERS} story workers, {UPSTREAM_CONCURRENCY} model calls at once)")
     print("=" * 60)
     print("\n💡 Features:")
     print("   • Static file serving (HTML, CSS, JS)")
     print("   • Story generation API (Anthropic Claude)")
-    print("   • File watching with auto-reload notifications")
+    print("   • Pre-generated random stories for instant \"Surprise Me!\"")
+    print("   • Batch story generation in the background")
+    print("   • File watching with live reload of open pages")
     print("=" * 60)
     print("\n💡 Tips:")
     print("   • Server will stay running until you close this window")
@@ -453,10 +4736,27 @@ if __name__ == '__main__':
     print("   • Press Ctrl+C to stop the server")
     print("=" * 60)
 
+    # Push file changes to open pages
+    if LIVE_RELOAD_PORT:
+        try:
+            live_reload.start()
+            file_changes.subscribe(live_reload.broadcast)
+        except OSError as e:
+            logger.warning(f"Live reload disabled - cannot listen on port {LIVE_RELOAD_PORT}: {e}")
+
     # Start file watcher in background thread
     watcher_thread = threading.Thread(target=watch_files, daemon=True)
     watcher_thread.start()
 
+    # Keep a few random stories ready so "Surprise Me!" answers instantly.
+    # These load the Anthropic client in the background.
+    if anthropic_api_key:
+        story_pool.start()
+        story_batches.start()
+        upstream_http.start()
+    speech.start()
+    image_variants.warm()
+
     # Open browser in background thread, but only when running interactively.
     # Under systemd the stdout is the journal (not a tty), so we skip this to
     # avoid spawning a browser tab on every (re)start of the service.
@@ -464,10 +4764,9 @@ if __name__ == '__main__':
         browser_thread = threading.Thread(target=open_browser, daemon=True)
         browser_thread.start()
 
-    # Start Flask server
+    # Start web server
     try:
-        # Disable Flask's default auto-reloader to use our custom file watcher
-        app.run(host='0.0.0.0', port=PORT, debug=False, use_reloader=False)
+        run_server(args.mode)
     except KeyboardInterrupt:
         print("\n\n👋 Server stopped. Goodbye!")
         sys.exit(0)
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the story concurrency and rate limits
+Checks that FairQueue hands freed slots to devices in turn, that slots
+are given back when the with block raises, and that DeviceRateLimit
+turns a spent device away with a 429 and Retry-After. Both story
+endpoints answer 503 before starting a response when the story workers
+are full, and new story batches get a 503 while too many are unfinished.
+
+Nothing is sent to the Anthropic API: the limited and busy requests are
+rejected before a story is generated. Run with python test_rate_limits.py
+or pytest.
+"""
+
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# The server reads its configuration when it is imported
+os.environ['ANTHROPIC_API_KEY'] = 'offline-test'
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='test-limits-'))
+os.environ['LIVE_RELOAD_PORT'] = '0'
+import server  # noqa: E402
+
+# Configuration
+WAIT_TIMEOUT = 5  # seconds a queued test call may wait for its turn
+STORY_REQUEST = {'gradeLevel': '2nd', 'length': 'tiny', 'prompt': 'a rate limited story', 'random': False, 'fresh': True}
+BATCH_REQUEST = {'stories': [{'gradeLevel': '2nd', 'length': 'tiny', 'random': True}]}
+
+
+def wait_until(condition, timeout=WAIT_TIMEOUT):
+    """Poll condition until it is true or timeout seconds have passed."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out waiting for the queue'
+        time.sleep(0.005)
+
+
+def queue_call(queue, device, label, order, raises=False):
+    """Start a thread that takes a slot in queue for device, records label, and leaves (raising if asked)."""
+    def call():
+        with server.generating_for(device):
+            try:
+                with queue.slot():
+                    order.append(label)
+                    if raises:
+                        raise RuntimeError('generation failed')
+            except RuntimeError:
+                pass
+
+    waiting = queue.stats()['waiting']
+    thread = threading.Thread(target=call, daemon=True)
+    thread.start()
+    wait_until(lambda: queue.stats()['waiting'] == waiting + 1)
+    return thread
+
+
+def hold_story_workers(stack):
+    """Take every story worker slot until stack is closed."""
+    for _ in range(server.story_workers.limit):
+        stack.enter_context(server.story_workers.slot())
+
+
+def test_fair_queue_takes_turns_between_devices():
+    queue = server.FairQueue('Test calls', 1, wait_timeout=WAIT_TIMEOUT)
+    order = []
+    threads = []
+    with queue.slot():
+        for device, label in (('a', 'a1'), ('a', 'a2'), ('a', 'a3'), ('b', 'b1'), (None, 'background1')):
+            threads.append(queue_call(queue, device, label, order))
+        assert queue.stats()['waiting_devices'] == 3
+    for thread in threads:
+        thread.join(WAIT_TIMEOUT)
+
+    assert order == ['a1', 'b1', 'background1', 'a2', 'a3'], order
+    stats = queue.stats()
+    assert (stats['in_use'], stats['waiting'], stats['waiting_devices'], stats['rejected']) == (0, 0, 0, 0)
+
+
+def test_fair_queue_rejects_after_the_wait_timeout():
+    queue = server.FairQueue('Test calls', 1, wait_timeout=0.05)
+    with queue.slot():
+        try:
+            with server.generating_for('a'), queue.slot():
+                raise AssertionError('the full queue gave out a second slot')
+        except server.StoryServiceBusy:
+            pass
+    stats = queue.stats()
+    assert (stats['in_use'], stats['waiting'], stats['waiting_devices'], stats['rejected']) == (0, 0, 0, 1)
+
+
+def test_fair_queue_releases_the_slot_when_the_block_raises():
+    queue = server.FairQueue('Test calls', 1, wait_timeout=WAIT_TIMEOUT)
+    order = []
+    try:
+        with queue.slot():
+            waiter = queue_call(queue, 'b', 'b1', order)
+            raise RuntimeError('generation failed')
+    except RuntimeError:
+        pass
+    waiter.join(WAIT_TIMEOUT)
+    assert order == ['b1'], 'the slot was not handed to the waiting call'
+
+    # A raising waiter passes the slot on too
+    with queue.slot():
+        threads = [queue_call(queue, 'a', 'a1', order, raises=True), queue_call(queue, 'b', 'b2', order)]
+    for thread in threads:
+        thread.join(WAIT_TIMEOUT)
+    assert order == ['b1', 'a1', 'b2'], order
+    assert queue.stats()['in_use'] == 0
+    with queue.slot():
+        assert queue.stats()['in_use'] == 1
+
+
+def test_concurrency_limit_releases_the_slot_when_the_block_raises():
+    limit = server.ConcurrencyLimit('Test workers', 1)
+    for _ in range(3):
+        try:
+            with limit.slot():
+                raise RuntimeError('generation failed')
+        except RuntimeError:
+            pass
+        assert limit.stats()['in_use'] == 0
+    with limit.slot():
+        assert limit.stats()['in_use'] == 1
+    assert limit.stats()['rejected'] == 0
+
+
+def test_rate_limit_allows_the_burst_then_says_when_to_retry():
+    limit = server.DeviceRateLimit(per_minute=6, burst=2)
+    limit.take('10.0.0.1')
+    limit.take('10.0.0.1')
+    try:
+        limit.take('10.0.0.1')
+    except server.StoryRateLimited as e:
+        assert 9 < e.retry_after <= 10, e.retry_after
+        assert 'try again in 10 seconds' in str(e)
+    else:
+        raise AssertionError('expected StoryRateLimited after the burst')
+
+    limit.take('10.0.0.2')  # Another device has its own bucket
+    stats = limit.stats()
+    assert (stats['allowed'], stats['limited'], stats['devices']) == (3, 1, 2)
+
+
+def test_rate_limit_of_zero_is_off():
+    limit = server.DeviceRateLimit(per_minute=0, burst=1)
+    for _ in range(10):
+        limit.take('10.0.0.1')
+    assert limit.stats()['limited'] == 0
+
+
+def test_spent_device_gets_429_with_retry_after():
+    original = server.story_rate_limit
+    server.story_rate_limit = server.DeviceRateLimit(per_minute=2, burst=1)
+    try:
+        server.story_rate_limit.take('10.0.0.3')  # Spend the burst without generating a story
+        client = server.app.test_client()
+        for path in ('/api/generate-story', '/api/generate-story/stream'):
+            response = client.post(path, json=STORY_REQUEST, environ_base={'REMOTE_ADDR': '10.0.0.3'})
+            assert response.status_code == 429, f'{path} returned {response.status_code}'
+            retry_after = int(response.headers['Retry-After'])
+            assert 1 <= retry_after <= 30, retry_after
+            body = response.get_json()
+            assert body['success'] is False
+            assert body['retryAfter'] == retry_after
+        assert server.story_rate_limit.stats()['limited'] == 2
+    finally:
+        server.story_rate_limit = original
+
+
+def test_full_story_workers_give_503_before_the_response_starts():
+    client = server.app.test_client()
+    with ExitStack() as stack:
+        hold_story_workers(stack)
+        for path in ('/api/generate-story', '/api/generate-story/stream'):
+            response = client.post(path, json=STORY_REQUEST, environ_base={'REMOTE_ADDR': '10.0.0.4'})
+            assert response.status_code == 503, f'{path} returned {response.status_code}'
+            assert response.headers['Retry-After'] == '5'
+            assert response.get_json()['success'] is False
+    assert server.story_workers.stats()['in_use'] == 0
+
+
+def test_busy_requests_do_not_spend_rate_limit_tokens():
+    original = server.story_rate_limit
+    server.story_rate_limit = server.DeviceRateLimit(per_minute=2, burst=1)
+    try:
+        client = server.app.test_client()
+        with ExitStack() as stack:
+            hold_story_workers(stack)
+            for path in ('/api/generate-story', '/api/generate-story/stream') * 2:
+                response = client.post(path, json=STORY_REQUEST, environ_base={'REMOTE_ADDR': '10.0.0.5'})
+                assert response.status_code == 503, f'{path} returned {response.status_code}'
+        stats = server.story_rate_limit.stats()
+        assert (stats['allowed'], stats['limited']) == (0, 0), stats
+        server.story_rate_limit.take('10.0.0.5')  # The burst is still there after the 503s
+    finally:
+        server.story_rate_limit = original
+
+
+def test_story_batches_are_capped_while_unfinished():
+    original = server.story_batches
+    # No workers are started, so every batch stays queued
+    server.story_batches = server.StoryBatchQueue(
+        os.path.join(tempfile.mkdtemp(prefix='test-batches-'), 'story-batches.json'),
+        workers=1, max_stories=5, max_jobs=10, max_pending=2
+    )
+    try:
+        client = server.app.test_client()
+        statuses = [client.post('/api/story-batches', json=BATCH_REQUEST).status_code for _ in range(4)]
+        assert statuses == [202, 202, 503, 503], statuses
+        response = client.post('/api/story-batches', json=BATCH_REQUEST)
+        assert response.headers['Retry-After'] == '60'
+        assert response.get_json()['success'] is False
+
+        stats = server.story_batches.stats()
+        assert (stats['batches'], stats['pending'], stats['queued'], stats['rejected']) == (2, 2, 2, 3), stats
+
+        # A finished batch makes room for another
+        for item in next(iter(server.story_batches._jobs.values()))['items']:
+            item['status'] = 'done'
+        assert client.post('/api/story-batches', json=BATCH_REQUEST).status_code == 202
+    finally:
+        server.story_batches = original
+
+
+def main():
+    """Run all tests."""
+    tests = [(name, test) for name, test in globals().items() if name.startswith('test_')]
+    failed = 0
+    for name, test in tests:
+        try:
+            test()
+            print(f"✓ PASS: {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ FAIL: {name}: {e}")
+
+    print(f"\nTotal: {len(tests) - failed}/{len(tests)} tests passed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
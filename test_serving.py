@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for serving under story load
+Saturates the server with story requests, many of them identical, and
+checks that static files and the health check still answer promptly.
+
+Runs the server in-process against fake_anthropic.py, so nothing is sent
+to the Anthropic API. Run with python test_serving.py or pytest.
+"""
+
+import argparse
+import io
+import sys
+import threading
+import time
+
+import bench_api
+import fake_anthropic
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# Configuration
+LOAD_SECONDS = 4
+STATIC_DEADLINE = 0.5  # seconds a static or health request may take under load
+STATIC_PATHS = ['/', '/api/health']
+
+
+def start_server():
+    """Start the fake API and the server in this process. Returns (base_url, server module)."""
+    parser = argparse.ArgumentParser()
+    fake_anthropic.add_backend_arguments(parser)
+    args = parser.parse_args(['--latency', '1.0', '--tokens-per-second', '0'])
+    base_url, _ = bench_api.start_offline_server(args)
+
+    import server
+    server._client = None  # Built again against this fake API if another test made one
+    return base_url, server
+
+
+def story_client(base_url, payload, deadline, statuses):
+    """Request the same story body back to back until the deadline."""
+    while time.perf_counter() < deadline:
+        status, _ = bench_api.timed_request(f'{base_url}/api/generate-story', payload)
+        statuses.append(status)
+
+
+def saturate_stories(base_url, server):
+    """Fill the story workers from many clients and check static requests meanwhile."""
+    clients = 2 * (server.SERVER_THREADS + server.STORY_WORKERS)
+    deadline = time.perf_counter() + LOAD_SECONDS
+    statuses = []
+
+    # Half the clients ask for one identical story, so most of them coalesce
+    threads = []
+    for number in range(clients):
+        prompt = 'the same story for everyone' if number % 2 else f'story number {number}'
+        payload = {'gradeLevel': '2nd', 'length': 'tiny', 'prompt': prompt, 'random': False, 'fresh': True}
+        thread = threading.Thread(target=story_client, args=(base_url, payload, deadline, statuses), daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    time.sleep(0.5)
+    slowest = 0.0
+    while time.perf_counter() < deadline - 0.5:
+        for path in STATIC_PATHS:
+            status, seconds = bench_api.timed_request(f'{base_url}{path}')
+            assert status == 200, f'{path} returned {status} under story load'
+            slowest = max(slowest, seconds)
+        time.sleep(0.05)
+
+    for thread in threads:
+        thread.join()
+
+    assert slowest < STATIC_DEADLINE, f'a static request took {slowest:.2f}s under story load'
+    assert set(statuses) <= {200, 503}, f'unexpected story statuses: {sorted(set(statuses))}'
+    assert 503 in statuses, 'the story load never filled the story workers'
+
+
+def test_static_routes_answer_while_stories_saturate():
+    base_url, server = start_server()
+    # Every client here has the same address; start_offline_server only turns
+    # the rate limit off if the server wasn't imported by another test first
+    original = server.story_rate_limit
+    server.story_rate_limit = server.DeviceRateLimit(0, server.STORY_RATE_BURST)
+    try:
+        saturate_stories(base_url, server)
+    finally:
+        server.story_rate_limit = original
+
+
+def main():
+    """Run all tests."""
+    tests = [(name, test) for name, test in globals().items() if name.startswith('test_')]
+    failed = 0
+    for name, test in tests:
+        try:
+            test()
+            print(f"✓ PASS: {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ FAIL: {name}: {e}")
+
+    print(f"\nTotal: {len(tests) - failed}/{len(tests)} tests passed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for story reply parsing
+Covers StoryStreamParser, find_json_object and parse_story_reply on the
+replies models actually send: split chunks, escaped quotes and braces in
+sentences, code fences and prose around the JSON, and replies cut off
+at max_tokens.
+
+Nothing is sent to the Anthropic API. Run with python test_story_parser.py
+or pytest.
+"""
+
+import io
+import json
+import os
+import sys
+import tempfile
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# The server reads its configuration when it is imported
+os.environ['ANTHROPIC_API_KEY'] = 'offline-test'
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='test-parser-'))
+os.environ['LIVE_RELOAD_PORT'] = '0'
+import server  # noqa: E402
+
+SENTENCES = [
+    {'text': 'Maya found a map.', 'testWord': 'map'},
+    {'text': '"Look!" said Maya, "a \\"secret\\" door {maybe}."', 'testWord': 'door'},
+    {'text': 'The path went left, then right}.', 'testWord': 'path'},
+    {'text': 'A back\\slash sign pointed home.', 'testWord': 'sign'},
+]
+STORY = {'title': 'The "Hidden" Door', 'sentences': SENTENCES}
+REPLY = json.dumps(STORY, indent=2)
+
+
+def feed_in_chunks(text, size):
+    """Feed text to a new StoryStreamParser size characters at a time. Returns (parser, sentences)."""
+    parser = server.StoryStreamParser()
+    sentences = []
+    for start in range(0, len(text), size):
+        sentences.extend(parser.feed(text[start:start + size]))
+    return parser, sentences
+
+
+def test_stream_parser_gives_the_same_story_for_any_chunk_size():
+    for size in (1, 2, 3, 7, 64, len(REPLY)):
+        parser, sentences = feed_in_chunks(REPLY, size)
+        assert parser.title == STORY['title'], f'chunk size {size}'
+        assert sentences == SENTENCES, f'chunk size {size}'
+        assert parser.finished
+
+
+def test_stream_parser_returns_each_sentence_once_it_is_complete():
+    parser = server.StoryStreamParser()
+    first_end = REPLY.index('}') + 1
+    assert parser.feed(REPLY[:first_end - 1]) == []
+    assert parser.title == STORY['title'], 'the title is known before any sentence'
+    assert parser.feed(REPLY[first_end - 1:first_end]) == [SENTENCES[0]]
+
+
+def test_stream_parser_title_split_inside_an_escape():
+    reply = '{"title": "A \\"Big\\" Day", "sentences": []}'
+    escape = reply.index('\\')
+    parser = server.StoryStreamParser()
+    parser.feed(reply[:escape + 1])
+    assert parser.title is None
+    parser.feed(reply[escape + 1:])
+    assert parser.title == 'A "Big" Day'
+
+
+def test_stream_parser_ignores_text_after_the_array():
+    parser, sentences = feed_in_chunks(REPLY + '\n```\nI hope you like it! {"text": "not a sentence"}', 5)
+    assert sentences == SENTENCES
+
+
+def test_stream_parser_skips_a_malformed_sentence():
+    reply = '{"title": "T", "sentences": [{"text": "One."}, {"text": bad}, {"text": "Three."}]}'
+    _, sentences = feed_in_chunks(reply, 4)
+    assert [s['text'] for s in sentences] == ['One.', 'Three.']
+
+
+def test_find_json_object_skips_prose_and_other_objects():
+    text = 'Here is {one} idea: {"note": 1}. And the story:\n' + REPLY + '\nThe end {really}.'
+    assert server.find_json_object(text, 'sentences') == STORY
+
+
+def test_find_json_object_returns_none_without_a_story():
+    assert server.find_json_object('no JSON here {at all', 'sentences') is None
+    assert server.find_json_object('{"title": "T", "sentences": "not a list"}', 'sentences') is None
+
+
+def test_parse_story_reply_with_code_fences_and_trailing_prose():
+    reply = 'Sure! Here you go:\n```json\n' + REPLY + '\n```\nLet me know if you want another.'
+    title, sentences, complete = server.parse_story_reply(reply)
+    assert title == STORY['title']
+    assert sentences == SENTENCES
+    assert complete
+
+
+def test_parse_story_reply_salvages_a_truncated_array():
+    cut = REPLY.index(SENTENCES[2]['testWord']) + 2  # Inside the third sentence
+    title, sentences, complete = server.parse_story_reply('```json\n' + REPLY[:cut])
+    assert title == STORY['title']
+    assert sentences == SENTENCES[:2]
+    assert not complete
+
+
+def test_parse_story_reply_cleans_sentences():
+    reply = json.dumps({'title': '  T  ', 'sentences': [
+        {'text': '  Padded.  ', 'testWord': 'Padded'},
+        {'text': 'No test word.'},
+        {'text': 'Odd test word.', 'testWord': 7},
+        {'text': '   '},
+        'not an object',
+    ]})
+    title, sentences, complete = server.parse_story_reply(reply)
+    assert title == 'T'
+    assert sentences == [
+        {'text': 'Padded.', 'testWord': 'Padded'},
+        {'text': 'No test word.', 'testWord': ''},
+        {'text': 'Odd test word.', 'testWord': ''},
+    ]
+    assert complete
+
+
+def test_parse_story_reply_rejects_replies_without_a_story():
+    for reply in ('I cannot write that story.', '{"sentences": [{"text": "No title."}]}',
+                  '{"title": "T", "sentences": []}', '{"title": "T", "sent'):
+        try:
+            server.parse_story_reply(reply)
+        except ValueError:
+            continue
+        raise AssertionError(f'expected ValueError for {reply!r}')
+
+
+def main():
+    """Run all tests."""
+    tests = [(name, test) for name, test in globals().items() if name.startswith('test_')]
+    failed = 0
+    for name, test in tests:
+        try:
+            test()
+            print(f"✓ PASS: {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ FAIL: {name}: {e}")
+
+    print(f"\nTotal: {len(tests) - failed}/{len(tests)} tests passed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
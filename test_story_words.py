@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for test word selection
+Covers StoryWordIndex and choose_test_words: the model's test words are
+kept when they are in their sentence, hyphenated and possessive words
+included, and replaced with unused words of the sentence when they are
+missing or repeated, across all the batches a story arrives in. The
+words the index splits for scoring match score_sentence's own.
+
+Nothing is sent to the Anthropic API. Run with python test_story_words.py
+or pytest.
+"""
+
+import io
+import os
+import sys
+import tempfile
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# The server reads its configuration when it is imported
+os.environ['ANTHROPIC_API_KEY'] = 'offline-test'
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='test-words-'))
+os.environ['LIVE_RELOAD_PORT'] = '0'
+import server  # noqa: E402
+
+GRADE_LEVEL = '2nd'
+
+
+def choose(*batches):
+    """Return the test words chosen for batches of sentences given as (text, testWord) pairs, in one story."""
+    index = server.StoryWordIndex(GRADE_LEVEL)
+    test_words = []
+    for batch in batches:
+        sentences = [{'text': text, 'testWord': test_word} for text, test_word in batch]
+        start = len(index)
+        index.add([sentence['text'] for sentence in sentences])
+        test_words.extend(server.choose_test_words(index, sentences, start))
+    return test_words
+
+
+def test_hyphenated_test_words_are_kept_whole_or_split():
+    test_words = choose([
+        ('We ate ice-cream at the beach.', 'ice-cream'),
+        ('The ice-cream truck played a song.', 'truck'),
+        ('Then a cream-colored kite flew by.', 'cream'),
+        ('"Look, a well-known pirate!" said Maya.', 'Well-Known'),
+    ])
+    assert test_words == ['ice-cream', 'truck', 'cream', 'Well-Known'], test_words
+
+
+def test_hyphenated_words_are_not_kept_in_part_across_words():
+    # "ice cream" written apart is not the hyphenated word
+    assert choose([('We ate ice cream at the beach.', 'ice-cream')]) != ['ice-cream']
+    assert choose([('We ate ice-cream at the beach.', 'e-cream')]) != ['e-cream']
+
+
+def test_possessives_count_as_their_word():
+    test_words = choose([("The dragon's wings were huge.", 'dragon'), ("It didn't fly away.", "didn't")])
+    assert test_words[0] == 'dragon', test_words
+    assert test_words[1] != "didn't", test_words  # Contractions are never test words
+
+
+def test_missing_and_repeated_words_are_replaced_with_unused_words():
+    sentences = [
+        ('The castle stood on a hill.', 'castle'),
+        ('Maya walked to the castle gate.', 'castle'),
+        ('A rabbit hopped past the garden.', 'zebra'),
+        ('The garden was full of flowers.', ''),
+    ]
+    test_words = choose(sentences)
+    assert test_words[0] == 'castle', test_words
+    lowered = [word.lower() for word in test_words]
+    assert len(set(lowered)) == len(lowered), test_words
+    for (text, _), word in zip(sentences, test_words):
+        assert word and word in text, (word, text)
+
+
+def test_replacements_leave_later_model_words_alone():
+    test_words = choose([('The forest was quiet.', 'moon'), ('The forest was dark.', 'forest')])
+    assert test_words[1] == 'forest', test_words
+    assert test_words[0] != 'forest', test_words
+
+
+def test_used_words_carry_across_batches():
+    # Streamed stories arrive one sentence at a time
+    test_words = choose([('The rocket was ready.', 'rocket')], [('Maya climbed into the rocket.', 'rocket')])
+    assert test_words[0] == 'rocket', test_words
+    assert test_words[1].lower() != 'rocket', test_words
+    assert test_words[1] in 'Maya climbed into the rocket.', test_words
+
+
+def test_index_words_match_score_sentence():
+    texts = ["\"Don't touch the dragon's 'golden' egg!\" said Mr. Fox.", 'The ice-cream—melted; 3 times!', '']
+    index = server.StoryWordIndex(GRADE_LEVEL)
+    index.add(texts)
+    for position, text in enumerate(texts):
+        words = index.words(position)
+        assert words == server.QUOTE_PATTERN.sub(' ', text.translate(server.WORD_BREAKS)).lower().split(), words
+        assert server.score_sentence(text, None, GRADE_LEVEL, words) == server.score_sentence(text, None, GRADE_LEVEL)
+
+
+def main():
+    """Run all tests."""
+    tests = [(name, test) for name, test in globals().items() if name.startswith('test_')]
+    failed = 0
+    for name, test in tests:
+        try:
+            test()
+            print(f"✓ PASS: {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ FAIL: {name}: {e}")
+
+    print(f"\nTotal: {len(tests) - failed}/{len(tests)} tests passed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
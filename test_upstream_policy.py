@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the upstream retry policy and circuit breaker
+Drives CircuitBreaker and UpstreamPolicy through open, half-open and
+closed against fake_anthropic.py, and checks the bounds of the jittered
+backoff between retries. A story request's wait for a call slot and its
+model calls keep to one deadline, however slow the API is.
+
+Nothing is sent to the Anthropic API. Run with python test_upstream_policy.py
+or pytest.
+"""
+
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+
+import fake_anthropic
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# The server reads its configuration when it is imported
+os.environ['ANTHROPIC_API_KEY'] = 'offline-test'
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='test-upstream-'))
+os.environ['LIVE_RELOAD_PORT'] = '0'
+import server  # noqa: E402
+
+# Configuration
+RESET_TIMEOUT = 0.3  # seconds the test breakers stay open
+STORY_DEADLINE = 4.0  # seconds a test story request gets for its model calls
+SLOT_HELD = 1.5  # seconds the test story request waits for a call slot
+_backend = None
+
+
+def fake_api(error_rate=0.0, error_status=500):
+    """Return the fake API, started on first use, answering with error_status at error_rate."""
+    global _backend
+    if _backend is None:
+        _backend = fake_anthropic.FakeAnthropicServer(latency=0, tokens_per_second=0).start()
+        os.environ['ANTHROPIC_BASE_URL'] = _backend.url
+        server._client = None  # Built again against the fake API
+    _backend.error_rate = error_rate
+    _backend.error_status = error_status
+    return _backend
+
+
+def requests_sent():
+    return _backend.stats()['requests']
+
+
+def call_api(timeout):
+    """One small messages call, as the story code makes them."""
+    return server.get_client().messages.create(
+        model='claude-haiku-4-5-20251001',
+        max_tokens=16,
+        messages=[{'role': 'user', 'content': 'Hi'}],
+        timeout=timeout
+    )
+
+
+def make_policy(failure_threshold=3, max_attempts=1, backoff_base=0.01, backoff_max=0.02):
+    breaker = server.CircuitBreaker(failure_threshold, RESET_TIMEOUT)
+    policy = server.UpstreamPolicy(breaker, max_attempts=max_attempts, attempt_timeout=5, total_deadline=20,
+                                   backoff_base=backoff_base, backoff_max=backoff_max)
+    return breaker, policy
+
+
+def call_expecting_unavailable(policy):
+    try:
+        policy.call(call_api)
+    except server.UpstreamUnavailable:
+        return
+    raise AssertionError('expected UpstreamUnavailable')
+
+
+def test_breaker_opens_after_threshold_and_fails_fast():
+    fake_api(error_rate=1.0)
+    breaker, policy = make_policy(failure_threshold=3)
+
+    for _ in range(3):
+        call_expecting_unavailable(policy)
+    assert breaker.state == 'open'
+
+    sent = requests_sent()
+    call_expecting_unavailable(policy)
+    assert requests_sent() == sent, 'an open breaker should not call the API'
+    assert policy.stats()['short_circuited'] == 1
+
+
+def test_half_open_trial_success_closes_breaker():
+    fake_api(error_rate=1.0)
+    breaker, policy = make_policy(failure_threshold=1)
+    call_expecting_unavailable(policy)
+    assert breaker.state == 'open'
+
+    time.sleep(RESET_TIMEOUT)
+    fake_api(error_rate=0.0)
+    message = policy.call(call_api)
+    assert message.content[0].text
+    assert breaker.state == 'closed'
+    assert breaker.consecutive_failures == 0
+
+
+def test_half_open_lets_one_trial_through_and_failure_reopens():
+    fake_api(error_rate=1.0)
+    breaker, policy = make_policy(failure_threshold=1)
+    call_expecting_unavailable(policy)
+
+    time.sleep(RESET_TIMEOUT)
+    assert breaker.allow_request(), 'the first call after reset_timeout is the trial'
+    assert breaker.state == 'half-open'
+    assert not breaker.allow_request(), 'only one trial at a time'
+
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert breaker.times_opened == 2
+    assert not breaker.allow_request()
+
+
+def test_retries_until_success():
+    fake_api(error_rate=1.0)
+    breaker, policy = make_policy(failure_threshold=5, max_attempts=3)
+    attempts = []
+
+    def flaky(timeout):
+        attempts.append(time.monotonic())
+        if len(attempts) == 3:
+            fake_api(error_rate=0.0)
+        return call_api(timeout)
+
+    policy.call(flaky)
+    assert len(attempts) == 3
+    assert policy.stats()['retries'] == 2
+    assert breaker.state == 'closed'
+
+
+def test_non_retryable_error_is_raised_without_retry():
+    fake_api(error_rate=1.0, error_status=400)
+    breaker, policy = make_policy(failure_threshold=1, max_attempts=3)
+    sent = requests_sent()
+    try:
+        policy.call(call_api)
+    except server.UpstreamUnavailable:
+        raise AssertionError('a 400 is not an outage')
+    except Exception as e:
+        assert getattr(e, 'status_code', None) == 400
+    else:
+        raise AssertionError('expected the 400 to be raised')
+    assert requests_sent() == sent + 1
+    assert breaker.state == 'closed'
+
+
+def test_backoff_stays_within_jitter_bounds():
+    _, policy = make_policy(backoff_base=0.5, backoff_max=4)
+    error = RuntimeError('no response attached')
+    for attempt in range(1, 8):
+        ceiling = min(4, 0.5 * 2 ** (attempt - 1))
+        delays = [policy._backoff(attempt, error) for _ in range(500)]
+        assert all(0 <= delay <= ceiling for delay in delays), f'attempt {attempt} outside [0, {ceiling}]'
+        # Full jitter spreads the delays over the whole range
+        assert min(delays) < ceiling * 0.2 and max(delays) > ceiling * 0.8
+
+
+def test_backoff_honours_retry_after():
+    fake_api(error_rate=1.0, error_status=529)  # The fake API sends retry-after: 1 with these
+    _, policy = make_policy(backoff_base=0.01, backoff_max=0.02)
+    try:
+        call_api(5)
+    except Exception as e:
+        assert policy._backoff(1, e) >= 1.0
+    else:
+        raise AssertionError('expected the injected 529')
+
+
+def test_call_is_not_started_without_time_left():
+    fake_api()
+    _, policy = make_policy()
+    sent = requests_sent()
+    with server.generating_for('10.0.0.8', time.monotonic() + policy.MIN_ATTEMPT_TIME / 2):
+        call_expecting_unavailable(policy)
+    assert requests_sent() == sent
+    stats = policy.stats()
+    assert (stats['attempts'], stats['out_of_time']) == (0, 1), stats
+
+
+def test_story_request_keeps_to_one_deadline_while_queued_and_slow():
+    backend = fake_api()
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold_upstream_calls():
+        with ExitStack() as stack:
+            for _ in range(server.upstream_calls.limit):
+                stack.enter_context(server.upstream_calls.slot())
+            held.set()
+            release.wait(SLOT_HELD)
+
+    original = server.UPSTREAM_TOTAL_DEADLINE
+    server.UPSTREAM_TOTAL_DEADLINE = STORY_DEADLINE
+    backend.latency = 3 * STORY_DEADLINE  # Slower than the whole budget
+    holder = threading.Thread(target=hold_upstream_calls, daemon=True)
+    try:
+        holder.start()
+        assert held.wait(5), 'could not take the call slots'
+        started = time.monotonic()
+        try:
+            server.get_story('2nd', 'tiny', 'a story for a slow API', False, fresh=True, device='10.0.0.9')
+        except server.UpstreamUnavailable:
+            pass
+        elapsed = time.monotonic() - started
+    finally:
+        release.set()
+        holder.join(5)
+        backend.latency = 0
+        server.UPSTREAM_TOTAL_DEADLINE = original
+
+    # The queue wait counts against the deadline instead of coming before it
+    assert SLOT_HELD < elapsed < STORY_DEADLINE + 0.5, f'took {elapsed:.1f}s'
+    assert server.upstream_calls.stats()['in_use'] == 0
+
+
+def main():
+    """Run all tests."""
+    tests = [(name, test) for name, test in globals().items() if name.startswith('test_')]
+    failed = 0
+    for name, test in tests:
+        try:
+            test()
+            print(f"✓ PASS: {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ FAIL: {name}: {e}")
+
+    print(f"\nTotal: {len(tests) - failed}/{len(tests)} tests passed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()